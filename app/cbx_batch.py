@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+"""Batch marking. Reads mark records (uid, state, statement) from CSV or JSON lines streams and writes the controls as CSV."""
+
+import csv
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+# A single mark: uid, state, statement
+MarkRecord = Tuple[str, str, str]
+
+# A skipped row of a mark file: line number, reason
+RecordError = Tuple[int, str]
+
+# Columns of the exported CSV files. uid, state and statement are read back, the others are for the people filling them out
+CSV_COLUMNS = ("uid", "section", "group", "item", "description", "cwe", "nist", "state", "statement")
+
+# Output formats of the control list. tsv and csv use CSV_COLUMNS, jsonl the control records
+LIST_FORMATS = ("text", "tsv", "jsonl", "csv")
+
+# Characters that would break a TSV line and their escapes. The backslash comes first
+TSV_ESCAPES = (("\\", "\\\\"), ("\t", "\\t"), ("\n", "\\n"), ("\r", "\\r"))
+
+
+class CbxMarkResult():
+    """Summary of a batch of marks."""
+
+    def __init__(self) -> None:
+        """Create an empty summary."""
+        self.applied: int = 0
+        self.unknown_uids: List[str] = []
+        self.invalid_states: List[MarkRecord] = []
+        # Only used by merges: records equal to the current state and the changes as uid, old state, new state
+        self.unchanged: int = 0
+        self.changes: List[Tuple[str, str, str]] = []
+        # Malformed rows of the input, skipped by the readers
+        self.errors: List[RecordError] = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the summary as dict.
+
+        :returns: The summary with applied, unknown_uids, invalid_states, unchanged, changes and errors
+        """
+        return {"applied": self.applied,
+                "unknown_uids": self.unknown_uids,
+                "invalid_states": [list(record) for record in self.invalid_states],
+                "unchanged": self.unchanged,
+                "changes": [list(change) for change in self.changes],
+                "errors": [list(error) for error in self.errors]}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CbxMarkResult":
+        """Create a summary from a dict created by to_dict.
+
+        :param data: The summary as dict
+        :returns: The summary
+        """
+        res = cls()
+        res.applied = int(data["applied"])
+        res.unknown_uids = list(data["unknown_uids"])
+        res.invalid_states = [(str(uid), str(state), str(statement)) for uid, state, statement in data["invalid_states"]]
+        res.unchanged = int(data.get("unchanged", 0))
+        res.changes = [(str(uid), str(old), str(new)) for uid, old, new in data.get("changes", [])]
+        res.errors = [(int(line), str(message)) for line, message in data.get("errors", [])]
+        return res
+
+    def print_summary(self) -> None:
+        """Print the summary."""
+        print(f"Applied: {self.applied}")
+        print(f"Unknown UIDs: {len(self.unknown_uids)}")
+        for uid in self.unknown_uids:
+            print(f"    {uid}")
+        print(f"Invalid states: {len(self.invalid_states)}")
+        for uid, state, _ in self.invalid_states:
+            print(f"    {uid}: {state}")
+        if self.unchanged or self.changes:
+            print(f"Unchanged: {self.unchanged}")
+        if self.errors:
+            print(f"Malformed rows: {len(self.errors)}")
+            for line, message in self.errors:
+                print(f"    line {line}: {message}")
+
+    def print_diff(self) -> None:
+        """Print the changes of a merge."""
+        for uid, old, new in self.changes:
+            if old == new:
+                print(f"    {uid}: statement of {new} changed")
+            else:
+                print(f"    {uid}: {old} -> {new}")
+
+
+def read_csv_records(fh: TextIO, errors: Optional[List[RecordError]] = None) -> Iterator[MarkRecord]:
+    """Read mark records from a CSV file with a header line containing uid, state and optionally statement.
+
+    Malformed rows are skipped.
+
+    :param fh: The file handle to read from
+    :param errors: Gets the line number and reason of every skipped row
+    :returns: A generator of mark records
+    """
+    if errors is None:
+        errors = []
+    reader = csv.DictReader(fh)
+    try:
+        missing = [column for column in ("uid", "state") if column not in (reader.fieldnames or [])]
+    except csv.Error as e:
+        errors.append((reader.line_num, str(e)))
+        return
+    if missing:
+        errors.append((reader.line_num, f"Missing column {', '.join(missing)}"))
+        return
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            errors.append((reader.line_num, str(e)))
+            continue
+        if row["uid"] is None or row["state"] is None:
+            errors.append((reader.line_num, "Missing uid or state"))
+            continue
+        yield (row["uid"].strip(), row["state"].strip(), row.get("statement") or "")
+
+
+def read_jsonl_records(fh: TextIO, errors: Optional[List[RecordError]] = None) -> Iterator[MarkRecord]:
+    """Read mark records from JSON lines. Every line is an object with uid, state and optionally statement.
+
+    Malformed lines are skipped.
+
+    :param fh: The file handle to read from
+    :param errors: Gets the line number and reason of every skipped line
+    :returns: A generator of mark records
+    """
+    if errors is None:
+        errors = []
+    for line_number, line in enumerate(fh, 1):
+        if line.strip():
+            try:
+                data = json.loads(line)
+            except ValueError as e:
+                errors.append((line_number, f"Invalid JSON: {e}"))
+                continue
+            if not isinstance(data, dict) or "uid" not in data or "state" not in data:
+                errors.append((line_number, "Not an object with uid and state"))
+                continue
+            yield (str(data["uid"]), str(data["state"]), str(data.get("statement") or ""))
+
+
+def read_mark_records(fh: TextIO, file_format: str, errors: Optional[List[RecordError]] = None) -> Iterator[MarkRecord]:
+    """Read mark records in the given format. Malformed rows are skipped.
+
+    :param fh: The file handle to read from
+    :param file_format: csv or jsonl
+    :param errors: Gets the line number and reason of every skipped row, see CbxMarkResult.errors
+    :returns: A generator of mark records
+    """
+    if file_format == "csv":
+        return read_csv_records(fh, errors)
+    if file_format == "jsonl":
+        return read_jsonl_records(fh, errors)
+    raise ValueError(f"Unknown format {file_format}. Available formats: csv, jsonl")
+
+
+def guess_format(filename: str, default: str = "jsonl") -> str:
+    """Guess the record format from the file name.
+
+    :param filename: The name of the file
+    :param default: The format to use if the extension is not known
+    :returns: csv or jsonl
+    """
+    if filename.endswith(".csv"):
+        return "csv"
+    if filename.endswith((".jsonl", ".json")):
+        return "jsonl"
+    return default
+
+
+def write_csv_rows(fh: TextIO, rows: Iterable[Tuple[Any, ...]]) -> int:
+    """Write control rows as CSV with a header line. See CSV_COLUMNS.
+
+    :param fh: The file handle to write to. Open it with newline=""
+    :param rows: The rows, one per control
+    :returns: The number of rows written
+    """
+    writer = csv.writer(fh)
+    writer.writerow(CSV_COLUMNS)
+    written = 0
+    for row in rows:
+        writer.writerow(row)
+        written += 1
+    return written
+
+
+def escape_tsv(value: Any) -> str:
+    """Escape a TSV field. Backslash, tab, line feed and carriage return are written as backslash escapes, see TSV_ESCAPES.
+
+    :param value: The field value
+    :returns: The field as text without tabs and line breaks
+    """
+    text = str(value)
+    for char, escape in TSV_ESCAPES:
+        if char in text:
+            text = text.replace(char, escape)
+    return text
+
+
+def write_tsv_rows(fh: TextIO, rows: Iterable[Tuple[Any, ...]]) -> int:
+    """Write control rows as tab separated values with a header line. See CSV_COLUMNS.
+
+    :param fh: The file handle to write to
+    :param rows: The rows, one per control
+    :returns: The number of rows written
+    """
+    fh.write("\t".join(CSV_COLUMNS) + "\n")
+    written = 0
+    for row in rows:
+        fh.write("\t".join(escape_tsv(value) for value in row) + "\n")
+        written += 1
+    return written
+
+
+def write_jsonl_records(fh: TextIO, records: Iterable[Dict[str, Any]]) -> int:
+    """Write records as JSON lines, one record per line.
+
+    :param fh: The file handle to write to
+    :param records: The records
+    :returns: The number of records written
+    """
+    encoder = json.JSONEncoder(ensure_ascii=False)
+    written = 0
+    for record in records:
+        fh.write(encoder.encode(record) + "\n")
+        written += 1
+    return written
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+"""The catalogue cache. Parsed data files are kept as marshalled trees, named by the hash of the data file."""
+
+import hashlib
+import marshal
+import os
+import sys
+import time
+from typing import TYPE_CHECKING, Any, Optional, Tuple
+
+from app.cbx_profile import profiled
+
+if TYPE_CHECKING:
+    from app.cbx_section import CbxSection
+
+# Bump this if the layout of the cached tree changes
+CACHE_FORMAT = 1
+
+# Subdirectory of cache_dir with the compiled report templates
+TEMPLATE_CACHE_DIR = "templates"
+
+
+def hash_data_file(file_type: str, filename: str, prefix: str) -> str:
+    """Hash the content of a data file together with the file type and the prefix of the section.
+
+    :param file_type: The type of the data file
+    :param filename: The name of the data file
+    :param prefix: The prefix of the section
+    :returns: The hash as hex string
+    """
+    key = hashlib.sha256()
+    with open(filename, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            key.update(chunk)
+    key.update(f"\0{file_type}\0{prefix}".encode("utf-8"))
+    return key.hexdigest()
+
+
+def get_cache_file(cache_dir: str, data_hash: Optional[str]) -> str:
+    """Return the name of the cache file of a data file. It is content addressed: a changed data file results in a new name.
+
+    :param cache_dir: Directory of the catalogue cache
+    :param data_hash: The hash of the data file, see hash_data_file
+    :returns: The file name of the cache file
+    """
+    key = hashlib.sha256(f"{data_hash}\0{CACHE_FORMAT}\0{marshal.version}\0{sys.version_info[:2]}".encode("utf-8"))
+    return os.path.join(cache_dir, key.hexdigest() + ".cbxc")
+
+
+@profiled("read_cache")
+def read_cache(cache_file: str) -> Optional[Tuple[Any, ...]]:
+    """Read a cache file.
+
+    :param cache_file: The name of the cache file
+    :returns: The cached section tree or None if there is no valid cache file
+    """
+    try:
+        with open(cache_file, "rb") as fh:
+            data: Tuple[Any, ...] = marshal.loads(fh.read())  # nosec  The cache is written by us, content addressed and only contains tuples of strings and numbers
+    except FileNotFoundError:
+        return None
+    except (EOFError, ValueError, TypeError):
+        print(f"Broken cache file {cache_file}. Reloading data file")
+        return None
+    return data
+
+
+@profiled("write_cache")
+def write_cache(cache_file: str, data: Tuple[Any, ...]) -> None:
+    """Write a section tree to a cache file. Writes to a temporary file first to never leave a partial cache file.
+
+    :param cache_file: The name of the cache file
+    :param data: The section tree as created by CbxSection.to_cache
+    """
+    os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as fh:
+        fh.write(marshal.dumps(data))
+    os.replace(tmp_file, cache_file)
+
+
+def lookup_cache(section: "CbxSection", file_type: str, filename: str, cache_dir: Optional[str]) -> Optional[Tuple[Any, ...]]:
+    """Hash the data file of a section and read its cache file. Does not change the tree of the section, so it can run in a thread.
+
+    :param section: The section, gets the data file, its hash and the time of the lookup as load duration
+    :param file_type: The type of the data file
+    :param filename: The name of the data file
+    :param cache_dir: Directory of the catalogue cache. None disables the cache
+    :returns: The cached section tree or None
+    """
+    start = time.perf_counter()
+    section.data_file = filename
+    section.data_hash = hash_data_file(file_type, filename, str(section.manual_prefix))
+    data = None if cache_dir is None else read_cache(get_cache_file(cache_dir, section.data_hash))
+    section.load_duration = time.perf_counter() - start
+    return data
+
+
+def clear_cache(cache_dir: Optional[str]) -> int:
+    """Remove all files from the catalogue cache: section trees, search indexes and compiled report templates.
+
+    :param cache_dir: Directory of the catalogue cache
+    :returns: The number of removed cache files
+    """
+    removed = 0
+    if cache_dir is not None and os.path.isdir(cache_dir):
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith((".cbxc", ".cbxs")):
+                os.remove(entry.path)
+                removed += 1
+        template_dir = os.path.join(cache_dir, TEMPLATE_CACHE_DIR)
+        if os.path.isdir(template_dir):
+            for entry in os.scandir(template_dir):
+                if entry.name.endswith(".cache"):
+                    os.remove(entry.path)
+                    removed += 1
+    return removed
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+"""Client of the daemon mode. Kept apart from the server, so commands checking for a running daemon do not import asyncio."""
+
+import json
+import os
+import socket
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.cbx_batch import MarkRecord
+
+# Header carrying the token of the server session, see write_token
+TOKEN_HEADER = "X-Cbx-Token"
+
+# Default of server_token_file in the config
+DEFAULT_TOKEN_FILE = ".cbx_server_token"
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """Split a server address like 127.0.0.1:8737.
+
+    :param address: host:port
+    :returns: host and port
+    """
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def get_token_file(config_file: str, token_file: str = DEFAULT_TOKEN_FILE) -> str:
+    """Return the absolute name of the token file of a project. A relative name is relative to the directory of the config file.
+
+    :param config_file: The config file of the project
+    :param token_file: server_token_file of the config
+    :returns: The absolute name of the token file
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(config_file)), token_file)
+
+
+def read_token(token_file: str) -> Optional[str]:
+    """Read the token a running server wrote.
+
+    :param token_file: The token file of the server
+    :returns: The token or None if there is no token file
+    """
+    try:
+        with open(token_file, "rt", encoding="utf-8") as fh:
+            return fh.read().strip() or None
+    except OSError:
+        return None
+
+
+class CbxApiError(Exception):
+    """An error reported to the client with a HTTP status code."""
+
+    def __init__(self, status: int, message: str) -> None:
+        """Create the error.
+
+        :param status: The HTTP status code
+        :param message: The error message
+        """
+        super().__init__(message)
+        self.status = status
+
+
+class CbxClient():
+    """Client for a running CbxServer."""
+
+    def __init__(self, address: str, token: str, timeout: float = 600.0) -> None:
+        """Create a client.
+
+        :param address: host:port of the server
+        :param token: The token of the server session, see read_token
+        :param timeout: Seconds to wait for an answer
+        """
+        self.host, self.port = parse_address(address)
+        self.token = token
+        self.timeout = timeout
+
+    def request(self, method: str, path: str, body: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None) -> Any:
+        """Send a request and return the decoded answer.
+
+        :param method: GET or POST
+        :param path: The request path
+        :param body: The JSON body
+        :param timeout: Seconds to wait. Default: the timeout of the client
+        :returns: The decoded JSON answer
+        :raises CbxApiError: If the server reports an error
+        """
+        import http.client  # pylint: disable=import-outside-toplevel
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=timeout or self.timeout)
+        try:
+            payload = json.dumps(body).encode("utf-8") if body is not None else None
+            connection.request(method, path, body=payload, headers={"Content-Type": "application/json", TOKEN_HEADER: self.token})
+            response = connection.getresponse()
+            data = json.loads(response.read())
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise CbxApiError(response.status, str(data.get("error")))
+        return data
+
+    def ping(self) -> Optional[Dict[str, Any]]:
+        """Ask the server which project it serves.
+
+        :returns: The answer of /ping with config, project and controls or None if the server does not answer
+        """
+        # Most of the time no daemon is running. A refused connection is detected without loading the HTTP client
+        try:
+            with socket.create_connection((self.host, self.port), timeout=1.0):
+                pass
+        except OSError:
+            return None
+        import http.client  # pylint: disable=import-outside-toplevel
+        try:
+            answer: Dict[str, Any] = self.request("GET", "/ping", timeout=1.0)
+        except (OSError, http.client.HTTPException, ValueError):
+            return None
+        return answer
+
+    def is_running(self) -> bool:
+        """Check if the server answers.
+
+        :returns: True if the server is running
+        """
+        return self.ping() is not None
+
+    def mark(self, records: List[MarkRecord], author: Optional[str] = None) -> Dict[str, Any]:
+        """Mark controls on the server.
+
+        :param records: (uid, state, statement) tuples
+        :param author: The author of the changes. Default: the author of the server
+        :returns: The summary as created by CbxMarkResult.to_dict
+        """
+        result: Dict[str, Any] = self.request("POST", "/mark", {"records": [list(record) for record in records], "author": author})
+        return result
+
+    def merge(self, records: List[MarkRecord], author: Optional[str] = None, dry_run: bool = False) -> Dict[str, Any]:
+        """Mark the controls on the server whose state or statement differ.
+
+        :param records: (uid, state, statement) tuples
+        :param author: The author of the changes. Default: the author of the server
+        :param dry_run: Only compare
+        :returns: The summary as created by CbxMarkResult.to_dict
+        """
+        result: Dict[str, Any] = self.request("POST", "/merge", {"records": [list(record) for record in records], "author": author, "dry_run": dry_run})
+        return result
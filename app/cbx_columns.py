@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+"""Columnar storage of control states. One byte per control instead of an attribute on every control object."""
+
+from typing import Dict, Iterable, Optional
+
+from app.cbx_control import State
+from app.cbx_index import CbxIndex
+
+# Byte values of the states in the state column
+STATE_CODES: Dict[State, int] = {state: code for code, state in enumerate(State)}
+STATES_BY_CODE = list(State)
+
+# Set in the state byte if the statement is empty instead of missing
+EMPTY_STATEMENT = 0x80
+STATE_MASK = 0x7F
+
+
+class CbxColumnStore():
+    """States of controls as a byte array indexed by the position of the control in the UID index. Statements are stored sparse.
+
+    Several stores can share the positions of the same catalogue, for example to keep the states of several projects or snapshots.
+    """
+
+    __slots__ = ("positions", "states", "statements")
+
+    def __init__(self, positions: Dict[str, int]) -> None:
+        """Create a store with all controls unchecked.
+
+        :param positions: Position of every UID in the state column
+        """
+        self.positions = positions
+        self.states = bytearray(len(positions))
+        self.statements: Dict[int, str] = {}
+
+    @staticmethod
+    def get_positions(uids: Iterable[str]) -> Dict[str, int]:
+        """Assign positions in the state column to UIDs.
+
+        :param uids: The UIDs in catalogue order
+        :returns: The position for every UID
+        """
+        return {uid: position for position, uid in enumerate(uids)}
+
+    @classmethod
+    def from_index(cls, index: CbxIndex, positions: Optional[Dict[str, int]] = None) -> "CbxColumnStore":
+        """Copy the current states and statements of the indexed controls.
+
+        :param index: The UID index of the controls
+        :param positions: Positions to share with other stores. Created from the index if None
+        :returns: A new store
+        """
+        store = cls(positions if positions is not None else cls.get_positions(index.controls.keys()))
+        for uid, control in index.controls.items():
+            store.set_state(uid, control.state, control.statement)
+        return store
+
+    def set_state(self, uid: str, state: State, statement: Optional[str] = None) -> bool:
+        """Set the state of a control.
+
+        :param uid: The UID of the control
+        :param state: The new state
+        :param statement: The statement. None removes it
+        :returns: True if the UID is part of the store
+        """
+        position = self.positions.get(uid)
+        if position is None:
+            return False
+        self.states[position] = STATE_CODES[state] | (EMPTY_STATEMENT if statement == "" else 0)
+        if statement:
+            self.statements[position] = statement
+        else:
+            self.statements.pop(position, None)
+        return True
+
+    def get_state(self, uid: str) -> Optional[State]:
+        """Return the state of a control.
+
+        :param uid: The UID of the control
+        :returns: The state or None for unknown UIDs
+        """
+        position = self.positions.get(uid)
+        if position is None:
+            return None
+        return STATES_BY_CODE[self.states[position] & STATE_MASK]
+
+    def get_statement(self, uid: str) -> Optional[str]:
+        """Return the statement of a control.
+
+        :param uid: The UID of the control
+        :returns: The statement or None
+        """
+        position = self.positions.get(uid)
+        if position is None:
+            return None
+        return self.statements.get(position, "" if self.states[position] & EMPTY_STATEMENT else None)
+
+    def get_counts(self) -> Dict[State, int]:
+        """Count the controls per state.
+
+        :returns: Number of controls per state
+        """
+        return {state: self.states.count(code) + self.states.count(code | EMPTY_STATEMENT) for state, code in STATE_CODES.items()}
+
+    def apply_to(self, index: CbxIndex, current: Optional["CbxColumnStore"] = None) -> None:
+        """Write the states and statements to the indexed control objects.
+
+        :param index: The UID index of the controls
+        :param current: The store the controls currently have the states of. Only the differences to it are written. Must share the positions
+        """
+        if current is None or current.positions is not self.positions:
+            changed: Iterable[int] = range(len(self.states))
+        else:
+            differing = {position for position, (old, new) in enumerate(zip(current.states, self.states)) if old != new}
+            differing.update(position for position in current.statements.keys() | self.statements.keys()
+                             if current.statements.get(position) != self.statements.get(position))
+            changed = sorted(differing)
+        # Positions are assigned in the order of the UIDs
+        uids = list(self.positions)
+        for position in changed:
+            control = index.find(uids[position])
+            if control is not None:
+                code = self.states[position]
+                control.set_state(STATES_BY_CODE[code & STATE_MASK].value, self.statements.get(position, "" if code & EMPTY_STATEMENT else None))
@@ -2,9 +2,13 @@
 
 """A single checkbox item called control."""
 
-from typing import List, Dict, Any, Union, Sequence, Optional
+import sys
+from typing import List, Dict, Any, Union, Sequence, Optional, Tuple, TYPE_CHECKING
 from enum import Enum
 
+if TYPE_CHECKING:
+    from app.cbx_stats import CbxStats
+
 
 class State(Enum):
   """State of the checkbox."""
@@ -15,10 +19,74 @@ class State(Enum):
 
 
 
+class CbxControlFilter():
+    """Conditions on controls, used to filter listings while the catalogue is walked. Conditions that are None match every control."""
+
+    __slots__ = ("state", "section_prefix", "group", "cwe", "nist")
+
+    def __init__(self, state: Optional[str] = None, section_prefix: Optional[str] = None, group: Optional[str] = None,
+                 cwe: Optional[int] = None, nist: Optional[str] = None) -> None:
+        """Create a filter.
+
+        :param state: Only controls with this state
+        :param section_prefix: Only controls of the section with this prefix
+        :param group: Only controls of the group with this shortcode
+        :param cwe: Only controls referencing this CWE
+        :param nist: Only controls referencing this NIST entry
+        :raises ValueError: If the state is unknown
+        """
+        try:
+            self.state: Optional[State] = State(state) if state is not None else None
+        except ValueError:
+            raise ValueError(f"Wrong state {state}. Available states: {','.join(e.value for e in State)}") from None
+        self.section_prefix = section_prefix
+        self.group = group
+        self.cwe = cwe
+        self.nist = nist
+
+    def matches(self, control: "CbxControl") -> bool:
+        """Check the conditions on the control itself. Section and group are checked while walking the catalogue.
+
+        :param control: The control to check
+        :returns: True if the control matches state, CWE and NIST
+        """
+        return ((self.state is None or control.state is self.state)
+                and (self.cwe is None or self.cwe in control.cwe)
+                and (self.nist is None or self.nist in control.nist))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the conditions as dict, for example to send them to the server.
+
+        :returns: The conditions that are set
+        """
+        res = {"state": self.state.value if self.state is not None else None, "section_prefix": self.section_prefix,
+               "group": self.group, "cwe": self.cwe, "nist": self.nist}
+        return {key: value for key, value in res.items() if value is not None}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CbxControlFilter":
+        """Create a filter from a dict created by to_dict.
+
+        :param data: The conditions
+        :returns: The filter
+        :raises ValueError: If the state is unknown or the CWE is not a number
+        """
+        return cls(data.get("state"), data.get("section_prefix"), data.get("group"),
+                   int(data["cwe"]) if data.get("cwe") is not None else None, data.get("nist"))
+
+
+# Shared by all controls without CWE or NIST entries
+EMPTY_CWE: Tuple[int, ...] = ()
+EMPTY_NIST: Tuple[str, ...] = ()
+
+
 class CbxControl():
     """A checkbox item."""
 
-    def __init__(self, shortcode: str, ordinal: int, description: str, cwe: List[int], nist: List[str], requirement_matrix: Dict[Any, Any], statement: Optional[str]=None, section_prefix: Optional[str] = "") -> None:
+    # There are many controls. Slots, interned strings and shared empty tuples keep them small
+    __slots__ = ("shortcode", "ordinal", "description", "cwe", "nist", "state", "statement", "_section_prefix", "uid", "stats")
+
+    def __init__(self, shortcode: str, ordinal: int, description: str, cwe: Sequence[int], nist: Sequence[str], requirement_matrix: Dict[Any, Any], statement: Optional[str]=None, section_prefix: Optional[str] = "") -> None:
         """Create a control object.
 
         Important. The state will start by default as "unchecked". If you want another state, call set_state.
@@ -26,20 +94,24 @@ class CbxControl():
         :param shortcode: A short ID code for this control
         :param ordinal: A numerical ordinal
         :param description: A description
-        :param cwe: A list of relevant CWEs
-        :param nist: A list of NIST entries
+        :param cwe: A list of relevant CWEs. Stored as tuple
+        :param nist: A list of NIST entries. Stored as tuple
         :param requirement matrix: A requirement matrix - Not yet implemented !
         :param statement: A statement for this control. Will be overwritten on state changes !
         :param section_prefix: First part of the generated UID of this control.
         """
-        self.shortcode = shortcode
+        self.shortcode = sys.intern(str(shortcode))
         self.ordinal: int = ordinal
-        self.description = description
-        self.cwe:List[int] = cwe
-        self.nist: List[str] = nist
+        self.description = sys.intern(str(description))
+        self.cwe: Tuple[int, ...] = tuple(cwe) if cwe else EMPTY_CWE
+        self.nist: Tuple[str, ...] = tuple(nist) if nist else EMPTY_NIST
         self.state:State = State.UNCHECKED
         self.statement = statement
-        self.section_prefix: Optional[str] = section_prefix
+        self.uid: str = ""
+        # Sets the uid as well
+        self.section_prefix = section_prefix
+        # Stats of the item containing this control. Updated on state changes
+        self.stats: Optional["CbxStats"] = None
 
         # TODO: Maybe prefix can not be optional to have a uniqe ID
 
@@ -60,14 +132,33 @@ class CbxControl():
         #      },
 
 
+    @property
+    def section_prefix(self) -> Optional[str]:
+        """First part of the UID of this control.
+
+        :returns: The prefix of the section
+        """
+        return self._section_prefix
+
+    @section_prefix.setter
+    def section_prefix(self, prefix: Optional[str]) -> None:
+        """Set the prefix and update the cached UID.
+
+        :param prefix: The prefix of the section
+        """
+        if prefix is None:
+            self._section_prefix = None
+            self.uid = "-" + self.shortcode
+        else:
+            self._section_prefix = sys.intern(str(prefix))
+            self.uid = self._section_prefix + "-" + self.shortcode
+
     def get_uid(self) -> str:
         """Get unique ID.
 
         :returns: the UID of this control
         """
-        if self.section_prefix is None:
-            return "-" + self.shortcode
-        return self.section_prefix + "-" + self.shortcode
+        return self.uid
 
 
     def to_dict(self) -> dict[str, Union[Optional[str], int, List[str], List[int]]]:
@@ -78,8 +169,8 @@ class CbxControl():
         res: dict[str, Union[Optional[str], int, List[str], List[int]]] = {"shortcode": self.shortcode,
                "ordinal": self.ordinal,
                "description": self.description,
-               "CWE": self.cwe,
-               "NIST": self.nist,
+               "CWE": list(self.cwe),
+               "NIST": list(self.nist),
                "state": self.state.name,
                "statement": self.statement,
                "uid": self.get_uid()}
@@ -87,6 +178,13 @@ class CbxControl():
 
     def pretty_print(self) -> None:
         """Pretty output for the control."""
+        print(self.pretty_format())
+
+    def pretty_format(self) -> str:
+        """Return the pretty output for the control.
+
+        :returns: The control as text
+        """
         cwe =",".join([str(x) for x in self.cwe])
         nist = ",".join(self.nist)
 
@@ -98,18 +196,22 @@ class CbxControl():
                    uid = self.get_uid()
                    )
 
-        print(out)
+        return out
 
-    def set_state(self, state: str, statement: str) -> None:
+    def set_state(self, state: str, statement: Optional[str]) -> None:
         """Set the state.
 
         :param state: The state to set for this control
         :param statement: The statement for the state change to add
         """
         try:
-          self.state = State(state)
+          new_state = State(state)
         except ValueError as e:
             print("Wrong state. Available states: ")
             print(",".join([e.value for e in State]))
+        else:
+            if self.stats is not None and new_state != self.state:
+                self.stats.change(self.state, new_state)
+            self.state = new_state
 
         self.statement = statement
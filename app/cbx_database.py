@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+
+"""The stored states of a project: the toml database with its journal or the SQLite backend."""
+
+import contextlib
+import os
+import tomllib
+from typing import TYPE_CHECKING, Any, ContextManager, Dict, Iterator, List, Optional, Set, Tuple
+
+from app.cbx_cache import hash_data_file
+from app.cbx_control import State
+from app.cbx_journal import CbxJournal
+from app.cbx_lock import LOCK_TIMEOUT, CbxFileLock, atomic_write
+from app.cbx_profile import PROFILER, profiled
+
+if TYPE_CHECKING:
+    from app.cbx_empire import CbxEmpire
+    from app.cbx_sqlite import CbxSqliteBackend
+
+
+class CbxStateDatabase():
+    """Loads and saves the states of the controls of a project. The project records its changes in changed_uids, see CbxEmpire.mark_control."""
+
+    def __init__(self, empire: "CbxEmpire") -> None:
+        """Create a database without backend. Configure it with the settings of a config.
+
+        :param empire: The project whose states are stored
+        """
+        self.empire = empire
+        self.database_file_toml: Optional[str] = None
+        self.state_backend: str = "toml"
+        self.sqlite: Optional["CbxSqliteBackend"] = None
+        self.journal: Optional[CbxJournal] = None
+        self.journal_compact_after: int = 1000
+        self.journal_pending: int = 0
+        # Size of the journal when this process last read or wrote it. Entries after it were written by other processes
+        self.journal_seen: int = 0
+        # Size and modification time of the toml database and data version of the SQLite backend when this process last read or wrote them
+        self.toml_stamp: Optional[Tuple[int, int]] = None
+        self.sqlite_version: int = 0
+        # Held while reading and writing the toml database and the journal, other processes may work on them at the same time
+        self.database_lock: Optional[CbxFileLock] = None
+
+    def configure(self, data: Dict[str, Any]) -> None:
+        """Set up the state backend from the settings of a config.
+
+        :param data: The parsed config
+        """
+        if "database_file_toml" in data:
+            self.database_file_toml = str(data["database_file_toml"])
+        if "state_backend" in data:
+            self.state_backend = str(data["state_backend"])
+        if self.state_backend == "sqlite":
+            from app.cbx_sqlite import CbxSqliteBackend  # pylint: disable=import-outside-toplevel
+            self.sqlite = CbxSqliteBackend(str(data.get("database_file_sqlite", "database.sqlite")))
+        elif self.state_backend != "toml":
+            print(f"Unknown state backend {self.state_backend}. Available: toml, sqlite")
+        if self.database_file_toml is not None:
+            self.journal = CbxJournal(str(data.get("database_journal", self.database_file_toml + ".journal")))
+        if "journal_compact_after" in data:
+            self.journal_compact_after = int(data["journal_compact_after"])
+        if self.database_file_toml is not None:
+            self.database_lock = CbxFileLock(self.database_file_toml + ".lock", float(data.get("database_lock_timeout", LOCK_TIMEOUT)))
+
+    @profiled("load_database")
+    def load(self) -> None:
+        """Load the control states from the configured state backend."""
+        if self.sqlite is not None:
+            self.sqlite.sync_sections(self.empire.sections)
+            self.sqlite_version = self.sqlite.get_data_version()
+            states = found = 0
+            for uid, state, statement in self.sqlite.load_states():
+                found += self.empire.apply_state(uid, state, statement)
+                states += 1
+            PROFILER.count("states_loaded", states)
+            PROFILER.count("uids_not_found", states - found)
+        else:
+            self.load_toml()
+
+    def ignore_stored_states(self) -> None:
+        """Skip the stored states, also the ones other processes save from now on. Used instead of load."""
+        if self.sqlite is not None:
+            self.sqlite_version = self.sqlite.get_data_version()
+        with self.lock(shared=True):
+            self.toml_stamp = self.get_toml_stamp()
+            if self.journal is not None:
+                self.journal_seen = self.journal.size()
+
+    def get_changes(self) -> List[Dict[str, str]]:
+        """Return the controls changed since the last save as journal entries.
+
+        :returns: A list of entries with uid, state, statement, timestamp and author
+        """
+        entries = []
+        for uid in self.empire.changed_uids:
+            control = self.empire.index.controls[uid]
+            entries.append(CbxJournal.create_entry(uid, control.state.value, control.statement or "", self.empire.author))
+        return entries
+
+    @profiled("save_database")
+    def save(self) -> None:
+        """Save the controls changed since loading to the configured state backend."""
+        if self.sqlite is not None:
+            self.sqlite.save_states(self.get_changes())
+            self.sqlite_version = self.sqlite.get_data_version()
+            self.empire.changed_uids.clear()
+        else:
+            self.save_toml()
+
+    @profiled("compact_database")
+    def compact(self) -> None:
+        """Write the states of all controls to the configured state backend. Includes the states set by project tags.
+
+        The SQLite backend only gets the states that differ from the stored ones.
+        """
+        self.empire.load_all()
+        if self.sqlite is not None:
+            self.sqlite.save_states(self.get_differing_states(), history=False)
+            self.sqlite_version = self.sqlite.get_data_version()
+        else:
+            self.compact_toml()
+
+    def get_differing_states(self) -> List[Dict[str, str]]:
+        """Return the controls whose state or statement differs from the stored one as journal entries. Used to compact the SQLite backend.
+
+        Only these rows are written, the others keep the timestamp and author of their last change. No stored row means unchecked.
+
+        :returns: A list of entries with uid, state, statement, timestamp and author
+        """
+        stored = self.get_stored_states()
+        return [CbxJournal.create_entry(uid, control.state.value, control.statement or "", self.empire.author)
+                for uid, control in self.empire.index.controls.items()
+                if stored.get(uid, (State.UNCHECKED.value, "")) != (control.state.value, control.statement or "")]
+
+    @profiled("migrate")
+    def migrate_toml_to_sqlite(self) -> int:
+        """Import the states of the toml database and its journal into the SQLite backend.
+
+        The journal entries keep their timestamp and author, the states of the toml database and of the project tags are written
+        like by compact.
+
+        :returns: The number of state rows written. Controls without stored state stay unchecked and are not counted
+        """
+        if self.sqlite is None:
+            print("The state backend is not sqlite. Set state_backend = \"sqlite\" in the config")
+            return 0
+        self.empire.load_all()
+        self.load_toml()
+        written: Set[str] = set()
+        if self.journal is not None:
+            entries = list(self.journal.read())
+            self.sqlite.save_states(entries, history=True)
+            written.update(entry["uid"] for entry in entries)
+        entries = self.get_differing_states()
+        self.sqlite.save_states(entries, history=False)
+        written.update(entry["uid"] for entry in entries)
+        self.sqlite_version = self.sqlite.get_data_version()
+        return len(written)
+
+    def get_toml_stamp(self) -> Optional[Tuple[int, int]]:
+        """Return size and modification time of the toml database.
+
+        :returns: (size, modification time in ns) or None if there is no toml database
+        """
+        if self.database_file_toml is None:
+            return None
+        try:
+            stat = os.stat(self.database_file_toml)
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def has_external_changes(self) -> bool:
+        """Check if other processes saved states since this process last read or wrote them. Only looks at sizes, times and versions.
+
+        :returns: True if sync has something to apply
+        """
+        if self.sqlite is not None:
+            return self.sqlite.get_data_version() != self.sqlite_version
+        if self.get_toml_stamp() != self.toml_stamp:
+            return True
+        return self.journal is not None and self.journal.size() != self.journal_seen
+
+    def sync(self) -> int:
+        """Apply the states other processes saved since this process last read or wrote them. Used by the serve daemon before answering.
+
+        New journal entries are replayed, see sync_journal. If the toml database was rewritten, for example compacted by another
+        process, or the SQLite backend changed, all stored states are applied again. Controls changed by this process and not
+        saved yet keep their state.
+
+        :returns: The number of states applied
+        """
+        if not self.has_external_changes():
+            return 0
+        applied = 0
+        if self.sqlite is not None:
+            self.sqlite_version = self.sqlite.get_data_version()
+            for uid, state, statement in self.sqlite.load_states():
+                if uid not in self.empire.changed_uids:
+                    applied += self.empire.apply_state(uid, state, statement)
+            PROFILER.count("states_synced", applied)
+            return applied
+        with self.lock(shared=True):
+            toml_stamp = self.get_toml_stamp()
+            if toml_stamp == self.toml_stamp:
+                return self.sync_journal()
+            self.journal_pending = 0
+            for uid, state, statement, from_journal in self.read_toml():
+                if uid not in self.empire.changed_uids:
+                    applied += self.empire.apply_state(uid, state, statement)
+                if from_journal:
+                    self.journal_pending += 1
+            self.toml_stamp = toml_stamp
+            if self.journal is not None:
+                self.journal_seen = self.journal.size()
+        PROFILER.count("states_synced", applied)
+        return applied
+
+    def lock(self, shared: bool = False) -> ContextManager[Any]:
+        """Lock the toml database and its journal against other processes. Reentrant.
+
+        :param shared: Shared lock for reading instead of an exclusive one for writing
+        :returns: A context manager holding the lock
+        :raises TimeoutError: If the lock could not be acquired within database_lock_timeout seconds
+        """
+        if self.database_lock is None:
+            return contextlib.nullcontext()
+        return self.database_lock.locked(shared)
+
+    def get_stored_states(self) -> Dict[str, Tuple[str, str]]:
+        """Return the states saved in the state backend without applying them. Controls never marked or compacted are missing.
+
+        :returns: uid: (state, statement)
+        """
+        if self.sqlite is not None:
+            return {uid: (state, statement) for uid, state, statement in self.sqlite.load_states()}
+        return {uid: (state, statement) for uid, state, statement, _ in self.read_toml()}
+
+    def get_history(self, uid: Optional[str] = None) -> Iterator[Dict[str, str]]:
+        """Return the state changes from the journal or the history table of the SQLite backend.
+
+        :param uid: Only the changes of this control. None returns all
+        :returns: A generator of entries with uid, state, statement, timestamp and author, oldest first
+        """
+        if self.sqlite is not None:
+            entries = self.sqlite.history(uid)
+        elif self.journal is not None:
+            entries = self.journal.read()
+        else:
+            return
+        for entry in entries:
+            if uid is None or entry["uid"] == uid:
+                yield entry
+
+    def sync_query_tables(self) -> int:
+        """Store the controls of the sections the SQLite backend does not know yet or whose data file changed.
+
+        Lazy sections are hashed and only loaded if their stored controls are missing or outdated. The states set by the project
+        tags are evaluated on the stored UIDs, see CbxEmpire.get_tag_states.
+
+        :returns: The number of sections written
+        """
+        if self.sqlite is None:
+            return 0
+        known = self.sqlite.get_section_hashes()
+        outdated = []
+        for section in self.empire.sections:
+            if section.source is not None:
+                file_type, filename, _ = section.source
+                if known.get(str(section.manual_prefix)) == hash_data_file(file_type, filename, str(section.manual_prefix)):
+                    continue
+                section.ensure_loaded()
+            outdated.append(section)
+        synced = self.sqlite.sync_sections(outdated)
+        # Only compact stores the states set by project tags. Queries get them from the rules
+        self.sqlite.set_tag_states(self.empire.get_tag_states(self.sqlite.get_section_uids()))
+        return synced
+
+    def read_toml(self) -> Iterator[Tuple[str, str, str, bool]]:
+        """Read the states of the toml database and of the journal entries written after the last compaction.
+
+        :returns: A generator of (uid, state, statement, from journal), later entries win
+        """
+        if self.database_file_toml is None:
+            return
+        with self.lock(shared=True):
+            offset = 0
+            if os.path.exists(self.database_file_toml):
+                with open(self.database_file_toml, "rb") as fh:
+                    data = tomllib.load(fh)
+                offset = int(data.get("journal_offset", 0))
+                for control in data.get("controls", []):
+                    yield control["uid"], control["state"], control["statement"], False
+            if self.journal is not None:
+                for entry in self.journal.read(offset):
+                    yield entry["uid"], entry["state"], entry["statement"], True
+
+    @profiled("load_toml_database")
+    def load_toml(self) -> None:
+        """Load the toml database assigning states to controls. Replays the journal entries written after the last compaction."""
+        if self.database_file_toml is None:
+            return
+        states = found = 0
+        self.journal_pending = 0
+        with self.lock(shared=True):
+            for uid, state, statement, from_journal in self.read_toml():
+                found += self.empire.apply_state(uid, state, statement)
+                if from_journal:
+                    self.journal_pending += 1
+                else:
+                    states += 1
+            self.toml_stamp = self.get_toml_stamp()
+            if self.journal is not None:
+                self.journal_seen = self.journal.size()
+        PROFILER.count("states_loaded", states + self.journal_pending)
+        PROFILER.count("journal_entries_replayed", self.journal_pending)
+        PROFILER.count("uids_not_found", states + self.journal_pending - found)
+
+    @profiled("save_toml_database")
+    def save_toml(self) -> None:
+        """Save the controls changed since loading to the journal.
+
+        Only the changes are written. If the journal has grown by journal_compact_after entries since the last compaction it is compacted into the toml database.
+        Changes other processes saved in the meantime are applied first, see sync_journal.
+        """
+        if self.database_file_toml is None:
+            return
+        if self.journal is None:
+            self.compact_toml()
+            return
+        with self.lock():
+            self.sync_journal()
+            self.journal_pending += self.journal.write(self.get_changes())
+            self.journal_seen = self.journal.size()
+            self.empire.changed_uids.clear()
+            if self.journal_pending >= self.journal_compact_after:
+                self.compact_toml()
+
+    def sync_journal(self) -> int:
+        """Apply the journal entries other processes wrote since this process last read or wrote the journal. Hold the database lock.
+
+        Optimistic merge: nothing is locked between loading and saving. When saving, the entries written in the meantime are
+        replayed in journal order. Controls changed by this process and not saved yet keep their state, they are saved after them.
+
+        :returns: The number of entries applied
+        """
+        if self.journal is None:
+            return 0
+        size = self.journal.size()
+        if size == self.journal_seen:
+            return 0
+        applied = 0
+        for entry in self.journal.read(self.journal_seen):
+            if entry["uid"] not in self.empire.changed_uids:
+                self.empire.apply_state(entry["uid"], entry["state"], entry["statement"])
+                applied += 1
+        self.journal_pending += applied
+        self.journal_seen = size
+        PROFILER.count("journal_entries_merged", applied)
+        return applied
+
+    @profiled("compact_toml_database")
+    def compact_toml(self) -> None:
+        """Write the states of all controls to the toml database and remember the current journal size as already included.
+
+        The journal stays untouched as audit trail. Replaying it again after a crash in between is harmless.
+        The journal entries of other processes are applied first. The database is replaced atomically, readers never see a partial file.
+        """
+        if self.database_file_toml is not None:
+            self.empire.load_all()
+            import tomlkit  # pylint: disable=import-outside-toplevel
+            with self.lock():
+                self.sync_journal()
+                data: dict[str, Any] = {"journal_offset": self.journal.size() if self.journal is not None else 0,
+                                        "controls": []}
+                for section in self.empire.sections:
+                    for group in section.get_groups():
+                        for item in group.get_items():
+                            for control in item.get_controls():
+                                data["controls"].append({"uid": control.get_uid(),
+                                                         "state": control.state.value,
+                                                         "statement": control.statement or ""})
+                with atomic_write(self.database_file_toml, "wt", encoding="UTF-8") as fh:
+                    tomlkit.dump(data, fh)
+                self.toml_stamp = self.get_toml_stamp()
+                self.journal_pending = 0
@@ -1,43 +1,61 @@
 """Master class to collect several checkbox sections and process them. Also generates reports."""
 
-import re
-from typing import Any, Dict, List, Optional, Union
-
-import tomlkit
-from jinja2 import Environment, FileSystemLoader, select_autoescape
-
-from app.cbx_control import CbxControl
-from app.cbx_section import CbxSection
-
-# Project offers logins
-required_tags: dict[str, list[Any]] = {"login": ["OWASP_ASVS-V2.1.1", "OWASP_ASVS-V2.1.2", "OWASP_ASVS-V2.1.3", "OWASP_ASVS-V2.1.4", "OWASP_ASVS-V2.1.5", "OWASP_ASVS-V2.1.6", "OWASP_ASVS-V2.1.7", "OWASP_ASVS-V2.1.8", "OWASP_ASVS-V2.1.9", "OWASP_ASVS-V2.1.10", "OWASP_ASVS-V2.1.11", "OWASP_ASVS-V2.1.12", "OWASP_ASVS-V2.2.1", "OWASP_ASVS-V2.2.2", "OWASP_ASVS-V2.2.3", "OWASP_ASVS-V2.2.4", "OWASP_ASVS-V2.2.5", "OWASP_ASVS-V2.2.6", "OWASP_ASVS-V2.2.7", "OWASP_ASVS-V2.3.1", "OWASP_ASVS-V2.3.2", "OWASP_ASVS-V2.3.3", "OWASP_ASVS-V2.4.1", "OWASP_ASVS-V2.4.2", "OWASP_ASVS-V2.4.3", "OWASP_ASVS-V2.4.4", "OWASP_ASVS-V2.4.5", "OWASP_ASVS-V2.5.1", "OWASP_ASVS-V2.5.2", "OWASP_ASVS-V2.5.3", "OWASP_ASVS-V2.5.4", "OWASP_ASVS-V2.5.5", "OWASP_ASVS-V2.5.6", "OWASP_ASVS-V2.5.7", "OWASP_ASVS-V2.6.1", "OWASP_ASVS-V2.6.2", "OWASP_ASVS-V2.6.3", "OWASP_ASVS-V2.7.1", "OWASP_ASVS-V2.7.2", "OWASP_ASVS-V2.7.3", "OWASP_ASVS-V2.7.4", "OWASP_ASVS-V2.7.5", "OWASP_ASVS-V2.7.6", "OWASP_ASVS-V2.8.1", "OWASP_ASVS-V2.8.2", "OWASP_ASVS-V2.8.3", "OWASP_ASVS-V2.8.4", "OWASP_ASVS-V2.8.5", "OWASP_ASVS-V2.8.6", "OWASP_ASVS-V2.8.7", "OWASP_ASVS-V2.9.1", "OWASP_ASVS-V2.9.2", "OWASP_ASVS-V2.9.3", "OWASP_ASVS-V2.10.1", "OWASP_ASVS-V2.10.2", "OWASP_ASVS-V2.10.3", "OWASP_ASVS-V2.10.4",],
-                                       # Project offers file uploads
-                                       "file_upload": ["OWASP_ASVS-V12.1.1", "OWASP_ASVS-V12.1.2", "OWASP_ASVS-V12.1.3",],
-                                       # Project offers file downloads
-                                       "file_download": ["OWASP_ASVS-V12.5.1", "OWASP_ASVS-V12.5.2"],
-                                       # Project uses GraphQL
-                                       "graphql": ["OWASP_ASVS-V13.4.1", "OWASP_ASVS-V13.4.2", "OWASP_WSTG-195", "OWASP_WSTG-196", "OWASP_WSTG-197"],
-                                       # Project uses http or https as web or API interface
-                                       "http_or_https": ["OWASP_ASVS-V14.3.3", "OWASP_ASVS-V5.1.1", "OWASP_ASVS-V5.2.1", "OWASP_ASVS-V8.3.1", "OWASP_ASVS-V9.1.1", "OWASP_ASVS-V9.1.2", "OWASP_ASVS-V9.1.3", "OWASP_ASVS-V9.2.1", "OWASP_ASVS-V9.2.2", "OWASP_ASVS-V9.2.3", "OWASP_ASVS-V9.2.4", "OWASP_ASVS-V9.2.5", "OWASP_ASVS-V13.1.3", "OWASP_ASVS-V13.1.4", " OWASP_ASVS-V13.1.5", "OWASP_ASVS-V13.2.1", "OWASP_ASVS-V13.2.2", "OWASP_ASVS-V13.2.3", "OWASP_ASVS-V13.2.4", "OWASP_ASVS-V13.2.5", "OWASP_ASVS-V13.2.6", "OWASP_ASVS-V14.4.1", "OWASP_ASVS-V14.4.2", "OWASP_ASVS-V14.4.3", "OWASP_ASVS-V14.4.4", "OWASP_ASVS-V14.4.5", "OWASP_ASVS-V14.4.6", "OWASP_ASVS-V14.4.7", "OWASP_ASVS-V14.5.1", "OWASP_ASVS-V14.5.2", "OWASP_ASVS-V14.5.3", "OWASP_ASVS-V14.5.4"],
-                                       # Uses a database (SQL, graphql, json, xml...)
-                                       "database": ["OWASP_ASVS-V13.4.1", "OWASP_ASVS-V13.4.2", "OWASP_WSTG-195", "OWASP_WSTG-196", "OWASP_WSTG-197", "OWASP_ASVS-V5.3.4", "OWASP_ASVS-V5.3.5", "OWASP_ASVS-V5.3.6", "OWASP_ASVS-V5.3.10", "OWASP_ASVS-V5.5.2", "OWASP_ASVS-V5.5.4", "OWASP_ASVS-V6.1.1", "OWASP_ASVS-V6.1.2", "OWASP_ASVS-V6.1.3"],
-                                       # keep deleted and duplicate entries
-                                       "keep_deleted": ["OWASP_ASVS-V1.4.2", "OWASP_ASVS-V1.4.3", "OWASP_ASVS-V1.12.1", "OWASP_ASVS-V4.1.4", "OWASP_ASVS-V7.3.2", "OWASP_ASVS-V13.1.2", "OWASP_ASVS-V13.2.4", "OWASP_ASVS-V14.3.1"],
-                                       # IoT: project contains IoT or is at least connected to one
-                                       "iot": [re.compile("^OWASP_ISVS.*")],
-                                       # mobile application: runs on a mobile phone or similar
-                                       "mobile": [re.compile("^OWASP_MASVS.*")],
-                                       # web technology (using a web page)
-                                       "web": [re.compile("^OWASP_WSTG.*"), "OWASP_ASVS-V14.3.2"],
-                                       # SOAP API technology being used or provided
-                                       "soap": ["OWASP_ASVS-V13.3.1", "OWASP_ASVS-V13.3.2"],
-                                       # REST API being used or provided ?
-                                       "rest": [re.compile(r"OWASP_ASVS-V13.2.\d{1,2}.*")],
-                                       # SQL being used as database ?
-                                       "sql": ["OWASP_ASVS-V5.3.4", "OWASP_ASVS-V5.3.5", "OWASP_MASVS-MASVS-CODE-4", "OWASP_WSTG-1ae57a55d2ec89263111e2c90548239f", "OWASP_WSTG-e1a2c57dab62c521836cce08625f5607"],
-                                       # XML being used for data storage or transfer ?
-                                       "xml": ["OWASP_ASVS-V5.3.10", "OWASP_ASVS-V5.5.2", "OWASP_ASVS-V5.5.3", "OWASP_ASVS-V13.3.1", "OWASP_WSTG-04fd8451791bc8adaae066bcfe127c51", "OWASP_WSTG-ce3b74688e3058a250ee977d07ddddfe"]
-                                       }
+import getpass
+import os
+import time
+import tomllib
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from app.cbx_batch import CbxMarkResult, MarkRecord
+from app.cbx_cache import get_cache_file, lookup_cache, write_cache
+from app.cbx_client import DEFAULT_TOKEN_FILE, get_token_file
+from app.cbx_control import CbxControl, State
+from app.cbx_database import CbxStateDatabase
+from app.cbx_index import CbxIndex
+from app.cbx_profile import PROFILER, profiled
+from app.cbx_rules import CbxRuleEngine, CbxRuleResult, load_tag_rules
+from app.cbx_section import CbxLoadError, CbxSection, parse_data_file
+from app.cbx_stats import CbxStats
+
+# Heavy dependencies are imported by the methods using them. Commands like show and mark do not need them, see benchmarks/bench_startup.py
+if TYPE_CHECKING:
+    from app.cbx_ingest import CbxIngestResult, Finding
+
+# Statement of controls set to not relevant by project tags
+TAG_STATEMENT = "Project does not require that. See project tags: "
+
+# Values accepted as state by mark_control, mark_controls and merge_controls
+VALID_STATES = frozenset(state.value for state in State)
+
+# Parsed config files by absolute name and modification time, see read_config
+CONFIGS: Dict[Tuple[str, int], Dict[str, Any]] = {}
+
+
+def read_config(filename: str) -> Dict[str, Any]:
+    """Parse a config file once per process. Checking for the serve daemon and loading the project share the result.
+
+    A changed file is parsed again. Do not modify the returned data.
+
+    :param filename: The name of the config file
+    :returns: The parsed config
+    """
+    key = (os.path.abspath(filename), os.stat(filename).st_mtime_ns)
+    data = CONFIGS.get(key)
+    if data is None:
+        with open(filename, "rb") as fh:
+            data = CONFIGS[key] = tomllib.load(fh)
+    return data
+
+
+def get_default_author() -> str:
+    """Return the author written to the journal if none is set.
+
+    :returns: The login name or "unknown"
+    """
+    try:
+        return getpass.getuser()
+    except (KeyError, OSError):
+        return "unknown"
 
 
 class CbxEmpire():
@@ -46,78 +64,317 @@ class CbxEmpire():
     def __init__(self) -> None:
         """Init empty checkbox empire class. Add sections by config or manually later."""
         self.sections: List[CbxSection] = []
-        self.database_file_toml: Optional[str] = None
         self.config_file: Optional[str] = None
         self.project: Optional[str] = None
+        self.cache_dir: Optional[str] = None
+        # Workers loading sections in parallel. 0: one per section, up to the number of CPUs. 1: load sequentially
+        self.load_workers: int = 0
+        # Rule id of a tool: UIDs of the controls its findings belong to. Used by ingest in addition to the CWE references
+        self.ingest_rules: Dict[str, List[str]] = {}
+        # Address of the serve daemon. Commands use it if it is running
+        self.server: Optional[str] = None
+        # The serve daemon writes the token clients have to send into this file. Relative to the config file
+        self.server_token_file: str = DEFAULT_TOKEN_FILE
+        self.load_duration: float = 0.0
+        self.author: str = get_default_author()
+        # UIDs of the controls changed by mark_control or mark_controls since the last save. Used as ordered set
+        self.changed_uids: Dict[str, None] = {}
+        self.index: CbxIndex = CbxIndex()
+        self.stats = CbxStats()
+        self.sections_by_prefix: Dict[str, CbxSection] = {}
+        # Rules of the disabled project tags and their result so far. Sections loaded lazily are evaluated when they are loaded
+        self.tag_engine: Optional[CbxRuleEngine] = None
+        self.tag_result = CbxRuleResult()
+        # Stored states of controls in sections that are not loaded yet, by section prefix
+        self.pending_states: Dict[str, Dict[str, Tuple[str, str]]] = {}
+        # The stored states: toml database and journal or SQLite
+        self.database = CbxStateDatabase(self)
+
+    def add_section(self, section: CbxSection) -> None:
+        """Add a section to the empire. Its controls are registered in the UID index, now and when loaded later.
+
+        :param section: The section to add
+        """
+        section.set_index(self.index)
+        section.stats.attach(self.stats)
+        self.sections.append(section)
+        self.sections_by_prefix[str(section.manual_prefix)] = section
 
-    def load_config(self, filename: str) -> None:
+    @profiled("load_config")
+    def load_config(self, filename: str, load_sections: bool = True, lazy: bool = False, catalogue: Optional["CbxEmpire"] = None,
+                    load_states: bool = True) -> None:
         """Load configuration and create the project based on it.
 
         :param filename: The name of the main config file to load
+        :param load_sections: Load the data files and states. Not required for queries on the SQLite backend
+        :param lazy: Only load the data file of a section when it is accessed. For commands working on single controls
+        :param catalogue: Use the sections of this loaded project instead of loading the data files. Its states are overwritten
+        :param load_states: Apply the stored states. Without them the controls have the states of the data files and project tags
         """
-        with open(filename, "rt", encoding="UTF-8") as fh:
-            data = tomlkit.load(fh)
-
-            if "database_file_toml" in data:
-                self.database_file_toml = str(data["database_file_toml"])
-            self.config_file = filename
-            self.project = str(data["project"])
-
-            sections = data["sections"]
-
-            for item in sections.items():  # type: ignore
-                new_section = CbxSection(name=item[1]["name"],
-                                         prefix=item[1]["prefix"],
-                                         description=item[1]["description"])
-                if item[1]["file_type"] == "OWASP_ASVS_JSON":
-                    new_section.load_asvs_json(item[1]["data_file"])
-                elif item[1]["file_type"] == "OWASP_ISVS_JSON":
-                    new_section.load_isvs_json(item[1]["data_file"])
-                elif item[1]["file_type"] == "OWASP_MASVS_YAML":
-                    new_section.load_masvs_yaml(str(item[1]["data_file"]))
-                elif item[1]["file_type"] == "OWASP_WSTG_JSON":
-                    new_section.load_wstg_json(str(item[1]["data_file"]))
-
-                self.sections.append(new_section)
-
-            #  For the Mypy ignore: It is a list. Better checks are possible when using pydantic. This is planned
-            tags: List[Any] = data["project_tags"]   # type: ignore
-            for tag in tags:
-                if tags[tag] is False:
-                    for uid in required_tags[tag]:
-                        if isinstance(uid, str):
-                            self.mark_control(uid, "not_relevant", "Project does not require that. See project tags")
-                            print(f"Setting as irrelevant because {tag} is false: {uid}")
-                        elif isinstance(uid, re.Pattern):
-                            for control_uid in self.list_all_control_uids():
-                                if uid.search(control_uid) is not None:
-                                    self.mark_control(control_uid, "not_relevant", "Project does not require that. See project tags")
+        data = read_config(filename)
 
-        # Load project specific states for the controls
-        self.load_toml_database()
-
-    def load_toml_database(self) -> None:
-        """Load the database assigning states to controls."""
-        if self.database_file_toml is not None:
-            with open(self.database_file_toml, "rt", encoding="UTF-8") as fh:
-                data = tomlkit.load(fh)
-                if "controls" in data:
-                    for control in data.item("controls"):   # type: ignore
-                        self.mark_control(control["uid"], control["state"], control["statement"])
-
-    def save_toml_database(self) -> None:
-        """Save the database assigning states to controls."""
-        if self.database_file_toml is not None:
-            data: dict[str, list[dict[str, str]]] = {"controls": []}
+        self.database.configure(data)
+        if "cache_dir" in data:
+            self.cache_dir = str(data["cache_dir"])
+        if "load_workers" in data:
+            self.load_workers = int(data["load_workers"])
+        if "ingest_rules" in data:
+            self.ingest_rules = {str(rule): [str(uid) for uid in uids] for rule, uids in data["ingest_rules"].items()}
+        if "server" in data:
+            self.server = str(data["server"])
+        self.server_token_file = get_token_file(filename, str(data.get("server_token_file", DEFAULT_TOKEN_FILE)))
+        self.config_file = filename
+        self.project = str(data["project"])
+
+        if not load_sections:
+            return
+
+        sections = data["sections"]
+
+        if catalogue is not None:
+            self.share_catalogue(catalogue)
+        else:
+            self.add_sections(sections)
+
+        # Project tags set to false mark the controls matched by their rule as not relevant. Rules for a whole catalogue skip evaluating its controls
+        tags: Dict[str, Any] = data.get("project_tags", {})
+        rules = load_tag_rules(data.get("tag_rules"), tags)
+        if rules:
+            self.tag_engine = CbxRuleEngine(rules)
+            self.tag_result.counts = {rule.tag: 0 for rule in rules}
+            for section in self.sections:
+                section.disabled_tags = self.tag_engine.get_section_tags(str(section.manual_prefix))
+                if section.disabled_tags:
+                    # Lazy sections keep the statement until they are loaded
+                    section.set_not_relevant(TAG_STATEMENT + ", ".join(section.disabled_tags))
+
+        if catalogue is not None:
             for section in self.sections:
-                for group in section.get_groups():
-                    for item in group.get_items():
-                        for control in item.get_controls():
-                            data["controls"].append({"uid": control.get_uid(),
-                                                     "state": control.state.value,
-                                                     "statement": control.statement or ""})
-            with open(self.database_file_toml, "wt", encoding="UTF-8") as fh:
-                tomlkit.dump(data, fh)
+                self._apply_project_tags(section)
+        elif not lazy:
+            self.load_all()
+        if self.tag_engine is not None and (catalogue is not None or not lazy):
+            self.tag_result.print_summary()
+
+        # Load project specific states for the controls
+        if load_states:
+            self.database.load()
+        else:
+            self.database.ignore_stored_states()
+
+    def add_sections(self, sections: Dict[str, Any]) -> None:
+        """Create the sections of the [sections] table of a config. Their data files are loaded when accessed or by load_all.
+
+        :param sections: The sections table
+        """
+        for item in sections.items():
+            new_section = CbxSection(name=item[1]["name"],
+                                     prefix=item[1]["prefix"],
+                                     description=item[1]["description"])
+            self.add_section(new_section)
+            new_section.set_source(str(item[1]["file_type"]), str(item[1]["data_file"]), self.cache_dir, self._on_section_loaded)
+
+    def load_catalogue(self, filename: str) -> None:
+        """Load only the sections of a config, without project tags and states. Projects with the same sections can share them.
+
+        :param filename: The name of the config file
+        """
+        self.load_config(filename, load_sections=False)
+        self.add_sections(read_config(filename)["sections"])
+        self.load_all()
+
+    @profiled("load_sections")
+    def load_all(self) -> None:
+        """Load the data files of all sections that are not loaded yet, in parallel if configured."""
+        pending = [section for section in self.sections if section.source is not None]
+        jobs = []
+        for section in pending:
+            if section.source is not None:
+                jobs.append((section, section.source[0], section.source[1]))
+                section.source = None
+        if not jobs:
+            return
+        start = time.perf_counter()
+        self.load_sections(jobs, self.load_workers)
+        self.load_duration += time.perf_counter() - start
+        for section in pending:
+            section.loaded()
+
+    def _on_section_loaded(self, section: CbxSection) -> None:
+        """Apply the project tag rules and the stored states to a freshly loaded section.
+
+        :param section: The loaded section
+        """
+        PROFILER.count("sections_loaded")
+        PROFILER.count("sections_from_cache", section.loaded_from_cache)
+        PROFILER.count("controls_loaded", section.stats.get_total())
+        self._apply_project_tags(section)
+        for uid, (state, statement) in self.pending_states.pop(str(section.manual_prefix), {}).items():
+            self.apply_state(uid, state, statement)
+
+    def _apply_project_tags(self, section: CbxSection) -> None:
+        """Set the controls of a loaded section that are matched by the rules of the disabled project tags to not relevant.
+
+        Sections disabled as a whole are already set by set_not_relevant. Only the UIDs listed by the rules get the tags of all
+        rules matching them, like when every control is evaluated.
+
+        :param section: The loaded section
+        """
+        if self.tag_engine is not None:
+            if section.disabled_tags:
+                count = section.stats.get_total()
+                PROFILER.count("tag_rules_section_not_relevant", count)
+                for tag in section.disabled_tags:
+                    self.tag_result.counts[tag] = self.tag_result.counts.get(tag, 0) + count
+                self.tag_result.evaluated += count
+                for uid in self.tag_engine.get_listed_uids(str(section.manual_prefix)):
+                    control = self.index.find(uid)
+                    if control is not None:
+                        tags = self.tag_engine.match(uid)
+                        control.set_state("not_relevant", TAG_STATEMENT + ", ".join(tags))
+                        for tag in tags:
+                            if tag not in section.disabled_tags:
+                                self.tag_result.counts[tag] = self.tag_result.counts.get(tag, 0) + 1
+            else:
+                self.tag_result.merge(self.apply_tag_rules(self.tag_engine, section.get_uids()))
+
+    def share_catalogue(self, catalogue: "CbxEmpire") -> None:
+        """Use the sections, controls and statistics of a catalogue with the same sections. The states of the controls are overwritten.
+
+        The controls have to be in the state of the data files, see load_catalogue. Only one of the projects sharing a catalogue has
+        its states on the controls at a time, see CbxPortfolio.
+
+        :param catalogue: The loaded catalogue
+        """
+        catalogue.load_all()
+        self.sections = catalogue.sections
+        self.sections_by_prefix = catalogue.sections_by_prefix
+        self.index = catalogue.index
+        self.stats = catalogue.stats
+
+    def route_uid(self, uid: str) -> Optional[CbxSection]:
+        """Find the section a UID belongs to by its prefix. Works for sections that are not loaded yet.
+
+        :param uid: The UID of a control
+        :returns: The section or None
+        """
+        section = self.sections_by_prefix.get(uid.partition("-")[0])
+        if section is None:
+            for candidate in self.sections:
+                if uid.startswith(f"{candidate.manual_prefix}-"):
+                    return candidate
+        return section
+
+    def load_sections(self, jobs: List[Tuple[CbxSection, str, str]], workers: int = 0) -> None:
+        """Load the data files of several sections, in parallel if there are several workers.
+
+        Hashing and cache lookups run in a thread pool, data files without cache are parsed in a process pool.
+        The trees are added to the sections in the order of the jobs, so the UID index does not depend on timing.
+
+        :param jobs: (section, file_type, data_file) for every section
+        :param workers: Number of workers. 0: one per section, up to the number of CPUs. 1: load sequentially
+        :raises CbxLoadError: If some data files could not be loaded. Contains the error of every failed section
+        """
+        if workers <= 0:
+            workers = min(len(jobs), os.cpu_count() or 1)
+        errors: Dict[str, str] = {}
+
+        if workers <= 1:
+            for section, file_type, filename in jobs:
+                try:
+                    section.load_data_file(file_type, filename, self.cache_dir)
+                except Exception as e:  # pylint: disable=broad-except
+                    errors[str(section.manual_prefix)] = f"{filename}: {e!r}"
+            if errors:
+                raise CbxLoadError(errors)
+            return
+
+        # Loads multiprocessing, only needed for parallel loading
+        from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor  # pylint: disable=import-outside-toplevel
+        known = [job for job in jobs if job[1] in job[0].get_loaders()]
+        for section, file_type, filename in jobs:
+            if file_type not in section.get_loaders():
+                print(f"Unknown file type {file_type} for {filename}. Skipping it")
+
+        trees: Dict[int, Future[Optional[Tuple[Any, ...]]]] = {}
+        with PROFILER.phase("cache_lookup"), ThreadPoolExecutor(max_workers=workers) as threads:
+            for number, (section, file_type, filename) in enumerate(known):
+                trees[number] = threads.submit(lookup_cache, section, file_type, filename, self.cache_dir)
+        cached = {number for number, future in trees.items() if future.exception() is None and future.result() is not None}
+
+        # The load duration of a section adds up its own lookup, parse and tree building, not the time waiting for the others
+        misses = [number for number, future in trees.items() if future.exception() is None and number not in cached]
+        parsed: Dict[int, Future[Tuple[Tuple[Any, ...], float]]] = {}
+        if len(misses) > 1:
+            with PROFILER.phase("parse"), ProcessPoolExecutor(max_workers=min(workers, len(misses))) as processes:
+                for number in misses:
+                    section, file_type, filename = known[number]
+                    parsed[number] = processes.submit(parse_data_file, file_type, filename, str(section.manual_prefix))
+        elif misses:
+            section, file_type, filename = known[misses[0]]
+            parsed[misses[0]] = Future()
+            try:
+                with PROFILER.phase("parse"):
+                    parsed[misses[0]].set_result(parse_data_file(file_type, filename, str(section.manual_prefix)))
+            except Exception as e:  # pylint: disable=broad-except
+                parsed[misses[0]].set_exception(e)
+
+        with PROFILER.phase("build_tree"):
+            for number, (section, file_type, filename) in enumerate(known):
+                try:
+                    tree: Optional[Tuple[Any, ...]]
+                    if number in parsed:
+                        tree, duration = parsed[number].result()
+                        section.load_duration += duration
+                    else:
+                        tree = trees[number].result()
+                    start = time.perf_counter()
+                    if tree is not None:
+                        section.from_cache(tree)
+                        section.loaded_from_cache = number in cached
+                        if self.cache_dir is not None and not section.loaded_from_cache:
+                            write_cache(get_cache_file(self.cache_dir, section.data_hash), section.to_cache())
+                    section.load_duration += time.perf_counter() - start
+                except Exception as e:  # pylint: disable=broad-except
+                    errors[str(section.manual_prefix)] = f"{filename}: {e!r}"
+        if errors:
+            raise CbxLoadError(errors)
+
+    @profiled("tag_rules")
+    def apply_tag_rules(self, engine: CbxRuleEngine, uids: Optional[Iterable[str]] = None) -> CbxRuleResult:
+        """Evaluate the project tag rules on controls in a single pass and set the matching ones to not relevant.
+
+        :param engine: The compiled rules of the disabled project tags
+        :param uids: The UIDs of the controls to evaluate. None evaluates all controls
+        :returns: The matched UIDs, counts per tag and evaluation time
+        """
+        if uids is None:
+            self.load_all()
+            uids = self.index.controls.keys()
+        result = engine.evaluate(uids)
+        for uid, matched_tags in result.matches.items():
+            self.index.controls[uid].set_state("not_relevant", TAG_STATEMENT + ", ".join(matched_tags))
+        PROFILER.count("tag_rules_evaluated", result.evaluated)
+        return result
+
+    def get_tag_states(self, uids_by_section: Dict[str, List[str]]) -> Iterator[Tuple[str, str, str]]:
+        """Return the states the project tag rules set, without loading the sections. Used by queries on the SQLite backend.
+
+        :param uids_by_section: The UIDs of the controls by section prefix
+        :returns: A generator of (uid, state, statement) for the controls set to not relevant
+        """
+        if self.tag_engine is None:
+            return
+        for prefix, uids in uids_by_section.items():
+            section = self.sections_by_prefix.get(prefix)
+            if section is not None and section.disabled_tags:
+                statement = TAG_STATEMENT + ", ".join(section.disabled_tags)
+                listed = set(self.tag_engine.get_listed_uids(prefix))
+                for uid in uids:
+                    yield uid, "not_relevant", TAG_STATEMENT + ", ".join(self.tag_engine.match(uid)) if uid in listed else statement
+            else:
+                for uid, matched_tags in self.tag_engine.evaluate(uids).matches.items():
+                    yield uid, "not_relevant", TAG_STATEMENT + ", ".join(matched_tags)
 
     def pretty_print(self) -> None:
         """Do some pretty printing."""
@@ -129,35 +386,30 @@ class CbxEmpire():
 
         :returns: A dict containing the core data of this class
         """
+        self.load_all()
         data: dict[str, list[dict[str, Union[Optional[str], List[dict[str, Union[Optional[str], int, List[dict[str, Union[Optional[str], int, List[dict[str, Union[Optional[str], int, List[str], List[int]]]]]]]]]]]]]] = {"sections": []}
         for section in self.sections:
             data["sections"].append(section.to_dict())
         return data
 
-    def export_to_toml(self, filename: str) -> None:
-        """Dump all the data to a toml file.
-
-        :param filename: The name of the toml to write
-        """
-        with open(filename, "wt", encoding="UTF-8") as fh:
-            fh.write(tomlkit.dumps(self.to_dict()))
-
     def find_control_by_uid(self, uid: str) -> Optional[CbxControl]:
         """Find and return a control by uid.
 
         :param uid: the UID of the element to find
         :returns: A control or None
         """
-        for section in self.sections:
-            for group in section.get_groups():
-                for item in group.get_items():
-                    for control in item.get_controls():
-                        if control.get_uid() == uid:
-                            return control
-        return None
+        control = self.index.find(uid)
+        if control is None:
+            # The section may not be loaded yet
+            section = self.route_uid(uid)
+            if section is not None and not section.is_loaded():
+                section.ensure_loaded()
+                control = self.index.find(uid)
+        return control
 
     def list_all_control_uids(self) -> List[str]:
         """Return a list of all uids used for controls."""
+        self.load_all()
         res = []
         for section in self.sections:
             for group in section.get_groups():
@@ -166,31 +418,103 @@ class CbxEmpire():
                         res.append(control.get_uid())
         return res
 
-    def print_control_list(self) -> None:
-        """Find and return a control by uid."""
-        for section in self.sections:
-            for group in section.get_groups():
-                for item in group.get_items():
-                    for control in item.get_controls():
-                        text = control.statement or control.description
-                        print(f"[{control.state.name}] {control.get_uid()}\t  {text}\t ")
-
-    def mark_control(self, uid: str, state: str, statement: str = "") -> None:
+    def mark_control(self, uid: str, state: str, statement: str = "") -> bool:
         """Set the state of a control defined by uid.
 
         :param uid: the UID of the element to mark
         :param state: The state to set.
         :param statement: A statement describing why the state has been set that way
+        :returns: True if the state was set and recorded as change to save
+        """
+        if state not in VALID_STATES:
+            print(f"Invalid state {state}. Available states: {', '.join(member.value for member in State)}")
+            return False
+        if self.find_control_by_uid(uid) is not None and self.apply_state(uid, state, statement):
+            self.changed_uids[uid] = None
+            PROFILER.count("marks_applied")
+            return True
+        PROFILER.count("uids_not_found")
+        return False
+
+    def apply_state(self, uid: str, state: str, statement: str = "") -> bool:
+        """Set the state of a control without recording it as change to save. Used when loading the database.
+
+        :param uid: the UID of the element to mark
+        :param state: The state to set.
+        :param statement: A statement describing why the state has been set that way
+        :returns: True if the state is valid and the control exists or its section is not loaded yet
+        """
+        if state not in VALID_STATES:
+            return False
+        control = self.index.find(uid)
+        if control is None:
+            section = self.route_uid(uid)
+            if section is None or section.is_loaded():
+                return False
+            # Applied when the section is loaded
+            self.pending_states.setdefault(str(section.manual_prefix), {})[uid] = (state, statement)
+            return True
+        control.set_state(state, statement)
+        return True
+
+    @profiled("mark")
+    def mark_controls(self, records: Iterable[MarkRecord]) -> CbxMarkResult:
+        """Set the states of many controls. Does not save the database, call database.save once afterwards.
+
+        :param records: (uid, state, statement) tuples
+        :returns: A summary with the number of applied marks, unknown UIDs and invalid states
+        """
+        result = CbxMarkResult()
+        for uid, state, statement in records:
+            control = self.find_control_by_uid(uid)
+            if control is None:
+                result.unknown_uids.append(uid)
+            elif state not in VALID_STATES:
+                result.invalid_states.append((uid, state, statement))
+            else:
+                control.set_state(state, statement)
+                self.changed_uids[uid] = None
+                result.applied += 1
+        PROFILER.count("marks_applied", result.applied)
+        PROFILER.count("uids_not_found", len(result.unknown_uids))
+        return result
+
+    @profiled("merge")
+    def merge_controls(self, records: Iterable[MarkRecord], dry_run: bool = False) -> CbxMarkResult:
+        """Apply only the records that differ from the current state and statement. Does not save the database.
+
+        :param records: (uid, state, statement) tuples, for example read from an exported CSV file
+        :param dry_run: Only compare, do not change the states
+        :returns: A summary with the changes and the number of unchanged records
+        """
+        result = CbxMarkResult()
+        for uid, state, statement in records:
+            control = self.find_control_by_uid(uid)
+            if control is None:
+                result.unknown_uids.append(uid)
+            elif state not in VALID_STATES:
+                result.invalid_states.append((uid, state, statement))
+            elif control.state.value == state and (control.statement or "") == statement:
+                result.unchanged += 1
+            else:
+                result.changes.append((uid, control.state.value, state))
+                if not dry_run:
+                    control.set_state(state, statement)
+                    self.changed_uids[uid] = None
+                    result.applied += 1
+        PROFILER.count("marks_applied", result.applied)
+        PROFILER.count("uids_not_found", len(result.unknown_uids))
+        return result
+
+    @profiled("ingest")
+    def ingest_findings(self, findings: Iterable["Finding"], source: str) -> Tuple["CbxIngestResult", CbxMarkResult]:
+        """Map tool findings to controls and mark them in one batch. Does not save the database.
+
+        :param findings: The findings, see read_findings
+        :param source: Name of the tool or file, used in the statements
+        :returns: The collected findings and the summary of the marks
         """
-        control = self.find_control_by_uid(uid)
-        if control is not None:
-            control.set_state(state, statement)
-
-    def generate_html_report(self, template_file: str, outfile: str) -> None:
-        """Generate a html report."""
-        env = Environment(loader=FileSystemLoader("."),
-                          autoescape=select_autoescape()
-                          )
-        template = env.get_template(template_file)
-        with open(outfile, "wt", encoding="utf-8") as fh:
-            fh.write(template.render(data=self.to_dict()))
+        from app.cbx_ingest import CbxFindingMap, CbxIngestResult  # pylint: disable=import-outside-toplevel
+        self.load_all()
+        result = CbxIngestResult(source).collect(findings, CbxFindingMap(self.index, self.ingest_rules))
+        return result, self.mark_controls(result.get_records(self.index))
@@ -3,13 +3,18 @@
 """A group collects several controls belonging to the same topic. A kind of document-subsection."""
 
 
+import sys
 from app.cbx_item import CbxItem
+from app.cbx_index import CbxIndex
+from app.cbx_stats import CbxStats
 from typing import List, Union, Optional
 
 
 class CbxGroup():
     """A group to collect control items."""
 
+    __slots__ = ("shortcode", "ordinal", "shortname", "name", "items", "index", "stats")
+
     def __init__(self, shortcode: str, ordinal: int, shortname: str, name: str) -> None:
         """Create a group object.
 
@@ -18,11 +23,13 @@ class CbxGroup():
         :param shortname: A short name for this group
         :param name: A long name for this group
         """
-        self.shortcode = shortcode
+        self.shortcode = sys.intern(str(shortcode))
         self.ordinal: int = ordinal
         self.shortname = shortname
         self.name = name
         self.items:List[CbxItem] = []
+        self.index: Optional[CbxIndex] = None
+        self.stats = CbxStats()
 
     def add_item(self, item: CbxItem) -> None:
         """Add an item to the internal item list.
@@ -30,6 +37,18 @@ class CbxGroup():
         :param item: The item to add
         """
         self.items.append(item)
+        item.stats.attach(self.stats)
+        if self.index is not None:
+            item.set_index(self.index)
+
+    def set_index(self, index: Optional[CbxIndex]) -> None:
+        """Attach an UID index to this group and all its items.
+
+        :param index: The index to register controls in
+        """
+        self.index = index
+        for item in self.items:
+            item.set_index(index)
 
     def to_dict(self) -> dict[str, Union[Optional[str], int, List[dict[str, Union[Optional[str], int, List[dict[str, Union[Optional[str], int, List[str], List[int]]]]]]]]]:
         """Return the item as a dict.
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+"""An index mapping control UIDs to controls. Used for fast lookups in the whole empire."""
+
+from typing import Dict, Iterable, List, Optional
+
+from app.cbx_control import CbxControl
+
+
+class CbxIndex():
+    """Index of controls by UID. Sections, groups and items attached to it register their controls."""
+
+    def __init__(self) -> None:
+        """Create an empty index."""
+        self.controls: Dict[str, CbxControl] = {}
+        self.duplicates: List[str] = []
+
+    def add_control(self, control: CbxControl) -> None:
+        """Add a control to the index.
+
+        If another control already uses the same UID the first one is kept and the duplicate is reported.
+
+        :param control: The control to add
+        """
+        uid = control.get_uid()
+        existing = self.controls.get(uid)
+        if existing is None:
+            self.controls[uid] = control
+        elif existing is not control:
+            self.duplicates.append(uid)
+            print(f"Duplicate UID, keeping the first control: {uid}")
+
+    def add_controls(self, controls: Iterable[CbxControl]) -> None:
+        """Add several controls to the index.
+
+        :param controls: The controls to add
+        """
+        for control in controls:
+            self.add_control(control)
+
+    def find(self, uid: str) -> Optional[CbxControl]:
+        """Find a control by UID.
+
+        :param uid: The UID to look up
+        :returns: A control or None
+        """
+        return self.controls.get(uid)
+
+    def uids(self) -> List[str]:
+        """Return all indexed UIDs in the order they were added.
+
+        :returns: A list of UIDs
+        """
+        return list(self.controls.keys())
+
+    def __contains__(self, uid: object) -> bool:
+        """Check if a UID is indexed.
+
+        :param uid: The UID to check
+        :returns: True if the UID is known
+        """
+        return uid in self.controls
+
+    def __len__(self) -> int:
+        """Return the number of indexed controls.
+
+        :returns: Number of controls
+        """
+        return len(self.controls)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+"""Ingest results of security tools. Maps findings of SARIF, JUnit XML and JSON lines files onto control states."""
+
+import json
+import re
+import time
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, TextIO, Tuple
+# Only local result files of own build tools are parsed
+from xml.etree.ElementTree import iterparse  # nosec
+
+from app.cbx_batch import MarkRecord
+from app.cbx_control import State
+from app.cbx_index import CbxIndex
+from app.cbx_stream import iter_json_arrays
+
+# Matches CWE references like CWE-79, cwe_79 or external/cwe/cwe-079
+CWE_RE = re.compile(r"cwe[-_:/ ]?0*(\d+)", re.IGNORECASE)
+
+# A single tool result: rule id, referenced CWEs, failed
+Finding = Tuple[str, Set[int], bool]
+
+# Rule ids listed in a statement, the rest is counted
+STATEMENT_RULES = 5
+
+
+def find_cwes(*texts: Any) -> Set[int]:
+    """Collect the CWE numbers referenced in texts.
+
+    :param texts: Strings or lists of strings to scan. Other values are ignored
+    :returns: The CWE numbers
+    """
+    res: Set[int] = set()
+    for text in texts:
+        if isinstance(text, list):
+            res |= find_cwes(*text)
+        elif isinstance(text, str):
+            res.update(int(cwe) for cwe in CWE_RE.findall(text))
+    return res
+
+
+def read_sarif_findings(fh: TextIO) -> Iterator[Finding]:
+    """Read the results of a SARIF file incrementally.
+
+    CWEs are taken from the tags and relationships of the rules and from the tags and taxa of the results.
+    Results of kind pass are passes, results of kind notApplicable, informational or review and results on level note or none are skipped.
+
+    :param fh: The file handle to read from
+    :returns: A generator of findings
+    """
+    rule_cwes: Dict[str, Set[int]] = {}
+    for key, item in iter_json_arrays(fh, ("rules", "results")):
+        if not isinstance(item, dict):
+            continue
+        if key == "rules":
+            properties = item.get("properties") or {}
+            relations = [relation.get("target", {}).get("id") for relation in item.get("relationships") or []]
+            rule_cwes[str(item.get("id"))] = find_cwes(properties.get("tags"), properties.get("cwe"), relations)
+            continue
+        rule_id = str(item.get("ruleId") or (item.get("rule") or {}).get("id"))
+        kind = item.get("kind", "fail")
+        if kind in ("notApplicable", "informational", "review") or item.get("level") in ("note", "none"):
+            continue
+        properties = item.get("properties") or {}
+        taxa = [taxon.get("id") for taxon in item.get("taxa") or []]
+        cwes = rule_cwes.get(rule_id, set()) | find_cwes(properties.get("tags"), taxa)
+        yield rule_id, cwes, kind != "pass"
+
+
+def read_junit_findings(fh: TextIO) -> Iterator[Finding]:
+    """Read the test cases of a JUnit XML file incrementally.
+
+    The rule id is classname.name of the test case. CWEs are taken from the name, the classname and a property named cwe.
+    Test cases with failure or error fail, skipped test cases are ignored.
+
+    :param fh: The file handle to read from
+    :returns: A generator of findings
+    """
+    # Open elements from the root down. Finished elements are removed from their parent, also in nested test suites
+    parents: List[Any] = []
+    in_testcase = 0
+    for event, element in iterparse(fh, events=("start", "end")):  # nosec
+        if event == "start":
+            parents.append(element)
+            in_testcase += element.tag == "testcase"
+            continue
+        parents.pop()
+        if element.tag == "testcase":
+            in_testcase -= 1
+            tags = {child.tag for child in element}
+            if "skipped" not in tags:
+                name = element.get("name", "")
+                classname = element.get("classname", "")
+                properties = [prop.get("value", "") for prop in element.iter("property") if prop.get("name") == "cwe"]
+                cwes = find_cwes(name, classname, [f"CWE-{value}" for value in properties])
+                yield f"{classname}.{name}" if classname else name, cwes, bool(tags & {"failure", "error"})
+        # The children of a test case are needed until it ends. Everything else is dropped when finished to keep the memory flat
+        if not in_testcase:
+            element.clear()
+            if parents:
+                parents[-1].remove(element)
+
+
+def read_jsonl_findings(fh: TextIO) -> Iterator[Finding]:
+    """Read findings from JSON lines. Every line is an object with rule, cwe and status.
+
+    cwe is a number, a CWE reference or a list of them. status is pass or fail, default fail.
+
+    :param fh: The file handle to read from
+    :returns: A generator of findings
+    """
+    for line in fh:
+        if not line.strip():
+            continue
+        data = json.loads(line)
+        cwe = data.get("cwe", [])
+        if not isinstance(cwe, list):
+            cwe = [cwe]
+        cwes = find_cwes([f"CWE-{value}" if isinstance(value, int) else str(value) for value in cwe])
+        yield str(data.get("rule") or data.get("uid") or ""), cwes, data.get("status", "fail") != "pass"
+
+
+def read_findings(fh: TextIO, file_format: str) -> Iterator[Finding]:
+    """Read findings in the given format.
+
+    :param fh: The file handle to read from
+    :param file_format: sarif, junit or jsonl
+    :returns: A generator of findings
+    """
+    readers = {"sarif": read_sarif_findings,
+               "junit": read_junit_findings,
+               "jsonl": read_jsonl_findings}
+    if file_format not in readers:
+        raise ValueError(f"Unknown format {file_format}. Available formats: {', '.join(readers)}")
+    return readers[file_format](fh)
+
+
+def guess_findings_format(filename: str) -> str:
+    """Guess the findings format from the file name.
+
+    :param filename: The name of the file
+    :returns: sarif, junit or jsonl
+    """
+    if filename.endswith((".sarif", ".sarif.json")):
+        return "sarif"
+    if filename.endswith(".xml"):
+        return "junit"
+    return "jsonl"
+
+
+class CbxFindingMap():
+    """Maps findings to control UIDs by CWE, by rule id table and by rule ids that are UIDs."""
+
+    def __init__(self, index: CbxIndex, rule_map: Optional[Dict[str, List[str]]] = None) -> None:
+        """Build the CWE table from the cwe field of all controls.
+
+        :param index: The UID index of the controls
+        :param rule_map: Rule id to UIDs. Used for rules without CWE reference
+        """
+        self.index = index
+        self.rule_map: Dict[str, List[str]] = rule_map or {}
+        self.cwe_map: Dict[int, List[str]] = {}
+        for uid, control in index.controls.items():
+            for cwe in control.cwe:
+                self.cwe_map.setdefault(cwe, []).append(uid)
+
+    def get_uids(self, rule_id: str, cwes: Iterable[int]) -> Set[str]:
+        """Return the UIDs of the controls a finding belongs to.
+
+        :param rule_id: The rule id of the finding
+        :param cwes: The CWEs of the finding
+        :returns: The UIDs
+        """
+        uids = set(self.rule_map.get(rule_id, ()))
+        if rule_id in self.index:
+            uids.add(rule_id)
+        for cwe in cwes:
+            uids.update(self.cwe_map.get(cwe, ()))
+        return uids
+
+    def map_findings(self, findings: Iterable[Finding]) -> Iterator[Tuple[str, Set[str], bool]]:
+        """Add the UIDs of the controls to the findings. Findings of the same rule and CWEs map to the same controls, they are looked up once.
+
+        :param findings: The findings to map
+        :returns: A generator of (rule id, UIDs, failed)
+        """
+        mapped: Dict[Tuple[str, FrozenSet[int]], Set[str]] = {}
+        for rule_id, cwes, failed in findings:
+            key = (rule_id, frozenset(cwes))
+            uids = mapped.get(key)
+            if uids is None:
+                uids = mapped[key] = self.get_uids(rule_id, cwes)
+            yield rule_id, uids, failed
+
+
+class CbxIngestResult():
+    """Findings collected per control. Creates the mark records for a single batch."""
+
+    def __init__(self, source: str) -> None:
+        """Create an empty result.
+
+        :param source: Name of the tool or file, used in the statements
+        """
+        self.source = source
+        self.findings: int = 0
+        self.unmapped: int = 0
+        self.duration: float = 0.0
+        # uid: rule ids with failures, rule ids passed
+        self.failed: Dict[str, Dict[str, int]] = {}
+        self.passed: Dict[str, Dict[str, None]] = {}
+
+    def collect(self, findings: Iterable[Finding], finding_map: CbxFindingMap) -> "CbxIngestResult":
+        """Assign findings to controls.
+
+        :param findings: The findings to collect
+        :param finding_map: Maps findings to UIDs
+        :returns: self
+        """
+        start = time.perf_counter()
+        for rule_id, uids, failed in finding_map.map_findings(findings):
+            self.findings += 1
+            if not uids:
+                self.unmapped += 1
+            for uid in uids:
+                if failed:
+                    rules = self.failed.setdefault(uid, {})
+                    rules[rule_id] = rules.get(rule_id, 0) + 1
+                else:
+                    self.passed.setdefault(uid, {})[rule_id] = None
+        self.duration += time.perf_counter() - start
+        return self
+
+    @staticmethod
+    def describe(rule_ids: Iterable[str]) -> str:
+        """List rule ids for a statement.
+
+        :param rule_ids: The rule ids
+        :returns: The first rule ids and the number of the others
+        """
+        rule_ids = list(rule_ids)
+        res = ", ".join(rule_ids[:STATEMENT_RULES])
+        if len(rule_ids) > STATEMENT_RULES:
+            res += f" and {len(rule_ids) - STATEMENT_RULES} more"
+        return res
+
+    def get_records(self, index: CbxIndex) -> List[MarkRecord]:
+        """Create the mark records. Controls with failures are unchecked, controls with only passes are checked.
+
+        Controls that are not relevant and controls that already have the resulting state and statement are left alone.
+
+        :param index: The UID index of the controls
+        :returns: The mark records
+        """
+        records: List[MarkRecord] = []
+        for uid in self.failed.keys() | self.passed.keys():
+            control = index.find(uid)
+            if control is None or control.state == State.NOT_RELEVANT:
+                continue
+            if uid in self.failed:
+                rules = self.failed[uid]
+                record = (uid, State.UNCHECKED.value, f"{self.source}: {sum(rules.values())} findings of {self.describe(sorted(rules))}")
+            else:
+                record = (uid, State.CHECKED.value, f"{self.source}: passed {self.describe(sorted(self.passed[uid]))}")
+            if (control.state.value, control.statement or "") != record[1:]:
+                records.append(record)
+        records.sort()
+        return records
+
+    def print_summary(self) -> None:
+        """Print the summary."""
+        print(f"Findings: {self.findings} in {self.duration:.1f} s, not mapped to a control: {self.unmapped}")
+        print(f"Controls with failures: {len(self.failed)}, passed: {len(self.passed.keys() - self.failed.keys())}")
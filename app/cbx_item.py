@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 
 """An item collecting several "controls" which are checkboxes."""
+import sys
 from typing import List, Union, Optional
 from app.cbx_control import CbxControl
+from app.cbx_index import CbxIndex
+from app.cbx_stats import CbxStats
 
 
 class CbxItem():
     """A checkbox item, a collection of controls."""
 
+    __slots__ = ("shortcode", "ordinal", "name", "controls", "index", "stats")
+
     def __init__(self, shortcode: str, ordinal: int, name: str) -> None:
         """Create an item object.
 
@@ -15,10 +20,12 @@ class CbxItem():
         :param ordinal: A counter for this item
         :param name: The name of this item
         """
-        self.shortcode = shortcode
+        self.shortcode = sys.intern(str(shortcode))
         self.ordinal = ordinal
         self.name = name
         self.controls: List[CbxControl] = []
+        self.index: Optional[CbxIndex] = None
+        self.stats = CbxStats()
 
     def add_control(self, control: CbxControl) -> None:
         """Add a control to the item.
@@ -26,6 +33,19 @@ class CbxItem():
         :param control: The control to add
         """
         self.controls.append(control)
+        control.stats = self.stats
+        self.stats.add({control.state: 1})
+        if self.index is not None:
+            self.index.add_control(control)
+
+    def set_index(self, index: Optional[CbxIndex]) -> None:
+        """Attach an UID index. Existing and future controls will be registered there.
+
+        :param index: The index to register controls in
+        """
+        self.index = index
+        if index is not None:
+            index.add_controls(self.controls)
 
     def get_controls(self) -> List[CbxControl]:
         """Return a list of controls in this item.
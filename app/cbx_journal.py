@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+"""Append-only journal of control state changes. Together with the toml database snapshot it holds the project states."""
+
+import json
+import os
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator
+
+
+class CbxJournal():
+    """A JSON lines file with one entry per state change: uid, state, statement, timestamp and author.
+
+    The journal is never rewritten. The database snapshot remembers the journal size when it was compacted, loading replays only the entries after that.
+    This way the journal is also the audit trail of all state changes.
+    """
+
+    def __init__(self, filename: str) -> None:
+        """Create a journal object.
+
+        :param filename: The name of the journal file
+        """
+        self.filename = filename
+
+    def size(self) -> int:
+        """Return the size of the journal in bytes. Used as offset for replaying.
+
+        :returns: The size of the journal file, 0 if it does not exist
+        """
+        try:
+            return os.path.getsize(self.filename)
+        except FileNotFoundError:
+            return 0
+
+    @staticmethod
+    def create_entry(uid: str, state: str, statement: str, author: str) -> Dict[str, str]:
+        """Create a journal entry. Use write to store a list of entries. The state backends use the same format.
+
+        :param uid: The UID of the changed control
+        :param state: The new state
+        :param statement: The new statement
+        :param author: Who changed the state
+        :returns: The journal entry
+        """
+        return {"uid": uid,
+                "state": state,
+                "statement": statement,
+                "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "author": author}
+
+    def write(self, entries: Iterable[Dict[str, str]]) -> int:
+        """Append entries to the journal with a single write.
+
+        :param entries: The entries to append
+        :returns: The number of entries written
+        """
+        lines = [json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries]
+        if lines:
+            with open(self.filename, "at", encoding="utf-8") as fh:
+                fh.write("".join(lines))
+        return len(lines)
+
+    def read(self, offset: int = 0) -> Iterator[Dict[str, str]]:
+        """Read the journal entries starting at an offset.
+
+        If the journal is smaller than the offset it has been replaced and is read from the start.
+
+        :param offset: The byte offset to start reading at
+        :returns: A generator of journal entries
+        """
+        if not os.path.exists(self.filename):
+            return
+        if offset > self.size():
+            print(f"Journal {self.filename} is shorter than expected. Replaying all of it")
+            offset = 0
+        with open(self.filename, "rb") as fh:
+            fh.seek(offset)
+            for line in fh:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    print(f"Skipping broken journal line in {self.filename}: {line!r}")
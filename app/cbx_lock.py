@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+"""Advisory file locking and atomic file replacement for the state files shared by several processes."""
+
+import contextlib
+import os
+import sys
+import time
+from typing import IO, Any, Iterator, Optional
+
+# Seconds to wait for a lock before giving up
+LOCK_TIMEOUT = 60.0
+# Longest pause between two attempts to get a lock
+MAX_POLL_INTERVAL = 0.05
+
+
+class CbxFileLock():
+    """An advisory lock on a lock file, shared for readers or exclusive for writers. Only processes using the lock are coordinated.
+
+    Uses flock on POSIX systems and msvcrt.locking on Windows, where all locks are exclusive. The lock is reentrant within the
+    process: nested acquires only count. A shared lock can not be upgraded to an exclusive one.
+    The lock file is never removed, removing it would let two processes lock different files.
+    """
+
+    def __init__(self, filename: str, timeout: float = LOCK_TIMEOUT) -> None:
+        """Create an unlocked lock.
+
+        :param filename: The name of the lock file. Created when locking
+        :param timeout: Seconds to wait for the lock
+        """
+        self.filename = filename
+        self.timeout = timeout
+        self.fd: Optional[int] = None
+        self.shared = False
+        self.depth = 0
+
+    def try_lock(self, fd: int, shared: bool) -> bool:
+        """Try to lock the open lock file without waiting.
+
+        :param fd: The file descriptor of the lock file
+        :param shared: Shared lock for readers instead of an exclusive one
+        :returns: True if the lock was acquired
+        """
+        if sys.platform == "win32":
+            import msvcrt  # pylint: disable=import-outside-toplevel,import-error
+            try:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            except OSError:
+                return False
+            return True
+        import fcntl  # pylint: disable=import-outside-toplevel
+        try:
+            fcntl.flock(fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def acquire(self, shared: bool = False) -> None:
+        """Lock, waiting up to timeout seconds for other processes to release their locks.
+
+        :param shared: Shared lock for readers instead of an exclusive one
+        :raises TimeoutError: If the lock could not be acquired in time
+        :raises RuntimeError: If an exclusive lock is requested while holding a shared one
+        """
+        if self.depth:
+            if self.shared and not shared:
+                raise RuntimeError(f"Can not upgrade the shared lock on {self.filename}")
+            self.depth += 1
+            return
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o666)
+        deadline = time.monotonic() + self.timeout
+        interval = 0.001
+        while not self.try_lock(fd, shared):
+            if time.monotonic() > deadline:
+                os.close(fd)
+                raise TimeoutError(f"Could not lock {self.filename} within {self.timeout:.0f} s")
+            time.sleep(interval)
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+        self.fd = fd
+        self.shared = shared
+        self.depth = 1
+
+    def release(self) -> None:
+        """Release one level of the lock. The lock file is unlocked when the outermost level is released."""
+        self.depth -= 1
+        if self.depth or self.fd is None:
+            return
+        if sys.platform == "win32":
+            import msvcrt  # pylint: disable=import-outside-toplevel,import-error
+            msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl  # pylint: disable=import-outside-toplevel
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+
+    @contextlib.contextmanager
+    def locked(self, shared: bool = False) -> Iterator["CbxFileLock"]:
+        """Hold the lock for a with block.
+
+        :param shared: Shared lock for readers instead of an exclusive one
+        :returns: A context manager
+        """
+        self.acquire(shared)
+        try:
+            yield self
+        finally:
+            self.release()
+
+
+@contextlib.contextmanager
+def atomic_write(filename: str, mode: str = "wt", **kwargs: Any) -> Iterator[IO[Any]]:
+    """Write a file by writing a temporary file next to it and renaming it. Readers see the old or the new file, never a partial one.
+
+    :param filename: The name of the file to replace
+    :param mode: The mode to open the temporary file with
+    :param kwargs: More arguments of open, like encoding
+    :returns: A context manager with the open temporary file
+    """
+    tmp_file = f"{filename}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, mode, **kwargs) as fh:  # pylint: disable=unspecified-encoding
+            yield fh
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_file, filename)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_file)
+        raise
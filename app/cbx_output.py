@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+
+"""Output of a loaded project: control lists, statistics, search results, query results, exports and reports."""
+
+import gzip
+import os
+import sys
+import time
+from typing import TYPE_CHECKING, Any, Dict, Iterator, Optional, TextIO, Tuple
+
+from app.cbx_batch import write_csv_rows, write_jsonl_records, write_tsv_rows
+from app.cbx_cache import TEMPLATE_CACHE_DIR
+from app.cbx_control import CbxControl, CbxControlFilter, State
+from app.cbx_profile import profiled
+from app.cbx_stats import CbxStats
+
+# Heavy dependencies are imported by the methods using them, see benchmarks/bench_startup.py
+if TYPE_CHECKING:
+    from jinja2 import Environment
+
+    from app.cbx_empire import CbxEmpire
+    from app.cbx_search import CbxSearchIndex
+
+# Number of template chunks joined before writing them to the report file
+REPORT_BUFFER_SIZE = 64
+
+# Buffer of the writer of the control list. Written to stdout in a few large chunks instead of a print per control
+LIST_BUFFER_SIZE = 1 << 16
+
+# Report environments by cache dir. They keep the compiled templates in memory
+REPORT_ENVIRONMENTS: Dict[Optional[str], "Environment"] = {}
+
+
+def get_report_environment(cache_dir: Optional[str] = None) -> "Environment":
+    """Return the jinja2 environment for reports. Templates are compiled once per process and kept as bytecode in the cache dir.
+
+    :param cache_dir: Directory of the catalogue cache. None only keeps the compiled templates in memory
+    :returns: The environment, templates are loaded relative to the working directory
+    """
+    if cache_dir is not None:
+        # The cache dir of a config is relative to the working directory. It may also have been cleared since the last report
+        cache_dir = os.path.abspath(cache_dir)
+        os.makedirs(os.path.join(cache_dir, TEMPLATE_CACHE_DIR), exist_ok=True)
+    env = REPORT_ENVIRONMENTS.get(cache_dir)
+    if env is None:
+        from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape  # pylint: disable=import-outside-toplevel
+        bytecode_cache = None
+        if cache_dir is not None:
+            bytecode_cache = FileSystemBytecodeCache(os.path.join(cache_dir, TEMPLATE_CACHE_DIR))
+        env = REPORT_ENVIRONMENTS[cache_dir] = Environment(loader=FileSystemLoader("."),
+                                                           autoescape=select_autoescape(),
+                                                           bytecode_cache=bytecode_cache
+                                                           )
+    return env
+
+
+def render_to_file(env: "Environment", template_file: str, outfile: str, compress: bool = False, **context: Any) -> None:
+    """Render a template and stream the output to a file in chunks.
+
+    :param env: The environment, see get_report_environment
+    :param template_file: The jinja2 template to use
+    :param outfile: The file to write
+    :param compress: gzip the output. Also enabled by a .gz extension of outfile
+    :param context: The variables of the template
+    """
+    template = env.get_template(template_file)
+    stream = template.stream(**context)
+    stream.enable_buffering(REPORT_BUFFER_SIZE)
+    fh: TextIO
+    if compress or outfile.endswith(".gz"):
+        fh = gzip.open(outfile, "wt", encoding="utf-8")
+    else:
+        fh = open(outfile, "wt", encoding="utf-8")  # pylint: disable=consider-using-with
+    with fh:
+        for chunk in stream:
+            fh.write(chunk)
+
+
+class CbxOutput():
+    """Lists, prints, exports and reports the controls of a project. Sections are loaded as far as the output needs them."""
+
+    def __init__(self, empire: "CbxEmpire") -> None:
+        """Create the output of a project.
+
+        :param empire: The loaded project
+        """
+        self.empire = empire
+
+    def iter_controls(self, control_filter: Optional[CbxControlFilter] = None) -> Iterator[Tuple[str, str, str, CbxControl]]:
+        """Walk the controls in catalogue order and apply a filter on the way.
+
+        With a section condition only that section is loaded, groups not matching the group condition are skipped as a whole.
+
+        :param control_filter: The conditions. All controls if None
+        :returns: A generator of (section prefix, group shortcode, item shortcode, control)
+        """
+        if control_filter is None:
+            control_filter = CbxControlFilter()
+        if control_filter.section_prefix is not None:
+            sections = [section for section in self.empire.sections if section.manual_prefix == control_filter.section_prefix]
+            for section in sections:
+                section.ensure_loaded()
+        else:
+            self.empire.load_all()
+            sections = self.empire.sections
+        matches = control_filter.matches
+        for section in sections:
+            prefix = section.manual_prefix or ""
+            for group in section.get_groups():
+                if control_filter.group is not None and group.shortcode != control_filter.group:
+                    continue
+                for item in group.get_items():
+                    for control in item.get_controls():
+                        if matches(control):
+                            yield prefix, group.shortcode, item.shortcode, control
+
+    def get_control_records(self, control_filter: Optional[CbxControlFilter] = None) -> Iterator[Dict[str, Any]]:
+        """Return one flat record per control, straight from the loaded sections.
+
+        :param control_filter: Only controls matching these conditions. All controls if None
+        :returns: A generator of dicts with uid, section, group, item, shortcode, ordinal, description, cwe, nist, state and statement
+        """
+        for prefix, group, item, control in self.iter_controls(control_filter):
+            yield {"uid": control.get_uid(),
+                   "section": prefix,
+                   "group": group,
+                   "item": item,
+                   "shortcode": control.shortcode,
+                   "ordinal": control.ordinal,
+                   "description": control.description,
+                   "cwe": list(control.cwe),
+                   "nist": list(control.nist),
+                   "state": control.state.value,
+                   "statement": control.statement or ""}
+
+    def get_csv_rows(self, control_filter: Optional[CbxControlFilter] = None) -> Iterator[Tuple[str, ...]]:
+        """Return one CSV row per control, straight from the loaded sections.
+
+        :param control_filter: Only controls matching these conditions. All controls if None
+        :returns: A generator of rows with the columns of CSV_COLUMNS
+        """
+        for prefix, group, item, control in self.iter_controls(control_filter):
+            yield (control.get_uid(), prefix, group, item, control.description,
+                   " ".join(str(cwe) for cwe in control.cwe), " ".join(control.nist),
+                   control.state.value, control.statement or "")
+
+    def get_control_list(self, control_filter: Optional[CbxControlFilter] = None) -> Iterator[str]:
+        """Return one line of text for every control.
+
+        :param control_filter: Only controls matching these conditions. All controls if None
+        :returns: A generator of lines
+        """
+        for _, _, _, control in self.iter_controls(control_filter):
+            text = control.statement or control.description
+            yield f"[{control.state.name}] {control.get_uid()}\t  {text}\t "
+
+    def write_control_list(self, fh: TextIO, file_format: str = "text", control_filter: Optional[CbxControlFilter] = None) -> int:
+        """Write the control list in one of the LIST_FORMATS.
+
+        :param fh: The file handle to write to. Open it with newline="" for csv
+        :param file_format: text, tsv, jsonl or csv
+        :param control_filter: Only controls matching these conditions. All controls if None
+        :returns: The number of controls written
+        :raises ValueError: If the format is unknown
+        """
+        if file_format == "text":
+            written = 0
+            for line in self.get_control_list(control_filter):
+                fh.write(line + "\n")
+                written += 1
+            return written
+        if file_format == "tsv":
+            return write_tsv_rows(fh, self.get_csv_rows(control_filter))
+        if file_format == "jsonl":
+            return write_jsonl_records(fh, self.get_control_records(control_filter))
+        if file_format == "csv":
+            return write_csv_rows(fh, self.get_csv_rows(control_filter))
+        raise ValueError(f"Unknown format {file_format}. Available formats: text, tsv, jsonl, csv")
+
+    @profiled("list")
+    def print_control_list(self, file_format: str = "text", control_filter: Optional[CbxControlFilter] = None) -> int:
+        """Print the controls with state and statement through one buffered writer on stdout.
+
+        A closed pipe, like list | head, raises BrokenPipeError. It is handled by the command line.
+
+        :param file_format: text, tsv, jsonl or csv
+        :param control_filter: Only controls matching these conditions. All controls if None
+        :returns: The number of controls printed
+        """
+        sys.stdout.flush()
+        with open(sys.stdout.fileno(), "wt", encoding="utf-8", newline="", buffering=LIST_BUFFER_SIZE, closefd=False) as out:
+            return self.write_control_list(out, file_format, control_filter)
+
+    @profiled("stats")
+    def print_stats(self, depth: str = "group") -> None:
+        """Print the number of controls per state and the percentage of checked controls.
+
+        :param depth: Print rows down to "section", "group" or "item"
+        """
+        def row(name: str, stats: CbxStats) -> None:
+            counts = stats.counts
+            print(f"{name}\t{counts[State.UNCHECKED]}\t{counts[State.CHECKED]}\t{counts[State.NOT_RELEVANT]}\t{stats.get_percent():.1f} %")
+
+        self.empire.load_all()
+        print("Name\tUnchecked\tChecked\tNot relevant\tDone")
+        for section in self.empire.sections:
+            row(str(section.manual_prefix), section.stats)
+            if depth in ("group", "item"):
+                for group in section.get_groups():
+                    row(f"{section.manual_prefix}/{group.shortcode}", group.stats)
+                    if depth == "item":
+                        for item in group.get_items():
+                            row(f"{section.manual_prefix}/{group.shortcode}/{item.shortcode}", item.stats)
+        row("Total", self.empire.stats)
+
+    def print_load_stats(self) -> None:
+        """Print how each section was loaded and how long it took."""
+        for section in self.empire.sections:
+            source = "cache" if section.loaded_from_cache else "data file"
+            print(f"{section.manual_prefix}\t{source}\t{section.load_duration * 1000:.1f} ms")
+        print(f"Total\t\t{self.empire.load_duration * 1000:.1f} ms")
+
+    @profiled("search_index")
+    def get_search_index(self) -> "CbxSearchIndex":
+        """Return the search index for the loaded sections and states. The catalogue part is kept in the cache dir.
+
+        :returns: The search index
+        """
+        from app.cbx_search import CbxSearchIndex  # pylint: disable=import-outside-toplevel
+        self.empire.load_all()
+        cache_file = None
+        search_index = None
+        if self.empire.cache_dir is not None:
+            cache_file = CbxSearchIndex.get_cache_file(self.empire.cache_dir, self.empire.sections)
+        if cache_file is not None:
+            search_index = CbxSearchIndex.load(cache_file)
+        if search_index is None or len(search_index.uids) != len(self.empire.index):
+            search_index = CbxSearchIndex.build(self.empire.sections)
+            if cache_file is not None:
+                search_index.save(cache_file)
+        search_index.index_states(self.empire.index)
+        return search_index
+
+    @profiled("search")
+    def print_search(self, query: str) -> None:
+        """Print the controls matching a search query.
+
+        :param query: The query, see CbxSearchIndex.search
+        """
+        start = time.perf_counter()
+        try:
+            uids = self.get_search_index().search(query)
+        except ValueError as e:
+            print(e)
+            return
+        for uid in uids:
+            control = self.empire.index.controls[uid]
+            print(f"[{control.state.name}] {uid}\t  {control.statement or control.description}\t ")
+        print(f"Found {len(uids)} controls in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def print_query(self, state: Optional[str] = None, section_prefix: Optional[str] = None, group: Optional[str] = None,
+                    cwe: Optional[int] = None, nist: Optional[str] = None) -> None:
+        """Print the controls matching a query on the SQLite backend.
+
+        :param state: Only controls with this state
+        :param section_prefix: Only controls of this section
+        :param group: Only controls of the group with this shortcode
+        :param cwe: Only controls referencing this CWE
+        :param nist: Only controls referencing this NIST entry
+        """
+        database = self.empire.database
+        if database.sqlite is None:
+            print("Queries require the sqlite state backend. Set state_backend = \"sqlite\" in the config")
+            return
+        database.sync_query_tables()
+        rows = database.sqlite.query(state, section_prefix, group, cwe, nist)
+        for uid, state_value, statement, description in rows:
+            print(f"[{state_value.upper()}] {uid}\t  {statement or description}\t ")
+        if not rows:
+            print("No controls match the query")
+
+    def print_history(self, uid: Optional[str] = None) -> None:
+        """Print the state changes from the journal.
+
+        :param uid: Only print the changes of this control. None prints all
+        """
+        for entry in self.empire.database.get_history(uid):
+            print(f"{entry['timestamp']}\t{entry['author']}\t{entry['uid']}\t{entry['state']}\t{entry['statement']}")
+
+    @profiled("export_toml")
+    def export_to_toml(self, filename: str) -> None:
+        """Dump all the data to a toml file.
+
+        :param filename: The name of the toml to write
+        """
+        import tomlkit  # pylint: disable=import-outside-toplevel
+        with open(filename, "wt", encoding="UTF-8") as fh:
+            fh.write(tomlkit.dumps(self.empire.to_dict()))
+
+    @profiled("export_jsonl")
+    def export_to_jsonl(self, filename: str) -> int:
+        """Write all controls as JSON lines, one control per line.
+
+        :param filename: The name of the file to write
+        :returns: The number of controls written
+        """
+        with open(filename, "wt", encoding="utf-8") as fh:
+            return write_jsonl_records(fh, self.get_control_records())
+
+    @profiled("export_msgpack")
+    def export_to_msgpack(self, filename: str) -> int:
+        """Write all controls as a stream of MessagePack maps, one per control. Requires the msgpack package.
+
+        :param filename: The name of the file to write
+        :returns: The number of controls written
+        """
+        try:
+            import msgpack  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            print("MessagePack export requires the msgpack package: pip install msgpack")
+            return 0
+        written = 0
+        packer = msgpack.Packer()
+        with open(filename, "wb") as fh:
+            for record in self.get_control_records():
+                fh.write(packer.pack(record))
+                written += 1
+        return written
+
+    @profiled("export_csv")
+    def export_to_csv(self, filename: str) -> int:
+        """Write all controls with their states to a CSV file. The file can be edited and read back with merge_controls.
+
+        :param filename: The name of the CSV file to write
+        :returns: The number of controls written
+        """
+        with open(filename, "wt", encoding="utf-8", newline="") as fh:
+            return write_csv_rows(fh, self.get_csv_rows())
+
+    @profiled("report")
+    def generate_html_report(self, template_file: str, outfile: str, compress: bool = False) -> None:
+        """Generate a html report.
+
+        The template gets the project as data and walks the live sections, groups, items and controls. The output is streamed to the file in chunks.
+
+        :param template_file: The jinja2 template to use
+        :param outfile: The file to write
+        :param compress: gzip the output. Also enabled by a .gz extension of outfile
+        """
+        self.empire.load_all()
+        render_to_file(get_report_environment(self.empire.cache_dir), template_file, outfile, compress, data=self.empire)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+"""Several projects in one process. Projects using the same catalogues share the loaded sections and keep only their states."""
+
+import json
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.cbx_columns import CbxColumnStore
+from app.cbx_control import State
+from app.cbx_empire import CbxEmpire, read_config
+from app.cbx_output import CbxOutput, get_report_environment, render_to_file
+
+# The portfolio of a report worker process. Inherited from the parent when worker processes are forked, loaded by init_report_worker otherwise
+WORKER_PORTFOLIO: Optional["CbxPortfolio"] = None
+
+
+def init_report_worker(config_file: Optional[str]) -> None:
+    """Load the portfolio in a report worker process if it was not inherited from the parent.
+
+    :param config_file: The config listing the projects
+    """
+    global WORKER_PORTFOLIO  # pylint: disable=global-statement
+    if WORKER_PORTFOLIO is None and config_file is not None:
+        WORKER_PORTFOLIO = CbxPortfolio()
+        WORKER_PORTFOLIO.load_config(config_file)
+
+
+def render_project_report(filename: str, template_file: str, outfile: str, compress: bool) -> Dict[str, Any]:
+    """Render the report of a project of the worker portfolio.
+
+    :param filename: The project config
+    :param template_file: The jinja2 template to use
+    :param outfile: The file to write
+    :param compress: gzip the output
+    :returns: The summary of the project for the index page
+    """
+    if WORKER_PORTFOLIO is None:
+        raise RuntimeError("The report worker has no portfolio")
+    project = WORKER_PORTFOLIO.activate(filename)
+    CbxOutput(project).generate_html_report(template_file, outfile, compress)
+    return WORKER_PORTFOLIO.get_summary(filename, outfile)
+
+
+class CbxPortfolio():
+    """The projects listed in the projects key of a config.
+
+    The data files of every distinct [sections] table are loaded once, all projects with that table share the sections and controls.
+    The states of every project are kept in a CbxColumnStore, one byte per control and the statements. Only the active project of a
+    catalogue has its states on the shared controls. activate switches by writing the differences between the two projects.
+    """
+
+    def __init__(self) -> None:
+        """Create an empty portfolio. Use load_config or add_project."""
+        # Config file of the project: project
+        self.projects: Dict[str, CbxEmpire] = {}
+        self.stores: Dict[str, CbxColumnStore] = {}
+        # Catalogue key of every project. Per key: the loaded catalogue, its positions and states and the project whose states are on its controls
+        self.catalogue_keys: Dict[str, str] = {}
+        self.catalogues: Dict[str, CbxEmpire] = {}
+        self.positions: Dict[str, Dict[str, int]] = {}
+        self.baselines: Dict[str, CbxColumnStore] = {}
+        self.active: Dict[str, str] = {}
+        self.config_file: Optional[str] = None
+
+    def load_config(self, filename: str) -> None:
+        """Load all projects listed in a config.
+
+        :param filename: A config with projects = ["product_a/config.toml", ...]. Paths in the project configs are relative to the working directory
+        """
+        self.config_file = filename
+        data = read_config(filename)
+        project_files: List[str] = [str(project) for project in data.get("projects", [])]
+        if not project_files:
+            print(f"No projects configured in {filename}. Add projects = [\"product_a/config.toml\", ...]")
+        for project_file in project_files:
+            self.add_project(project_file)
+
+    @staticmethod
+    def get_catalogue_key(filename: str) -> str:
+        """Return a key for the sections of a project config. Projects with equal keys can share the loaded catalogue.
+
+        :param filename: The project config
+        :returns: The [sections] table as JSON
+        """
+        data = read_config(filename)
+        return json.dumps(data.get("sections", {}), sort_keys=True)
+
+    def add_project(self, filename: str) -> CbxEmpire:
+        """Load a project. Loads the data files only if no project with the same sections is loaded yet.
+
+        :param filename: The project config
+        :returns: The project, it is the active one of its catalogue
+        """
+        key = self.get_catalogue_key(filename)
+        catalogue = self.catalogues.get(key)
+        if catalogue is None:
+            catalogue = CbxEmpire()
+            catalogue.load_catalogue(filename)
+            self.catalogues[key] = catalogue
+            self.positions[key] = CbxColumnStore.get_positions(catalogue.index.controls.keys())
+            self.baselines[key] = CbxColumnStore.from_index(catalogue.index, self.positions[key])
+        else:
+            # Back to the states of the data files. The states of the active project are kept in its store
+            self.baselines[key].apply_to(catalogue.index, self.deactivate(key))
+        print(f"Project {filename}")
+        project = CbxEmpire()
+        project.load_config(filename, catalogue=catalogue)
+        self.projects[filename] = project
+        self.catalogue_keys[filename] = key
+        self.stores[filename] = CbxColumnStore.from_index(project.index, self.positions[key])
+        self.active[key] = filename
+        return project
+
+    def deactivate(self, key: str) -> Optional[CbxColumnStore]:
+        """Keep the states of the active project of a catalogue in its store. They may have been changed since activating it.
+
+        :param key: The catalogue key
+        :returns: The store of the active project or None
+        """
+        active = self.active.get(key)
+        if active is None:
+            return None
+        project = self.projects[active]
+        self.stores[active] = CbxColumnStore.from_index(project.index, self.positions[key])
+        return self.stores[active]
+
+    def activate(self, filename: str) -> CbxEmpire:
+        """Put the states of a project on the controls of its catalogue.
+
+        :param filename: The project config
+        :returns: The project
+        """
+        key = self.catalogue_keys[filename]
+        if self.active.get(key) != filename:
+            current = self.deactivate(key)
+            self.stores[filename].apply_to(self.projects[filename].index, current)
+            self.active[key] = filename
+        return self.projects[filename]
+
+    def iter_projects(self) -> Iterator[CbxEmpire]:
+        """Activate the projects one after another.
+
+        :returns: A generator of the activated projects, in config order
+        """
+        for filename in self.projects:
+            yield self.activate(filename)
+
+    def print_stats(self) -> None:
+        """Print the number of controls per state and the percentage of checked controls for every project and its sections."""
+        print("Name\tUnchecked\tChecked\tNot relevant\tDone")
+        for project in self.iter_projects():
+            for name, stats in [(str(project.project), project.stats)] + [(f"{project.project}/{section.manual_prefix}", section.stats)
+                                                                          for section in project.sections]:
+                counts = stats.counts
+                print(f"{name}\t{counts[State.UNCHECKED]}\t{counts[State.CHECKED]}\t{counts[State.NOT_RELEVANT]}\t{stats.get_percent():.1f} %")
+
+    @staticmethod
+    def get_project_file(filename: str, project: CbxEmpire) -> str:
+        """Insert the project name into a file name, for exports of several projects.
+
+        :param filename: The file name, for example controls.csv
+        :param project: The project
+        :returns: The file name, for example controls_Foo.csv
+        """
+        stem, extension = os.path.splitext(filename)
+        return f"{stem}_{project.project}{extension}"
+
+    def get_summary(self, filename: str, outfile: Optional[str] = None) -> Dict[str, Any]:
+        """Return the compliance summary of a project.
+
+        :param filename: The project config
+        :param outfile: The report file of the project
+        :returns: A dict with config, project, report, counts per state, total and percent
+        """
+        project = self.activate(filename)
+        return {"config": filename,
+                "project": project.project,
+                "report": outfile,
+                "counts": {state.value: count for state, count in project.stats.counts.items()},
+                "total": project.stats.get_total(),
+                "percent": project.stats.get_percent()}
+
+    def generate_html_reports(self, template_file: str, outdir: str, index_template: str, compress: bool = False, workers: int = 0) -> List[Dict[str, Any]]:
+        """Generate the reports of all projects and an index page with the compliance of every project.
+
+        The template is compiled once before the worker processes start. Forked workers inherit the loaded catalogues and render one
+        project each. The report of project Foo is written to outdir/Foo.html, the index page to outdir/index.html.
+
+        :param template_file: The jinja2 template of a project report
+        :param outdir: The directory to write the reports to
+        :param index_template: The jinja2 template of the index page. Gets the project summaries as projects, see get_summary
+        :param compress: gzip the project reports
+        :param workers: Number of worker processes. 0: one per project, up to the number of CPUs. 1: render in this process
+        :returns: The project summaries
+        """
+        global WORKER_PORTFOLIO  # pylint: disable=global-statement
+        os.makedirs(outdir, exist_ok=True)
+        cache_dir = next(iter(self.projects.values())).cache_dir if self.projects else None
+        env = get_report_environment(cache_dir)
+        # Compile before forking, so the workers only render
+        env.get_template(template_file)
+        jobs = []
+        used: Dict[str, int] = {}
+        for filename, project in self.projects.items():
+            name = re.sub(r"[^A-Za-z0-9_.-]+", "_", str(project.project))
+            used[name] = used.get(name, 0) + 1
+            if used[name] > 1:
+                name = f"{name}_{used[name]}"
+            jobs.append((filename, template_file, os.path.join(outdir, f"{name}.html{'.gz' if compress else ''}"), compress))
+        if workers <= 0:
+            workers = min(len(jobs), os.cpu_count() or 1)
+
+        if workers <= 1:
+            summaries = []
+            for filename, template, outfile, compressed in jobs:
+                CbxOutput(self.activate(filename)).generate_html_report(template, outfile, compressed)
+                summaries.append(self.get_summary(filename, outfile))
+        else:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork" if "fork" in methods else None)
+            WORKER_PORTFOLIO = self
+            try:
+                with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_report_worker,
+                                         initargs=(None if context.get_start_method() == "fork" else self.config_file,)) as processes:
+                    futures = [processes.submit(render_project_report, *job) for job in jobs]
+                    summaries = [future.result() for future in futures]
+            finally:
+                WORKER_PORTFOLIO = None
+
+        for summary in summaries:
+            summary["link"] = os.path.basename(summary["report"])
+        render_to_file(env, index_template, os.path.join(outdir, "index.html"), projects=summaries)
+        return summaries
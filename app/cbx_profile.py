@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+"""Profiling. Timings of nested phases, counters and peak memory of a run, with an optional cProfile dump.
+
+Instrumented code uses the global PROFILER. As long as it is not enabled a phase is a shared no-op context manager and a count is a single check.
+"""
+
+import contextlib
+import functools
+import json
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, ContextManager, Dict, Iterator, List, Optional, TextIO, TypeVar, cast
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # Not available on Windows. The peak memory of the process is not reported there
+    resource = None  # type: ignore
+
+# cProfile and tracemalloc are imported when they are enabled, every command imports this module
+if TYPE_CHECKING:
+    import cProfile
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# Returned by phase while profiling is disabled
+NULL_PHASE: ContextManager[None] = contextlib.nullcontext()
+
+
+class CbxPhase():
+    """Accumulated measurements of a phase."""
+
+    __slots__ = ("calls", "seconds", "peak_traced")
+
+    def __init__(self) -> None:
+        """Create an empty phase."""
+        self.calls: int = 0
+        self.seconds: float = 0.0
+        # Peak of the memory allocated by Python during the phase. Only measured with trace_memory
+        self.peak_traced: int = 0
+
+    def add(self, seconds: float, peak_traced: int = 0) -> None:
+        """Add a call of the phase.
+
+        :param seconds: The duration of the call
+        :param peak_traced: The peak memory allocated during the call
+        """
+        self.calls += 1
+        self.seconds += seconds
+        self.peak_traced = max(self.peak_traced, peak_traced)
+
+    def to_dict(self, name: str, trace_memory: bool) -> Dict[str, Any]:
+        """Return the measurements.
+
+        :param name: The path of the phase
+        :param trace_memory: Include the peak memory, it is only measured with trace_memory
+        :returns: A dict with name, calls, seconds and peak_traced_bytes
+        """
+        return {"name": name, "calls": self.calls, "seconds": self.seconds,
+                "peak_traced_bytes": self.peak_traced if trace_memory else None}
+
+
+class CbxProfiler():
+    """Collects the timings of nested phases and counters. Phase names are joined with / to paths of the enclosing phases."""
+
+    def __init__(self) -> None:
+        """Create a disabled profiler."""
+        self.enabled: bool = False
+        self.trace_memory: bool = False
+        self.phases: Dict[str, CbxPhase] = {}
+        self.counts: Dict[str, int] = {}
+        self.started: float = 0.0
+        self.cprofile: Optional["cProfile.Profile"] = None
+        # Stack of (path, peak) of the open phases, per thread
+        self.local = threading.local()
+
+    def enable(self, trace_memory: bool = False, cprofile: bool = False) -> None:
+        """Start profiling.
+
+        :param trace_memory: Measure the peak memory of every phase with tracemalloc. Slows Python code down about two times
+        :param cprofile: Also run cProfile for a function level profile, see dump_cprofile
+        """
+        self.enabled = True
+        self.trace_memory = trace_memory
+        self.started = time.perf_counter()
+        if trace_memory:
+            import tracemalloc  # pylint: disable=import-outside-toplevel
+            tracemalloc.start()
+        if cprofile:
+            import cProfile  # pylint: disable=import-outside-toplevel,redefined-outer-name
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def disable(self) -> None:
+        """Stop profiling. The collected data stays available."""
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        if self.trace_memory:
+            import tracemalloc  # pylint: disable=import-outside-toplevel
+            self.get_stack()[0][1] = max(self.get_stack()[0][1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        self.enabled = False
+
+    def get_stack(self) -> List[List[Any]]:
+        """Return the open phases of the current thread. The first entry is the run itself.
+
+        :returns: [path, peak traced memory] of every open phase
+        """
+        stack: Optional[List[List[Any]]] = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = [["", 0]]
+        return stack
+
+    def phase(self, name: str) -> ContextManager[None]:
+        """Measure a phase. Use as context manager.
+
+        :param name: Name of the phase, nested phases are named enclosing/name
+        :returns: A context manager
+        """
+        if not self.enabled:
+            return NULL_PHASE
+        return self.measure(name)
+
+    @contextlib.contextmanager
+    def measure(self, name: str) -> Iterator[None]:
+        """Measure a phase, use phase instead.
+
+        :param name: Name of the phase
+        :returns: A context manager
+        """
+        stack = self.get_stack()
+        path = f"{stack[-1][0]}/{name}" if len(stack) > 1 else name
+        if self.trace_memory:
+            import tracemalloc  # pylint: disable=import-outside-toplevel
+            # The peak of the enclosing phase up to now, the peak is reset for this phase
+            stack[-1][1] = max(stack[-1][1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        # Registered at the start, so enclosing phases come first in the summary
+        entry = self.phases.get(path)
+        if entry is None:
+            entry = self.phases[path] = CbxPhase()
+        stack.append([path, 0])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            _, peak = stack.pop()
+            if self.trace_memory:
+                import tracemalloc  # pylint: disable=import-outside-toplevel,reimported
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                stack[-1][1] = max(stack[-1][1], peak)
+                tracemalloc.reset_peak()
+            entry.add(duration, peak)
+
+    def count(self, name: str, value: int = 1) -> None:
+        """Add to a counter.
+
+        :param name: Name of the counter
+        :param value: Value to add
+        """
+        if self.enabled:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    @staticmethod
+    def get_peak_rss() -> Optional[int]:
+        """Return the peak resident memory of the process.
+
+        :returns: Bytes or None if not available on this platform
+        """
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, KiB everywhere else
+        return int(peak if sys.platform == "darwin" else peak * 1024)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the collected data.
+
+        :returns: A dict with total_seconds, peak_rss_bytes, peak_traced_bytes, phases and counts
+        """
+        return {"total_seconds": time.perf_counter() - self.started,
+                "peak_rss_bytes": self.get_peak_rss(),
+                "peak_traced_bytes": self.get_stack()[0][1] if self.trace_memory else None,
+                "phases": [entry.to_dict(name, self.trace_memory) for name, entry in self.phases.items()],
+                "counts": dict(self.counts)}
+
+    def print_summary(self, fh: TextIO, output_format: str = "text") -> None:
+        """Print the collected data.
+
+        :param fh: The file to print to
+        :param output_format: text or json
+        """
+        data = self.to_dict()
+        if output_format == "json":
+            json.dump(data, fh, indent=2)
+            fh.write("\n")
+            return
+        total = data["total_seconds"]
+        peak = f", peak memory {data['peak_rss_bytes'] / 1e6:.1f} MB" if data["peak_rss_bytes"] is not None else ""
+        print(f"Profile: {total:.3f} s{peak}", file=fh)
+        memory_header = f"{'Peak MB':>9}" if self.trace_memory else ""
+        print(f"{'Phase':48}{'Calls':>8}{'Seconds':>10}{'Share':>9}{memory_header}", file=fh)
+        # Children below their enclosing phase, phases of one level in the order they started first
+        order = {entry["name"]: number for number, entry in enumerate(data["phases"])}
+
+        def tree_key(phase: Dict[str, Any]) -> List[int]:
+            parts = phase["name"].split("/")
+            return [order.get("/".join(parts[:depth + 1]), 0) for depth in range(len(parts))]
+
+        for entry in sorted(data["phases"], key=tree_key):
+            depth = entry["name"].count("/")
+            name = "  " * depth + entry["name"].rpartition("/")[2]
+            share = entry["seconds"] / total * 100 if total else 0.0
+            memory = f"{entry['peak_traced_bytes'] / 1e6:9.1f}" if entry["peak_traced_bytes"] is not None else ""
+            print(f"{name:48}{entry['calls']:8}{entry['seconds']:10.3f}{share:8.1f}%{memory}", file=fh)
+        for name, value in sorted(data["counts"].items()):
+            print(f"{name:48}{value:8}", file=fh)
+
+    def dump_cprofile(self, filename: str) -> None:
+        """Write the cProfile statistics. Read them with python -m pstats or snakeviz.
+
+        :param filename: The file to write
+        """
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(filename)
+
+
+PROFILER = CbxProfiler()
+
+
+def profiled(name: str) -> Callable[[F], F]:
+    """Measure every call of a function as phase. Do not use it on generators, only their creation would be measured.
+
+    :param name: Name of the phase
+    :returns: The decorator
+    """
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            with PROFILER.measure(name):
+                return func(*args, **kwargs)
+        return cast(F, wrapper)
+    return decorator
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+"""Project tag rules. Compiles the rules of disabled project tags into a single matcher for control UIDs."""
+
+import os
+import re
+import time
+import tomllib
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Set
+
+# The built-in rules, used if a config has no [tag_rules] table. Same format as the [tag_rules] table of a config, see config.toml
+DEFAULT_TAG_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "default_tag_rules.toml")
+
+
+class CbxTagRule():
+    """A rule for a project tag: exact UIDs and regex patterns of the controls that are not relevant if the tag is false."""
+
+    def __init__(self, tag: str, uids: Iterable[str], patterns: Iterable[str], description: str = "") -> None:
+        """Create a tag rule.
+
+        :param tag: The name of the project tag
+        :param uids: Exact UIDs of the controls affected
+        :param patterns: Regex patterns searched in the UIDs of the controls
+        :param description: A description of the tag
+        """
+        self.tag = tag
+        self.uids: List[str] = [uid.strip() for uid in uids]
+        self.patterns: List[re.Pattern[str]] = [re.compile(pattern) for pattern in patterns]
+        self.description = description
+
+    @classmethod
+    def from_config(cls, tag: str, data: Mapping[str, Any]) -> "CbxTagRule":
+        """Create a tag rule from a [tag_rules.*] table of the config.
+
+        :param tag: The name of the project tag
+        :param data: The config table for this tag
+        :returns: A tag rule
+        """
+        return cls(tag=tag,
+                   uids=[str(uid) for uid in data.get("uids", [])],
+                   patterns=[str(pattern) for pattern in data.get("patterns", [])],
+                   description=str(data.get("description", "")))
+
+    def matches(self, uid: str) -> bool:
+        """Check if the rule affects a control.
+
+        :param uid: The UID of the control
+        :returns: True if the UID is listed or matched by a pattern
+        """
+        return uid in self.uids or any(pattern.search(uid) for pattern in self.patterns)
+
+    def covers_section(self, prefix: str) -> bool:
+        """Check if a pattern matches every UID of a section, like ^OWASP_ISVS.* for the section OWASP_ISVS. Only literal prefix patterns are recognised.
+
+        :param prefix: The prefix of the section
+        :returns: True if the whole section is affected
+        """
+        literals = {prefix, prefix + "-", re.escape(prefix), re.escape(prefix + "-")}
+        return any(pattern.pattern.removeprefix("^").removesuffix(".*") in literals for pattern in self.patterns)
+
+
+class CbxRuleResult():
+    """Result of a rule evaluation."""
+
+    def __init__(self) -> None:
+        """Create an empty result."""
+        self.matches: Dict[str, List[str]] = {}
+        self.counts: Dict[str, int] = {}
+        self.evaluated: int = 0
+        self.duration: float = 0.0
+
+    def merge(self, other: "CbxRuleResult") -> None:
+        """Add the result of another evaluation, for example of a section loaded later.
+
+        :param other: The result to add
+        """
+        self.matches.update(other.matches)
+        for tag, count in other.counts.items():
+            self.counts[tag] = self.counts.get(tag, 0) + count
+        self.evaluated += other.evaluated
+        self.duration += other.duration
+
+    def print_summary(self) -> None:
+        """Print how many controls each rule matched and the time it took."""
+        for tag, count in self.counts.items():
+            print(f"Project tag {tag} is false: {count} controls set as irrelevant")
+        print(f"Evaluated project tags on {self.evaluated} controls in {self.duration * 1000:.1f} ms")
+
+
+class CbxRuleEngine():
+    """Compiles the rules of all disabled tags into one matcher: a set of exact UIDs and one combined regex."""
+
+    def __init__(self, rules: Iterable[CbxTagRule]) -> None:
+        """Compile the rules.
+
+        :param rules: The rules of the disabled tags
+        """
+        self.rules: List[CbxTagRule] = list(rules)
+        self.exact: Dict[str, List[str]] = {}
+        for rule in self.rules:
+            for uid in rule.uids:
+                self.exact.setdefault(uid, []).append(rule.tag)
+
+        alternatives = [f"(?:{pattern.pattern})" for rule in self.rules for pattern in rule.patterns]
+        self.combined: Optional[re.Pattern[str]] = re.compile("|".join(alternatives)) if alternatives else None
+
+    def match(self, uid: str) -> List[str]:
+        """Return the tags of all rules matching a UID.
+
+        :param uid: The UID to check
+        :returns: A list of tags, empty if no rule matches
+        """
+        tags = list(self.exact.get(uid, []))
+        if self.combined is not None and self.combined.search(uid) is not None:
+            # Only UIDs hitting the combined regex are checked against the single patterns to find out which tag matched
+            for rule in self.rules:
+                if rule.tag not in tags and rule.matches(uid):
+                    tags.append(rule.tag)
+        return tags
+
+    def get_section_tags(self, prefix: str) -> List[str]:
+        """Return the tags with a pattern matching every UID of a section, like ^OWASP_ISVS.* for the section OWASP_ISVS.
+
+        Only literal prefix patterns are recognised. Those sections can be set to not relevant without evaluating every control.
+
+        :param prefix: The prefix of the section
+        :returns: The tags disabling the whole section
+        """
+        return [rule.tag for rule in self.rules if rule.covers_section(prefix)]
+
+    def get_listed_uids(self, prefix: str) -> List[str]:
+        """Return the exact UIDs of all rules that belong to a section.
+
+        :param prefix: The prefix of the section
+        :returns: The listed UIDs of the section
+        """
+        return [uid for uid in self.exact if uid.startswith(prefix + "-")]
+
+    def evaluate(self, uids: Iterable[str]) -> CbxRuleResult:
+        """Evaluate all rules on the UIDs in a single pass.
+
+        :param uids: The UIDs of the controls to check
+        :returns: The matching UIDs with the tags that matched them and per tag counts
+        """
+        start = time.perf_counter()
+        result = CbxRuleResult()
+        result.counts = {rule.tag: 0 for rule in self.rules}
+        for uid in uids:
+            result.evaluated += 1
+            tags = self.match(uid)
+            if tags:
+                result.matches[uid] = tags
+                for tag in tags:
+                    result.counts[tag] += 1
+        result.duration = time.perf_counter() - start
+        return result
+
+
+def load_tag_rules(data: Optional[Mapping[str, Any]], tags: Mapping[str, Any]) -> List[CbxTagRule]:
+    """Collect the rules of all project tags set to false.
+
+    :param data: The [tag_rules] table of the config. None if the config has none, the built-in rules of DEFAULT_TAG_RULES_FILE are used then
+    :param tags: The [project_tags] table of the config
+    :returns: The rules of the disabled tags
+    """
+    if data is None:
+        with open(DEFAULT_TAG_RULES_FILE, "rb") as fh:
+            data = tomllib.load(fh)["tag_rules"]
+    res: List[CbxTagRule] = []
+    disabled: Set[str] = {str(tag) for tag, value in tags.items() if value is False}
+    for tag in sorted(disabled - set(data.keys())):
+        print(f"No rule for project tag {tag}. Ignoring it")
+    for tag, rule in data.items():
+        if str(tag) in disabled:
+            res.append(CbxTagRule.from_config(str(tag), rule))
+    return res
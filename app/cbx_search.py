@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+"""Search. An inverted index over control descriptions and statements with secondary indexes on CWE, NIST, state, section and group."""
+
+import hashlib
+import marshal
+import os
+import re
+import shlex
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.cbx_index import CbxIndex
+from app.cbx_section import CbxSection
+
+# Version of the search cache file layout. Increase it if the layout changes
+SEARCH_FORMAT = 1
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Fields of the catalogue, they can be cached. state and the statements change with the database
+STATIC_FIELDS = ("text", "cwe", "nist", "section", "group")
+FIELDS = STATIC_FIELDS + ("state", "uid")
+
+
+def tokenize(text: str) -> Set[str]:
+    """Split a text into lower case words.
+
+    :param text: The text to split
+    :returns: The words
+    """
+    return set(TOKEN_RE.findall(text.lower()))
+
+
+class CbxSearchIndex():
+    """Posting lists of control positions for every word and field value. Positions refer to uids, which are in catalogue order."""
+
+    def __init__(self) -> None:
+        """Create an empty index. Use build or load."""
+        self.uids: List[str] = []
+        self.positions: Dict[str, int] = {}
+        # field: value: positions
+        self.postings: Dict[str, Dict[str, List[int]]] = {field: {} for field in STATIC_FIELDS}
+        self.statements: Dict[str, List[int]] = {}
+        self.states: Dict[str, List[int]] = {}
+        # UID index of the controls, set by index_states. Used for uid terms
+        self.index: Optional[CbxIndex] = None
+
+    def add(self, field: str, value: str, position: int) -> None:
+        """Add a position to a posting list.
+
+        :param field: The field
+        :param value: The value of the field
+        :param position: The position of the control
+        """
+        self.postings[field].setdefault(value, []).append(position)
+
+    @classmethod
+    def build(cls, sections: Iterable[CbxSection]) -> "CbxSearchIndex":
+        """Index the catalogue data of the sections.
+
+        :param sections: The loaded sections
+        :returns: The index
+        """
+        res = cls()
+        for section in sections:
+            prefix = (section.manual_prefix or "").lower()
+            for group in section.get_groups():
+                for item in group.get_items():
+                    for control in item.get_controls():
+                        position = len(res.uids)
+                        res.uids.append(control.get_uid())
+                        for token in tokenize(control.description):
+                            res.add("text", token, position)
+                        for cwe in control.cwe:
+                            res.add("cwe", str(cwe), position)
+                        for nist in control.nist:
+                            res.add("nist", nist.lower(), position)
+                        res.add("section", prefix, position)
+                        res.add("group", group.shortcode.lower(), position)
+        res.positions = {uid: position for position, uid in enumerate(res.uids)}
+        return res
+
+    def index_states(self, index: CbxIndex) -> None:
+        """Index the current states and statements. Call it again after the states changed.
+
+        :param index: The UID index of the loaded controls
+        """
+        self.index = index
+        self.statements = {}
+        self.states = {}
+        for position, uid in enumerate(self.uids):
+            control = index.find(uid)
+            if control is None:
+                continue
+            self.states.setdefault(control.state.value, []).append(position)
+            if control.statement:
+                for token in tokenize(control.statement):
+                    self.statements.setdefault(token, []).append(position)
+
+    @staticmethod
+    def get_cache_file(cache_dir: str, sections: Iterable[CbxSection]) -> Optional[str]:
+        """Return the name of the cache file. It is derived from the data hashes of the sections.
+
+        :param cache_dir: Directory of the catalogue cache
+        :param sections: The loaded sections
+        :returns: The file name or None if a section has no data file
+        """
+        hashes = [section.data_hash for section in sections]
+        if None in hashes:
+            return None
+        key = hashlib.sha256(f"{hashes}\0{SEARCH_FORMAT}\0{marshal.version}\0{sys.version_info[:2]}".encode("utf-8"))
+        return os.path.join(cache_dir, key.hexdigest() + ".cbxs")
+
+    @classmethod
+    def load(cls, cache_file: str) -> Optional["CbxSearchIndex"]:
+        """Load the catalogue part of the index from a cache file.
+
+        :param cache_file: The name of the cache file
+        :returns: The index or None if there is no valid cache file
+        """
+        try:
+            with open(cache_file, "rb") as fh:
+                data: Tuple[Any, ...] = marshal.loads(fh.read())  # nosec  The cache is written by us, content addressed and only contains lists of strings and numbers
+            res = cls()
+            res.uids, res.postings = data
+        except FileNotFoundError:
+            return None
+        except (EOFError, ValueError, TypeError):
+            print(f"Broken search cache file {cache_file}. Rebuilding the search index")
+            return None
+        res.positions = {uid: position for position, uid in enumerate(res.uids)}
+        return res
+
+    def save(self, cache_file: str) -> None:
+        """Write the catalogue part of the index to a cache file.
+
+        :param cache_file: The name of the cache file
+        """
+        os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as fh:
+            fh.write(marshal.dumps((self.uids, self.postings)))
+        os.replace(tmp_file, cache_file)
+
+    def lookup(self, field: str, value: str) -> Set[int]:
+        """Return the positions of the controls matching a single term.
+
+        :param field: The field
+        :param value: The value. Text values ending with * match all words starting with it
+        :returns: The positions
+        """
+        if field == "uid":
+            return self.lookup_uid(value)
+        value = value.lower()
+        if field == "text":
+            if value.endswith("*"):
+                prefix = value[:-1]
+                res: Set[int] = set()
+                for postings in (self.postings["text"], self.statements):
+                    for token, positions in postings.items():
+                        if token.startswith(prefix):
+                            res.update(positions)
+                return res
+            res = set()
+            for token in tokenize(value) or {""}:
+                found = set(self.postings["text"].get(token, ())) | set(self.statements.get(token, ()))
+                res = found if not res else res & found
+                if not res:
+                    break
+            return res
+        if field == "cwe":
+            return set(self.postings["cwe"].get(value.removeprefix("cwe-"), ()))
+        if field == "state":
+            return set(self.states.get(value, ()))
+        return set(self.postings[field].get(value, ()))
+
+    def lookup_uid(self, value: str) -> Set[int]:
+        """Return the positions of the controls with a UID or a UID prefix.
+
+        A full UID is looked up in the UID index. A prefix is routed by the section prefix, only the controls of matching sections are compared.
+
+        :param value: The UID or the start of UIDs, case insensitive
+        :returns: The positions
+        """
+        if self.index is not None and value in self.index:
+            return {self.positions[value]} if value in self.positions else set()
+        value = value.lower()
+        res: Set[int] = set()
+        for prefix, positions in self.postings["section"].items():
+            if f"{prefix}-".startswith(value):
+                # All UIDs of the section start with the value
+                res.update(positions)
+            elif value.startswith(f"{prefix}-"):
+                res.update(position for position in positions if self.uids[position].lower().startswith(value))
+        return res
+
+    def search(self, query: str) -> List[str]:
+        """Search controls.
+
+        The query is a list of terms like cwe:79 state:unchecked text:session. All terms have to match.
+        Terms without field search the text. Comma separated values of one term match any of them.
+        Fields: text (description and statement), cwe, nist, state, section, group, uid (a full UID or the start of UIDs).
+
+        :param query: The query
+        :returns: The UIDs of the matching controls in catalogue order
+        """
+        res: Optional[Set[int]] = None
+        for term in shlex.split(query):
+            field, separator, value = term.partition(":")
+            if not separator:
+                field, value = "text", term
+            if field not in FIELDS:
+                raise ValueError(f"Unknown search field {field}. Available fields: {', '.join(FIELDS)}")
+            found: Set[int] = set()
+            for alternative in value.split(","):
+                found |= self.lookup(field, alternative)
+            res = found if res is None else res & found
+            if not res:
+                return []
+        if res is None:
+            return list(self.uids)
+        return [self.uids[position] for position in sorted(res)]
@@ -2,20 +2,53 @@
 
 """A section in the document. Collecting several checkbox tests."""
 
-import json
-from typing import Optional, List, Union
+import time
+from typing import Any, Callable, Dict, Optional, List, Tuple, Union
 import hashlib
 
-import yaml
-
-from app.cbx_control import CbxControl
+from app.cbx_cache import get_cache_file, hash_data_file, read_cache, write_cache
+from app.cbx_control import CbxControl, State
 from app.cbx_group import CbxGroup
+from app.cbx_index import CbxIndex
 from app.cbx_item import CbxItem
+from app.cbx_profile import PROFILER, profiled
+from app.cbx_stats import CbxStats
+from app.cbx_stream import CbxJsonReader, CbxYamlReader
+
+
+class CbxLoadError(Exception):
+    """The data files of one or more sections could not be loaded."""
+
+    def __init__(self, errors: Dict[str, str]) -> None:
+        """Create the error.
+
+        :param errors: The error message for every failed section, by prefix
+        """
+        self.errors = errors
+        super().__init__("Loading failed for " + "; ".join(f"{prefix}: {error}" for prefix, error in errors.items()))
+
+
+def parse_data_file(file_type: str, filename: str, prefix: str) -> Tuple[Tuple[Any, ...], float]:
+    """Parse a data file into the cache representation of a section. Runs in worker processes when loading in parallel.
+
+    :param file_type: The type of the data file
+    :param filename: The name of the data file
+    :param prefix: The prefix of the section
+    :returns: The section tree as created by CbxSection.to_cache and the time the parsing took in seconds
+    """
+    start = time.perf_counter()
+    section = CbxSection(name=prefix, prefix=prefix, description="")
+    section.get_loaders()[file_type](filename)
+    return section.to_cache(), time.perf_counter() - start
 
 
 class CbxSection():
     """Load data from a data file. This is a section in the document. A single data file can be loaded several times for different sections (for example use similar checklists for planning and testing)."""
 
+    __slots__ = ("manual_name", "manual_prefix", "manual_description", "data_name", "data_shortname", "data_version", "data_description",
+                 "_groups", "index", "stats", "data_file", "data_hash", "loaded_from_cache", "load_duration", "source", "on_load", "disabled_tags",
+                 "not_relevant_statement")
+
     def __init__(self, name: str, prefix: str, description: str):
         """Create a section object.
 
@@ -35,49 +68,265 @@ class CbxSection():
         self.data_version: Optional[str] = None
         self.data_description: Optional[str] = None
 
-        self.groups: list[CbxGroup] = []
+        self._groups: list[CbxGroup] = []
+        self.index: Optional[CbxIndex] = None
+        self.stats = CbxStats()
+
+        self.data_file: Optional[str] = None
+        # Hash of data file content, file type and prefix. Identifies the catalogue data of this section
+        self.data_hash: Optional[str] = None
+
+        # Loading statistics
+        self.loaded_from_cache: bool = False
+        self.load_duration: float = 0.0
+
+        # Lazy loading: file type, data file and cache dir of a data file not loaded yet. Called with the section once it is loaded
+        self.source: Optional[Tuple[str, str, Optional[str]]] = None
+        self.on_load: Optional[Callable[["CbxSection"], None]] = None
+        # Project tags disabling the whole catalogue
+        self.disabled_tags: List[str] = []
+        # Statement of set_not_relevant for a section that is not loaded yet. Applied once it is loaded, before on_load
+        self.not_relevant_statement: Optional[str] = None
+
+    @property
+    def groups(self) -> list[CbxGroup]:
+        """The groups of this section. Accessing them loads a lazy section.
+
+        :returns: The groups
+        """
+        self.ensure_loaded()
+        return self._groups
+
+    def set_source(self, file_type: str, filename: str, cache_dir: Optional[str] = None, on_load: Optional[Callable[["CbxSection"], None]] = None) -> None:
+        """Remember the data file of this section without loading it. It is loaded when the groups are accessed first.
+
+        :param file_type: The type of the data file, for example OWASP_ASVS_JSON
+        :param filename: The name of the data file
+        :param cache_dir: Directory of the catalogue cache. None disables the cache
+        :param on_load: Called with this section after loading, for example to apply tag rules and stored states
+        """
+        self.source = (file_type, filename, cache_dir)
+        self.on_load = on_load
+
+    def is_loaded(self) -> bool:
+        """Check if the data file has been loaded.
+
+        :returns: False if the section still waits for lazy loading
+        """
+        return self.source is None
+
+    def ensure_loaded(self) -> None:
+        """Load the data file of a lazy section now.
+
+        :raises CbxLoadError: If the data file could not be loaded
+        """
+        if self.source is None:
+            return
+        file_type, filename, cache_dir = self.source
+        self.source = None
+        try:
+            self.load_data_file(file_type, filename, cache_dir)
+        except Exception as e:  # pylint: disable=broad-except
+            raise CbxLoadError({str(self.manual_prefix): f"{filename}: {e!r}"}) from e
+        self.loaded()
+
+    def loaded(self) -> None:
+        """Mark a lazy section as loaded and call the on_load callback. Used when the data was loaded from outside."""
+        self.source = None
+        if self.not_relevant_statement is not None:
+            statement = self.not_relevant_statement
+            self.not_relevant_statement = None
+            self.set_not_relevant(statement)
+        if self.on_load is not None:
+            on_load = self.on_load
+            self.on_load = None
+            on_load(self)
+
+    def set_not_relevant(self, statement: str) -> int:
+        """Set all controls of this section to not relevant in one go, without evaluating rules per control.
+
+        A lazy section is not loaded for that. The statement is kept and applied when its data file is loaded.
+
+        :param statement: The statement for all controls
+        :returns: The number of controls changed. 0 if the section is not loaded yet
+        """
+        if not self.is_loaded():
+            self.not_relevant_statement = statement
+            return 0
+        changed = 0
+        for group in self._groups:
+            for item in group.get_items():
+                counts = {state: 0 for state in State}
+                for control in item.get_controls():
+                    counts[control.state] -= 1
+                    control.state = State.NOT_RELEVANT
+                    control.statement = statement
+                counts[State.NOT_RELEVANT] += len(item.controls)
+                item.stats.add(counts)
+                changed += len(item.controls)
+        return changed
+
+    def add_group(self, group: CbxGroup) -> None:
+        """Add a group to this section.
+
+        :param group: The group to add
+        """
+        self._groups.append(group)
+        group.stats.attach(self.stats)
+        if self.index is not None:
+            group.set_index(self.index)
+
+    def set_index(self, index: Optional[CbxIndex]) -> None:
+        """Attach an UID index to this section. Controls loaded or added later will be registered there as well.
+
+        :param index: The index to register controls in
+        """
+        self.index = index
+        for group in self._groups:
+            group.set_index(index)
+
+    def get_loaders(self) -> Dict[str, Callable[[str], None]]:
+        """Return the loaders by file type.
+
+        :returns: A dict mapping the file_type of the config to the loader
+        """
+        return {"OWASP_ASVS_JSON": self.load_asvs_json,
+                "OWASP_ISVS_JSON": self.load_isvs_json,
+                "OWASP_MASVS_YAML": self.load_masvs_yaml,
+                "OWASP_WSTG_JSON": self.load_wstg_json}
+
+    @profiled("load_section")
+    def load_data_file(self, file_type: str, filename: str, cache_dir: Optional[str] = None) -> None:
+        """Load a data file with the loader for its type. Use the catalogue cache if a cache dir is set.
+
+        :param file_type: The type of the data file, for example OWASP_ASVS_JSON
+        :param filename: The name of the data file
+        :param cache_dir: Directory of the catalogue cache. None disables the cache
+        """
+        start = time.perf_counter()
+        loader = self.get_loaders().get(file_type)
+        if loader is None:
+            print(f"Unknown file type {file_type} for {filename}. Skipping it")
+            return
+
+        self.data_file = filename
+        with PROFILER.phase("hash"):
+            self.data_hash = hash_data_file(file_type, filename, str(self.manual_prefix))
+        cache_file = None
+        data = None
+        if cache_dir is not None:
+            cache_file = get_cache_file(cache_dir, self.data_hash)
+            data = read_cache(cache_file)
+        self.loaded_from_cache = data is not None
+        if data is not None:
+            self.from_cache(data)
+        else:
+            with PROFILER.phase("parse"):
+                loader(filename)
+            if cache_file is not None:
+                write_cache(cache_file, self.to_cache())
+        self.load_duration = time.perf_counter() - start
+
+    def to_cache(self) -> Tuple[Any, ...]:
+        """Return the catalogue data as nested tuples for the cache. States are not part of it.
+
+        :returns: The section tree as tuples
+        """
+        return (self.data_name, self.data_shortname, self.data_version, self.data_description,
+                tuple((group.shortcode, group.ordinal, group.shortname, group.name,
+                       tuple((item.shortcode, item.ordinal, item.name,
+                              tuple((control.shortcode, control.ordinal, control.description,
+                                     tuple(control.cwe), tuple(control.nist), control.statement)
+                                    for control in item.get_controls()))
+                             for item in group.get_items()))
+                      for group in self.groups))
+
+    def from_cache(self, data: Tuple[Any, ...]) -> None:
+        """Build the section tree from cache data.
+
+        :param data: The section tree as created by to_cache
+        """
+        self.data_name, self.data_shortname, self.data_version, self.data_description, groups = data
+        for g_shortcode, g_ordinal, g_shortname, g_name, items in groups:
+            new_group = CbxGroup(shortcode=g_shortcode,
+                                 ordinal=g_ordinal,
+                                 shortname=g_shortname,
+                                 name=g_name)
+            for i_shortcode, i_ordinal, i_name, controls in items:
+                new_item = CbxItem(shortcode=i_shortcode,
+                                   ordinal=i_ordinal,
+                                   name=i_name)
+                for c_shortcode, c_ordinal, c_description, c_cwe, c_nist, c_statement in controls:
+                    new_item.add_control(CbxControl(shortcode=c_shortcode,
+                                                    ordinal=c_ordinal,
+                                                    description=c_description,
+                                                    cwe=c_cwe,
+                                                    nist=c_nist,
+                                                    requirement_matrix={},
+                                                    statement=c_statement,
+                                                    section_prefix=self.manual_prefix))
+                new_group.add_item(new_item)
+            self.add_group(new_group)
 
     def load_masvs_yaml(self, filename: str) -> None:
-        """Load MASVS style yaml files.
+        """Load MASVS style yaml files. Walks the parser events, one control is constructed at a time.
 
         :param filename: the name of the masvs as a yaml file
         """
         with open(filename, "rt", encoding="utf-8") as fh:
-            data = yaml.safe_load(fh)
-            self.data_name = data["metadata"]["title"]
-            self.data_shortname = data["metadata"]["remarks"]
-            self.data_version = data["metadata"]["version"]
-            self.data_description = ""
-
-            item_count = 0
-
-            for group in data["groups"]:
-                new_group = CbxGroup(shortcode=group["id"],
-                                     ordinal=int(group["index"]),
-                                     shortname=group["title"],
-                                     name=group["description"])
-
-                new_item = CbxItem(shortcode="None",
-                                   ordinal=item_count,
-                                   name="None")
-
-                item_count += 1
-
-                for control in group["controls"]:
-                    new_control = CbxControl(shortcode=control["id"],
-                                             ordinal=0,
-                                             description=control["description"],
-                                             cwe=[],
-                                             nist=[],
-                                             requirement_matrix={},
-                                             statement=control["statement"],
-                                             section_prefix=self.manual_prefix)
-                    new_item.add_control(new_control)
-                new_group.add_item(new_item)
-                self.groups.append(new_group)
+            reader = CbxYamlReader(fh)
+            try:
+                self.data_description = ""
+                item_count = 0
+                for key in reader.iter_object():
+                    if key == "metadata":
+                        metadata = reader.read_value()
+                        self.data_name = metadata["title"]
+                        self.data_shortname = metadata["remarks"]
+                        self.data_version = metadata["version"]
+                    elif key == "groups":
+                        for _ in reader.iter_array():
+                            self.add_group(self._read_masvs_group(reader, item_count))
+                            item_count += 1
+                    else:
+                        reader.read_value()
+            finally:
+                reader.close()
+
+    def _read_masvs_group(self, reader: CbxYamlReader, item_count: int) -> CbxGroup:
+        """Build a MASVS group from the stream. MASVS has no items, the controls are put into one item per group.
+
+        :param reader: The reader positioned at the group
+        :param item_count: The ordinal of the item
+        :returns: The group
+        """
+        fields: Dict[str, Any] = {}
+        new_item = CbxItem(shortcode="None",
+                           ordinal=item_count,
+                           name="None")
+        for key in reader.iter_object():
+            if key == "controls":
+                for _ in reader.iter_array():
+                    control = reader.read_value()
+                    new_item.add_control(CbxControl(shortcode=control["id"],
+                                                    ordinal=0,
+                                                    description=control["description"],
+                                                    cwe=[],
+                                                    nist=[],
+                                                    requirement_matrix={},
+                                                    statement=control["statement"],
+                                                    section_prefix=self.manual_prefix))
+            else:
+                fields[key] = reader.read_value()
+        new_group = CbxGroup(shortcode=fields["id"],
+                             ordinal=int(fields["index"]),
+                             shortname=fields["title"],
+                             name=fields["description"])
+        new_group.add_item(new_item)
+        return new_group
 
     def load_isvs_json(self, filename: str) -> None:
-        """Load ISVS style json.
+        """Load ISVS style json. The controls are decoded one at a time while the file is read.
 
         :param filename: the name of the isvs as a json document
         """
@@ -91,7 +340,7 @@ class CbxSection():
         control_count = 0
 
         with open(filename, "rt", encoding="utf-8") as fh:
-            data = json.load(fh)
+            reader = CbxJsonReader(fh)
             new_group = CbxGroup(shortcode="None",
                                  ordinal=group_count,
                                  shortname="None",
@@ -102,7 +351,8 @@ class CbxSection():
                                name="None")
             item_count += 1
 
-            for control in data:
+            for _ in reader.iter_array():
+                control = reader.read_value()
                 new_control = CbxControl(shortcode=control["ID"],
                                          ordinal=control_count,
                                          description=control["Description"],
@@ -114,26 +364,42 @@ class CbxSection():
                 new_item.add_control(new_control)
 
             new_group.add_item(new_item)
-            self.groups.append(new_group)
+            self.add_group(new_group)
 
     def load_asvs_json(self, filename: str) -> None:
-        """Load ASVS json.
+        """Load ASVS json. Groups are built while the file is read, one item with its controls is decoded at a time.
 
         :param filename: The filename of the asvs as a json document
         """
         with open(filename, "rt", encoding="utf-8") as fh:
-            data = json.load(fh)
-            self.data_name = data["Name"]
-            self.data_shortname = data["ShortName"]
-            self.data_version = data["Version"]
-            self.data_description = data["Description"]
-
-            for group_data in data["Requirements"]:
-                new_group = CbxGroup(shortcode=group_data["Shortcode"],
-                                     ordinal=group_data["Ordinal"],
-                                     shortname=group_data["ShortName"],
-                                     name=group_data["Name"])
-                for item in group_data["Items"]:
+            reader = CbxJsonReader(fh)
+            for key in reader.iter_object():
+                if key == "Requirements":
+                    for _ in reader.iter_array():
+                        self.add_group(self._read_asvs_group(reader))
+                elif key == "Name":
+                    self.data_name = reader.read_value()
+                elif key == "ShortName":
+                    self.data_shortname = reader.read_value()
+                elif key == "Version":
+                    self.data_version = reader.read_value()
+                elif key == "Description":
+                    self.data_description = reader.read_value()
+                else:
+                    reader.read_value()
+
+    def _read_asvs_group(self, reader: CbxJsonReader) -> CbxGroup:
+        """Build an ASVS group from the stream.
+
+        :param reader: The reader positioned at the group
+        :returns: The group
+        """
+        fields: Dict[str, Any] = {}
+        items: List[CbxItem] = []
+        for key in reader.iter_object():
+            if key == "Items":
+                for _ in reader.iter_array():
+                    item = reader.read_value()
                     new_item = CbxItem(shortcode=item["Shortcode"],
                                        ordinal=item["Ordinal"],
                                        name=item["Name"])
@@ -146,48 +412,82 @@ class CbxSection():
                                                  requirement_matrix={},
                                                  section_prefix=self.manual_prefix)
                         new_item.add_control(new_control)
-                    new_group.add_item(new_item)
-                self.groups.append(new_group)
+                    items.append(new_item)
+            else:
+                fields[key] = reader.read_value()
+        new_group = CbxGroup(shortcode=fields["Shortcode"],
+                             ordinal=fields["Ordinal"],
+                             shortname=fields["ShortName"],
+                             name=fields["Name"])
+        for new_item in items:
+            new_group.add_item(new_item)
+        return new_group
 
     def load_wstg_json(self, filename: str) -> None:
-        """Load WSTG json.
+        """Load WSTG json. Groups are built while the file is read, one test with its objectives is decoded at a time.
 
         :param filename: The filename of the wstg as a json document
         """
+        self.data_name = "WSTG json"
+        self.data_shortname = "WSTGj"
+        self.data_version = ""
+        self.data_description = ""
+        # Ordinals of groups, tests and controls, counted over the whole file
+        ordinals = [0, 0, 0]
+
         with open(filename, "rt", encoding="utf-8") as fh:
-            data = json.load(fh)
-            self.data_name = "WSTG json"
-            self.data_shortname = "WSTGj"
-            self.data_version = ""
-            self.data_description = ""
-
-            group_ordinal = 0
-            test_ordinal = 0
-            control_ordinal = 0
-
-            for group in data["categories"].keys():
-                new_group = CbxGroup(shortcode=data["categories"][group]["id"],
-                                     ordinal=group_ordinal,
-                                     shortname=group,
-                                     name=group)
-                group_ordinal += 1
-                for item in data["categories"][group]["tests"]:
+            reader = CbxJsonReader(fh)
+            for key in reader.iter_object():
+                if key == "categories":
+                    for group in reader.iter_object():
+                        self.add_group(self._read_wstg_group(reader, group, ordinals))
+                else:
+                    reader.read_value()
+
+    def _read_wstg_group(self, reader: CbxJsonReader, group: str, ordinals: List[int]) -> CbxGroup:
+        """Build a WSTG group from the stream.
+
+        :param reader: The reader positioned at the category
+        :param group: The name of the category
+        :param ordinals: The next group, test and control ordinal. Updated
+        :returns: The group
+        """
+        group_ordinal = ordinals[0]
+        ordinals[0] += 1
+        group_id = None
+        items: List[CbxItem] = []
+        for key in reader.iter_object():
+            if key == "tests":
+                for _ in reader.iter_array():
+                    item = reader.read_value()
                     new_item = CbxItem(shortcode=item["id"],
-                                       ordinal=test_ordinal,
+                                       ordinal=ordinals[1],
                                        name=item["name"])
-                    test_ordinal += 1
+                    ordinals[1] += 1
                     for control in item["objectives"]:
                         new_control = CbxControl(shortcode=hashlib.md5(bytes(control, encoding="utf-8")).hexdigest(),  # nosec  deactivating bandit. Using the hash not for security reasons. So MD5 is ok
-                                                 ordinal=control_ordinal,
+                                                 ordinal=ordinals[2],
                                                  description=control,
                                                  cwe=[],
                                                  nist=[],
                                                  requirement_matrix={},
                                                  section_prefix=self.manual_prefix)
-                        control_ordinal += 1
+                        ordinals[2] += 1
                         new_item.add_control(new_control)
-                    new_group.add_item(new_item)
-                self.groups.append(new_group)
+                    items.append(new_item)
+            elif key == "id":
+                group_id = reader.read_value()
+            else:
+                reader.read_value()
+        if group_id is None:
+            raise KeyError("id")
+        new_group = CbxGroup(shortcode=group_id,
+                             ordinal=group_ordinal,
+                             shortname=group,
+                             name=group)
+        for new_item in items:
+            new_group.add_item(new_item)
+        return new_group
 
     def to_dict(self) -> dict[str, Union[Optional[str], List[dict[str, Union[Optional[str], int, List[dict[str, Union[Optional[str], int, List[dict[str, Union[Optional[str], int, List[str], List[int]]]]]]]]]]]]:
         """Return class attributes as dict.
@@ -233,6 +533,13 @@ Description: {self.data_description}
                 for control in item.get_controls():
                     control.pretty_print()
 
+    def get_uids(self) -> List[str]:
+        """Return the UIDs of all controls of this section.
+
+        :returns: The UIDs in catalogue order
+        """
+        return [control.get_uid() for group in self.groups for item in group.get_items() for control in item.get_controls()]
+
     def get_groups(self) -> list[CbxGroup]:
         """Return a list of groups."""
         return self.groups
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+
+"""Daemon mode. Keeps a loaded empire in memory and offers its operations as a local HTTP/JSON API."""
+
+import asyncio
+import contextlib
+import hmac
+import io
+import ipaddress
+import json
+import os
+import secrets
+import signal
+from typing import Any, AsyncIterator, Callable, Dict, List, Tuple
+
+from app.cbx_batch import CbxMarkResult, MarkRecord
+from app.cbx_client import DEFAULT_TOKEN_FILE, TOKEN_HEADER, CbxApiError
+from app.cbx_control import CbxControlFilter
+from app.cbx_empire import CbxEmpire
+from app.cbx_output import CbxOutput
+
+# Status codes used by the API
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+                415: "Unsupported Media Type", 500: "Internal Server Error"}
+
+
+def is_loopback(host: str) -> bool:
+    """Check if an address only accepts connections from this machine.
+
+    :param host: A host name or IP address
+    :returns: True for localhost and loopback addresses
+    """
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def write_token(token_file: str, token: str) -> None:
+    """Write the token of a server session to a file readable and writable only by the user.
+
+    :param token_file: The file to write
+    :param token: The token
+    """
+    fd = os.open(token_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(fd, "wt", encoding="utf-8") as fh:
+        # An existing file keeps its mode on open
+        os.chmod(token_file, 0o600)
+        fh.write(token)
+
+
+def remove_token(token_file: str, token: str) -> None:
+    """Remove a token file if it still holds the token of this session. A newer server may have replaced it.
+
+    :param token_file: The file to remove
+    :param token: The token of this session
+    """
+    with contextlib.suppress(OSError):
+        with open(token_file, "rt", encoding="utf-8") as fh:
+            current = fh.read().strip()
+        if current == token:
+            os.remove(token_file)
+
+
+class CbxRWLock():
+    """Readers-writer lock for asyncio. Many readers or one writer. Waiting writers block new readers."""
+
+    def __init__(self) -> None:
+        """Create an unlocked lock."""
+        self.condition = asyncio.Condition()
+        self.readers = 0
+        self.writer = False
+        self.writers_waiting = 0
+
+    @contextlib.asynccontextmanager
+    async def read(self) -> AsyncIterator[None]:
+        """Hold the lock as reader."""
+        async with self.condition:
+            await self.condition.wait_for(lambda: not self.writer and self.writers_waiting == 0)
+            self.readers += 1
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.readers -= 1
+                self.condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def write(self) -> AsyncIterator[None]:
+        """Hold the lock as the only writer."""
+        async with self.condition:
+            self.writers_waiting += 1
+            await self.condition.wait_for(lambda: not self.writer and self.readers == 0)
+            self.writers_waiting -= 1
+            self.writer = True
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.writer = False
+                self.condition.notify_all()
+
+
+class CbxServer():
+    """Serves one empire over HTTP. Requests run in worker threads, reads concurrently and writes one after another.
+
+    Marks are saved every save_interval seconds and on shutdown. If the config or a data file changes the empire is reloaded.
+    States saved by other processes are applied before the next request.
+    """
+
+    def __init__(self, config_file: str, host: str = "127.0.0.1", port: int = 8737, save_interval: float = 30.0, watch_interval: float = 2.0,
+                 *, token_file: str = DEFAULT_TOKEN_FILE) -> None:
+        """Create the server. Call run to load the empire and start serving.
+
+        Every request has to send the token of this session, written to token_file readable only by the user. Browsers cannot
+        read it, so web pages cannot send requests to the daemon. Templates and written files are restricted to the working directory.
+
+        :param config_file: The config file of the empire. Reported by ping, clients only use a server of their config
+        :param host: The address to listen on. Only loopback addresses are accepted
+        :param port: The port to listen on
+        :param save_interval: Seconds between saves of changed states
+        :param watch_interval: Seconds between checks for changed config and data files
+        :param token_file: File the token of this session is written to. Clients read it from there
+        :raises ValueError: If host is not a loopback address
+        """
+        if not is_loopback(host):
+            raise ValueError(f"Refusing to listen on {host}. The daemon only serves this machine, use 127.0.0.1, ::1 or localhost")
+        self.config_file = os.path.abspath(config_file)
+        self.host = host
+        self.port = port
+        self.save_interval = save_interval
+        self.watch_interval = watch_interval
+        self.token_file = token_file
+        self.token = secrets.token_urlsafe(32)
+        # Templates and written files have to be in here
+        self.root = os.path.realpath(os.getcwd())
+        self.empire = CbxEmpire()
+        self.lock = CbxRWLock()
+        self.mtimes: Dict[str, float] = {}
+        self.routes: Dict[Tuple[str, str], Callable[[str, Dict[str, Any]], Any]] = {
+            ("GET", "ping"): self.handle_ping,
+            ("GET", "controls"): self.handle_control,
+            ("GET", "list"): self.handle_list,
+            ("GET", "stats"): self.handle_stats,
+            ("POST", "mark"): self.handle_mark,
+            ("POST", "merge"): self.handle_merge,
+            ("POST", "report"): self.handle_report,
+            ("POST", "export"): self.handle_export,
+            ("POST", "save"): self.handle_save,
+        }
+        self.writes = {"mark", "merge", "save"}
+
+    def load(self) -> CbxEmpire:
+        """Load a new empire from the config file and remember the modification times of all files it uses.
+
+        :returns: The loaded empire
+        """
+        empire = CbxEmpire()
+        empire.load_config(self.config_file)
+        files = [self.config_file] + [section.data_file for section in empire.sections if section.data_file is not None]
+        self.mtimes = {filename: os.path.getmtime(filename) for filename in files}
+        return empire
+
+    def files_changed(self) -> bool:
+        """Check if the config or a data file changed since loading.
+
+        :returns: True if a file changed or disappeared
+        """
+        for filename, mtime in self.mtimes.items():
+            try:
+                if os.path.getmtime(filename) != mtime:
+                    return True
+            except FileNotFoundError:
+                return True
+        return False
+
+    def handle_ping(self, _: str, __: Dict[str, Any]) -> Dict[str, Any]:
+        """Report that the server is running.
+
+        :returns: Absolute name of the config file, project and number of controls
+        """
+        return {"config": self.config_file, "project": self.empire.project, "controls": len(self.empire.index)}
+
+    def handle_control(self, uid: str, _: Dict[str, Any]) -> Dict[str, Any]:
+        """Return a control.
+
+        :param uid: The UID of the control
+        :returns: The control data and its pretty text
+        """
+        control = self.empire.find_control_by_uid(uid)
+        if control is None:
+            raise CbxApiError(404, f"Unknown UID {uid}")
+        res: Dict[str, Any] = control.to_dict()
+        res["text"] = control.pretty_format()
+        return res
+
+    def handle_list(self, _: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Return the control list.
+
+        :param body: filter: conditions as created by CbxControlFilter.to_dict, format: one of LIST_FORMATS, default text
+        :returns: The control list as output text
+        """
+        control_filter = CbxControlFilter.from_dict(body.get("filter") or {})
+        out = io.StringIO()
+        CbxOutput(self.empire).write_control_list(out, body.get("format", "text"), control_filter)
+        return {"output": out.getvalue()}
+
+    def handle_stats(self, _: str, __: Dict[str, Any]) -> Dict[str, Any]:
+        """Return the statistics of all sections.
+
+        :returns: Statistics by section prefix and total
+        """
+        return {"sections": {str(section.manual_prefix): section.stats.to_dict() for section in self.empire.sections},
+                "total": self.empire.stats.to_dict()}
+
+    def handle_mark(self, _: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Mark controls. They are saved with the next periodic save.
+
+        :param body: records: list of [uid, state, statement], author: optional author
+        :returns: The summary of the marks
+        """
+        return self.apply_records(body, self.empire.mark_controls)
+
+    def handle_merge(self, _: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Mark the controls whose state or statement differ. They are saved with the next periodic save.
+
+        :param body: records: list of [uid, state, statement], author: optional author, dry_run: only compare
+        :returns: The summary of the merge
+        """
+        dry_run = bool(body.get("dry_run", False))
+        return self.apply_records(body, lambda records: self.empire.merge_controls(records, dry_run))
+
+    def apply_records(self, body: Dict[str, Any], apply: Callable[[List[MarkRecord]], CbxMarkResult]) -> Dict[str, Any]:
+        """Apply mark records as author of the request.
+
+        :param body: records: list of [uid, state, statement], author: optional author
+        :param apply: Applies the records and returns the summary
+        :returns: The summary
+        """
+        records = [(str(uid), str(state), str(statement or "")) for uid, state, statement in body.get("records", [])]
+        author = str(body.get("author") or self.empire.author)
+        if author == self.empire.author:
+            return apply(records).to_dict()
+        # Changes of other authors are saved at once, pending changes are saved before with their own author
+        default_author = self.empire.author
+        self.empire.database.save()
+        self.empire.author = author
+        try:
+            result = apply(records)
+            self.empire.database.save()
+        finally:
+            self.empire.author = default_author
+        return result.to_dict()
+
+    def get_project_path(self, filename: str) -> str:
+        """Resolve a file name of a request and check that it is inside the working directory of the server.
+
+        :param filename: An absolute file name or one relative to the working directory of the server
+        :returns: The absolute file name
+        :raises CbxApiError: If the file is outside the working directory
+        """
+        path = os.path.realpath(os.path.join(self.root, filename))
+        if os.path.commonpath([path, self.root]) != self.root:
+            raise CbxApiError(403, f"{filename} is outside of {self.root}")
+        return path
+
+    def handle_report(self, _: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Generate a html report. Template and output file have to be in the working directory of the server.
+
+        :param body: template, outfile and gzip
+        :returns: The name of the written file
+        """
+        template = os.path.relpath(self.get_project_path(str(body["template"])), self.root).replace(os.sep, "/")
+        outfile = self.get_project_path(str(body["outfile"]))
+        CbxOutput(self.empire).generate_html_report(template, outfile, bool(body.get("gzip", False)))
+        return {"outfile": outfile}
+
+    def handle_export(self, _: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Export to toml, CSV, JSON lines or MessagePack. The files have to be in the working directory of the server.
+
+        :param body: toml_file, csv_file, jsonl_file and/or msgpack_file
+        :returns: The names of the written files
+        """
+        output = CbxOutput(self.empire)
+        exports: Dict[str, Callable[[str], Any]] = {"toml_file": output.export_to_toml,
+                                                    "csv_file": output.export_to_csv,
+                                                    "jsonl_file": output.export_to_jsonl,
+                                                    "msgpack_file": output.export_to_msgpack}
+        files = {key: self.get_project_path(str(body[key])) for key in exports if body.get(key)}
+        for key, filename in files.items():
+            exports[key](filename)
+        return files
+
+    def handle_save(self, _: str, __: Dict[str, Any]) -> Dict[str, Any]:
+        """Save the changed states now.
+
+        :returns: The number of saved changes
+        """
+        changes = len(self.empire.changed_uids)
+        self.empire.database.save()
+        return {"saved": changes}
+
+    async def dispatch(self, method: str, path: str, body: Dict[str, Any]) -> Any:
+        """Run the handler for a request in a worker thread while holding the lock. States other processes saved are applied first.
+
+        :param method: GET or POST
+        :param path: The request path, for example /controls/OWASP_ASVS-V1.1.1
+        :param body: The decoded JSON body
+        :returns: The result of the handler
+        """
+        name, _, argument = path.strip("/").partition("/")
+        handler = self.routes.get((method, name))
+        if handler is None:
+            raise CbxApiError(404 if all(route != name for _, route in self.routes) else 405, f"No route for {method} {path}")
+        loop = asyncio.get_running_loop()
+        # Marks saved by other processes, like commands run with --no_server, are visible to the request
+        if self.empire.database.has_external_changes():
+            async with self.lock.write():
+                await loop.run_in_executor(None, self.empire.database.sync)
+        lock = self.lock.write() if name in self.writes else self.lock.read()
+        async with lock:
+            return await loop.run_in_executor(None, handler, argument, body)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Read one HTTP request, answer it with JSON and close the connection.
+
+        :param reader: The stream to read the request from
+        :param writer: The stream to write the response to
+        """
+        status = 200
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers: Dict[str, str] = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                key, _, value = line.partition(":")
+                headers[key.strip().lower()] = value.strip()
+            if len(request_line) < 2:
+                raise CbxApiError(400, "Malformed request")
+            if not hmac.compare_digest(headers.get(TOKEN_HEADER.lower(), "").encode("latin-1"), self.token.encode("latin-1")):
+                raise CbxApiError(401, f"Missing or wrong {TOKEN_HEADER} header. The token is in {self.token_file}")
+            # Browsers send form posts without preflight, but never a JSON content type
+            if request_line[0] != "GET" and headers.get("content-type", "").partition(";")[0].strip() != "application/json":
+                raise CbxApiError(415, "Requests need Content-Type: application/json")
+            length = int(headers.get("content-length", "0"))
+            body = json.loads(await reader.readexactly(length)) if length else {}
+            result: Any = await self.dispatch(request_line[0], request_line[1], body)
+        except CbxApiError as e:
+            status = e.status
+            result = {"error": str(e)}
+        except (ValueError, KeyError, TypeError) as e:
+            status = 400
+            result = {"error": repr(e)}
+        except Exception as e:  # pylint: disable=broad-except
+            status = 500
+            result = {"error": repr(e)}
+        payload = json.dumps(result).encode("utf-8")
+        writer.write(f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode("latin-1") + payload)
+        with contextlib.suppress(ConnectionError):
+            await writer.drain()
+        writer.close()
+
+    async def save_periodically(self) -> None:
+        """Save changed states every save_interval seconds."""
+        while True:
+            await asyncio.sleep(self.save_interval)
+            if self.empire.changed_uids:
+                async with self.lock.write():
+                    await asyncio.get_running_loop().run_in_executor(None, self.empire.database.save)
+
+    async def watch_files(self) -> None:
+        """Reload the empire if the config or a data file changed. Unsaved changes are saved first."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            if self.files_changed():
+                async with self.lock.write():
+                    await loop.run_in_executor(None, self.empire.database.save)
+                    try:
+                        self.empire = await loop.run_in_executor(None, self.load)
+                        print(f"Reloaded {self.config_file}")
+                    except Exception as e:  # pylint: disable=broad-except
+                        print(f"Reloading failed, keeping the loaded data: {e!r}")
+                        self.mtimes = {filename: os.path.getmtime(filename) for filename in self.mtimes if os.path.exists(filename)}
+
+    async def serve(self) -> None:
+        """Load the empire and serve until SIGINT or SIGTERM. Saves the changed states before exiting."""
+        loop = asyncio.get_running_loop()
+        self.empire = await loop.run_in_executor(None, self.load)
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        write_token(self.token_file, self.token)
+        tasks = [asyncio.create_task(self.save_periodically()), asyncio.create_task(self.watch_files())]
+        print(f"Serving {self.config_file} on {self.host}:{self.port}, token in {self.token_file}")
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            remove_token(self.token_file, self.token)
+        for task in tasks:
+            task.cancel()
+        async with self.lock.write():
+            self.empire.database.save()
+        print("Saved and stopped")
+
+    def run(self) -> None:
+        """Run the server in a new event loop."""
+        asyncio.run(self.serve())
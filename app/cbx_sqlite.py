@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+"""SQLite state backend. Stores the controls of the catalogues, their states and the history of state changes in indexed tables."""
+
+import sqlite3
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.cbx_section import CbxSection
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sections (prefix TEXT PRIMARY KEY, name TEXT, data_hash TEXT);
+CREATE TABLE IF NOT EXISTS controls (uid TEXT PRIMARY KEY, section_prefix TEXT NOT NULL, group_shortcode TEXT, item_shortcode TEXT,
+                                     shortcode TEXT, ordinal INTEGER, description TEXT);
+CREATE INDEX IF NOT EXISTS controls_section_group ON controls (section_prefix, group_shortcode);
+CREATE TABLE IF NOT EXISTS control_cwe (cwe INTEGER NOT NULL, uid TEXT NOT NULL, PRIMARY KEY (cwe, uid));
+CREATE TABLE IF NOT EXISTS control_nist (nist TEXT NOT NULL, uid TEXT NOT NULL, PRIMARY KEY (nist, uid));
+CREATE TABLE IF NOT EXISTS states (uid TEXT PRIMARY KEY, state TEXT NOT NULL, statement TEXT NOT NULL DEFAULT '', timestamp TEXT, author TEXT);
+CREATE INDEX IF NOT EXISTS states_state ON states (state);
+CREATE TABLE IF NOT EXISTS history (id INTEGER PRIMARY KEY AUTOINCREMENT, uid TEXT NOT NULL, state TEXT NOT NULL, statement TEXT NOT NULL,
+                                    timestamp TEXT, author TEXT);
+CREATE INDEX IF NOT EXISTS history_uid ON history (uid);
+CREATE TEMP TABLE IF NOT EXISTS tag_states (uid TEXT PRIMARY KEY, state TEXT NOT NULL, statement TEXT NOT NULL);
+"""
+
+
+class CbxSqliteBackend():
+    """Keeps control states in a SQLite database. Uses WAL mode so several processes can read and write at the same time."""
+
+    def __init__(self, filename: str, timeout: float = 30.0) -> None:
+        """Open or create the database.
+
+        :param filename: The name of the SQLite file
+        :param timeout: Seconds to wait for a lock held by another writer
+        """
+        self.filename = filename
+        # The serve daemon uses the connection from worker threads, one writer at a time
+        self.connection = sqlite3.connect(filename, timeout=timeout, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        """Close the database."""
+        self.connection.close()
+
+    def get_data_version(self) -> int:
+        """Return the data version of the connection. It changes when another connection commits, see PRAGMA data_version.
+
+        :returns: The data version
+        """
+        version: int = self.connection.execute("PRAGMA data_version").fetchone()[0]
+        return version
+
+    def get_section_hashes(self) -> Dict[str, Optional[str]]:
+        """Return the data hashes of the sections whose controls are stored.
+
+        :returns: prefix: data hash
+        """
+        return dict(self.connection.execute("SELECT prefix, data_hash FROM sections").fetchall())
+
+    def sync_sections(self, sections: Iterable[CbxSection]) -> int:
+        """Store the controls of all loaded sections whose data changed since the last sync. Required for queries.
+
+        :param sections: The loaded sections
+        :returns: The number of sections written
+        """
+        known = self.get_section_hashes()
+        synced = 0
+        with self.connection:
+            for section in sections:
+                if not section.is_loaded():
+                    continue
+                prefix = section.manual_prefix or ""
+                if section.data_hash is not None and known.get(prefix) == section.data_hash:
+                    continue
+                controls: List[Tuple[str, str, str, str, str, int, str]] = []
+                cwes: List[Tuple[int, str]] = []
+                nists: List[Tuple[str, str]] = []
+                for group in section.get_groups():
+                    for item in group.get_items():
+                        for control in item.get_controls():
+                            uid = control.get_uid()
+                            controls.append((uid, prefix, group.shortcode, item.shortcode, control.shortcode, control.ordinal, control.description))
+                            cwes.extend((cwe, uid) for cwe in control.cwe)
+                            nists.extend((nist, uid) for nist in control.nist)
+                self.connection.execute("DELETE FROM control_cwe WHERE uid IN (SELECT uid FROM controls WHERE section_prefix = ?)", (prefix,))
+                self.connection.execute("DELETE FROM control_nist WHERE uid IN (SELECT uid FROM controls WHERE section_prefix = ?)", (prefix,))
+                self.connection.execute("DELETE FROM controls WHERE section_prefix = ?", (prefix,))
+                self.connection.executemany("INSERT OR IGNORE INTO controls VALUES (?, ?, ?, ?, ?, ?, ?)", controls)
+                self.connection.executemany("INSERT OR IGNORE INTO control_cwe VALUES (?, ?)", cwes)
+                self.connection.executemany("INSERT OR IGNORE INTO control_nist VALUES (?, ?)", nists)
+                self.connection.execute("INSERT OR REPLACE INTO sections VALUES (?, ?, ?)", (prefix, section.manual_name, section.data_hash))
+                synced += 1
+        return synced
+
+    def get_section_uids(self) -> Dict[str, List[str]]:
+        """Return the UIDs of the stored controls.
+
+        :returns: section prefix: UIDs in catalogue order
+        """
+        uids: Dict[str, List[str]] = {}
+        for prefix, uid in self.connection.execute("SELECT section_prefix, uid FROM controls ORDER BY rowid"):
+            uids.setdefault(prefix, []).append(uid)
+        return uids
+
+    def set_tag_states(self, states: Iterable[Tuple[str, str, str]]) -> int:
+        """Replace the states set by project tags. They are kept in a temporary table of this connection and used by query.
+
+        :param states: (uid, state, statement) tuples
+        :returns: The number of states stored
+        """
+        rows = list(states)
+        with self.connection:
+            self.connection.execute("DELETE FROM temp.tag_states")
+            self.connection.executemany("INSERT OR REPLACE INTO temp.tag_states VALUES (?, ?, ?)", rows)
+        return len(rows)
+
+    def load_states(self) -> Iterator[Tuple[str, str, str]]:
+        """Return all stored states.
+
+        :returns: A generator of (uid, state, statement)
+        """
+        yield from self.connection.execute("SELECT uid, state, statement FROM states")
+
+    def save_states(self, entries: Iterable[Dict[str, str]], history: bool = True) -> int:
+        """Store states in a single transaction.
+
+        :param entries: Entries with uid, state, statement, timestamp and author. See CbxJournal.create_entry
+        :param history: Also add the entries to the history
+        :returns: The number of entries written
+        """
+        rows = [(e["uid"], e["state"], e["statement"], e["timestamp"], e["author"]) for e in entries]
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO states VALUES (?, ?, ?, ?, ?)", rows)
+            if history:
+                self.connection.executemany("INSERT INTO history (uid, state, statement, timestamp, author) VALUES (?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def history(self, uid: Optional[str] = None) -> Iterator[Dict[str, str]]:
+        """Return the history of state changes.
+
+        :param uid: Only return changes of this control. None returns all
+        :returns: A generator of entries with uid, state, statement, timestamp and author
+        """
+        sql = "SELECT uid, state, statement, timestamp, author FROM history"
+        params: Tuple[str, ...] = ()
+        if uid is not None:
+            sql += " WHERE uid = ?"
+            params = (uid,)
+        for row in self.connection.execute(sql + " ORDER BY id", params):
+            yield dict(zip(("uid", "state", "statement", "timestamp", "author"), row))
+
+    def query(self, state: Optional[str] = None, section_prefix: Optional[str] = None, group: Optional[str] = None,
+              cwe: Optional[int] = None, nist: Optional[str] = None) -> List[Tuple[str, str, str, str]]:
+        """Query controls using the indexes. Controls without stored state have the state set by project tags or are unchecked.
+
+        :param state: Only controls with this state
+        :param section_prefix: Only controls of this section
+        :param group: Only controls of the group with this shortcode
+        :param cwe: Only controls referencing this CWE
+        :param nist: Only controls referencing this NIST entry
+        :returns: A list of (uid, state, statement, description)
+        """
+        conditions: List[str] = []
+        params: List[object] = []
+        if state is not None:
+            conditions.append("COALESCE(s.state, t.state, 'unchecked') = ?")
+            params.append(state)
+        if section_prefix is not None:
+            conditions.append("c.section_prefix = ?")
+            params.append(section_prefix)
+        if group is not None:
+            conditions.append("c.group_shortcode = ?")
+            params.append(group)
+        if cwe is not None:
+            conditions.append("c.uid IN (SELECT uid FROM control_cwe WHERE cwe = ?)")
+            params.append(cwe)
+        if nist is not None:
+            conditions.append("c.uid IN (SELECT uid FROM control_nist WHERE nist = ?)")
+            params.append(nist)
+        sql = ("SELECT c.uid, COALESCE(s.state, t.state, 'unchecked'), COALESCE(s.statement, t.statement, ''), c.description "
+               "FROM controls c LEFT JOIN states s ON s.uid = c.uid LEFT JOIN temp.tag_states t ON t.uid = c.uid")
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return self.connection.execute(sql + " ORDER BY c.rowid", params).fetchall()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""Compliance statistics. Counts of controls per state, kept up to date for every item, group, section and the empire."""
+
+from typing import Dict, Optional
+
+from app.cbx_control import State
+
+
+class CbxStats():
+    """Number of controls per state in a container. Changes are passed on to the stats of the parent container."""
+
+    __slots__ = ("counts", "parent")
+
+    def __init__(self) -> None:
+        """Create empty statistics."""
+        self.counts: Dict[State, int] = {state: 0 for state in State}
+        self.parent: Optional["CbxStats"] = None
+
+    def attach(self, parent: "CbxStats") -> None:
+        """Attach to the stats of the parent container and add the own counts there.
+
+        :param parent: The stats of the parent container
+        """
+        self.parent = parent
+        parent.add(self.counts)
+
+    def add(self, counts: Dict[State, int]) -> None:
+        """Add counts and pass them on to the parent.
+
+        :param counts: Number of controls per state to add. Negative numbers remove controls
+        """
+        stats: Optional[CbxStats] = self
+        while stats is not None:
+            for state, count in counts.items():
+                stats.counts[state] += count
+            stats = stats.parent
+
+    def change(self, old: State, new: State) -> None:
+        """Move a control from one state to another.
+
+        :param old: The previous state
+        :param new: The new state
+        """
+        stats: Optional[CbxStats] = self
+        while stats is not None:
+            stats.counts[old] -= 1
+            stats.counts[new] += 1
+            stats = stats.parent
+
+    def get_total(self) -> int:
+        """Return the number of controls.
+
+        :returns: The number of controls
+        """
+        return sum(self.counts.values())
+
+    def get_percent(self) -> float:
+        """Return the percentage of checked controls. Not relevant controls are not counted.
+
+        :returns: Percent of relevant controls that are checked. 100 if there are no relevant controls
+        """
+        relevant = self.counts[State.CHECKED] + self.counts[State.UNCHECKED]
+        if relevant == 0:
+            return 100.0
+        return 100.0 * self.counts[State.CHECKED] / relevant
+
+    def to_dict(self) -> Dict[str, float]:
+        """Return the statistics as dict.
+
+        :returns: Counts per state name, total and percent
+        """
+        res: Dict[str, float] = {state.value: count for state, count in self.counts.items()}
+        res["total"] = self.get_total()
+        res["percent"] = self.get_percent()
+        return res
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+"""Incremental JSON and YAML reading. Walks large documents without loading the whole document."""
+
+import json
+import re
+from json.decoder import scanstring  # type: ignore[attr-defined]
+from typing import Any, Dict, Iterable, Iterator, TextIO, Tuple
+
+# Characters read at once
+CHUNK_SIZE = 1 << 20
+# Characters read at once by the pull readers. A load needs the tree and a few chunks of memory
+READER_CHUNK_SIZE = 1 << 16
+
+# A value decoded closer than this to the end of the buffer is decoded again with the next chunk. A number like 1.5 could be cut after 1
+NUMBER_MARGIN = 64
+
+WHITESPACE_RE = re.compile(r"[ \t\r\n]*")
+
+
+def iter_json_arrays(fh: TextIO, keys: Iterable[str], chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[str, Any]]:
+    """Yield the items of all arrays stored under one of the keys, in document order and at any depth.
+
+    Only the current item and one chunk are kept in memory. The arrays are found by a scan for "key": [ outside of strings.
+    Items are decoded completely, arrays nested in an item are part of the item and not yielded on their own.
+
+    :param fh: The file handle to read from
+    :param keys: The keys of the arrays
+    :param chunk_size: Characters to read at once
+    :returns: A generator of (key, item)
+    """
+    pattern = re.compile(r'"(' + "|".join(re.escape(key) for key in keys) + r')"\s*:\s*\[')
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+    key = None
+
+    while True:
+        if pos >= len(buffer) - 64 and not eof:
+            # Keep a tail for keys split between chunks
+            chunk = fh.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+        if key is None:
+            match = pattern.search(buffer, pos)
+            if match is None:
+                if eof:
+                    return
+                pos = max(pos, len(buffer) - 256)
+                chunk = fh.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            key = match.group(1)
+            pos = match.end()
+            continue
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= len(buffer):
+            if eof:
+                raise ValueError(f"Unterminated array {key}")
+            continue
+        if buffer[pos] == "]":
+            key = None
+            pos += 1
+            continue
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            end = -1
+        if end == -1 or (end == len(buffer) and not eof):
+            # The item continues in the next chunk
+            chunk = fh.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        pos = end
+        yield key, item
+
+
+class CbxJsonReader():
+    """Pull reader for JSON documents. Only one chunk and the value currently decoded are in memory.
+
+    The caller walks the containers with iter_object and iter_array and has to consume every key or element they yield: with
+    read_value (decoded at once by the C decoder of the json module), or by walking it with iter_object or iter_array.
+    The YAML reader offers the same methods, so loaders can walk both.
+    """
+
+    def __init__(self, fh: TextIO, chunk_size: int = READER_CHUNK_SIZE) -> None:
+        """Create a reader positioned before the first value.
+
+        :param fh: The file handle to read from
+        :param chunk_size: Characters to read at once
+        """
+        self.fh = fh
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """Drop the consumed part of the buffer and read the next chunk.
+
+        :returns: False at the end of the file
+        """
+        chunk = self.fh.read(self.chunk_size)
+        self.eof = not chunk
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return not self.eof
+
+    def peek(self) -> str:
+        """Skip white space and return the next character without consuming it.
+
+        :returns: The next character
+        :raises ValueError: At the end of the file
+        """
+        if self.pos < len(self.buffer) and self.buffer[self.pos] not in " \t\r\n":
+            return self.buffer[self.pos]
+        self.pos = WHITESPACE_RE.match(self.buffer, self.pos).end()  # type: ignore[union-attr]
+        while self.pos >= len(self.buffer):
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON document")
+            self.pos = WHITESPACE_RE.match(self.buffer, self.pos).end()  # type: ignore[union-attr]
+        return self.buffer[self.pos]
+
+    def expect(self, char: str) -> None:
+        """Consume the next character.
+
+        :param char: The character it has to be
+        :raises ValueError: If it is another character
+        """
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} but found {found!r} in JSON document")
+        self.pos += 1
+
+    def read_value(self) -> Any:
+        """Decode the next value completely.
+
+        :returns: The value
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self.fill()
+                continue
+            if len(self.buffer) - end < NUMBER_MARGIN and not self.eof:
+                # The value may continue in the next chunk
+                self.fill()
+                continue
+            self.pos = end
+            return value
+
+    def read_key(self) -> str:
+        """Decode the next object key and the colon after it.
+
+        :returns: The key
+        """
+        if self.peek() != '"':
+            raise ValueError(f"Expected an object key but found {self.buffer[self.pos]!r} in JSON document")
+        while True:
+            try:
+                key, end = scanstring(self.buffer, self.pos + 1)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self.fill()
+                continue
+            self.pos = end
+            self.expect(":")
+            return str(key)
+
+    def iter_object(self) -> Iterator[str]:
+        """Walk the object starting at the next value. Consume the value of every key before asking for the next one.
+
+        :returns: A generator of the keys
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            yield self.read_key()
+            if self.peek() == "}":
+                self.pos += 1
+                return
+            self.expect(",")
+
+    def iter_array(self) -> Iterator[int]:
+        """Walk the array starting at the next value. Consume every element before asking for the next one.
+
+        :returns: A generator of the positions of the elements
+        """
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        position = 0
+        while True:
+            yield position
+            position += 1
+            if self.peek() == "]":
+                self.pos += 1
+                return
+            self.expect(",")
+
+
+class CbxYamlReader():
+    """Pull reader for YAML documents on the event stream of the parser. Uses the C parser of libyaml if PyYAML was built with it.
+
+    Offers the methods of CbxJsonReader. Values are constructed with the safe constructors, so tags are resolved like yaml.safe_load does.
+    """
+
+    def __init__(self, fh: TextIO) -> None:
+        """Create a reader positioned before the root value of the first document.
+
+        :param fh: The file handle to read from
+        """
+        # Only needed for YAML data files. Loaded here to keep the start of the other commands fast
+        import yaml  # pylint: disable=import-outside-toplevel
+        self.yaml = yaml
+        self.loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)(fh)
+        self.anchors: Dict[str, Any] = {}
+        self.loader.get_event()  # StreamStartEvent
+        self.loader.get_event()  # DocumentStartEvent
+
+    def close(self) -> None:
+        """Release the parser."""
+        self.loader.dispose()
+
+    def expect(self, event_class: type) -> Any:
+        """Consume the next event.
+
+        :param event_class: The class it has to be
+        :returns: The event
+        :raises ValueError: If it is another event
+        """
+        event = self.loader.get_event()
+        if not isinstance(event, event_class):
+            raise ValueError(f"Expected {event_class.__name__} but found {type(event).__name__} in YAML document at {event.start_mark}")
+        return event
+
+    def read_value(self) -> Any:
+        """Construct the next value completely.
+
+        :returns: The value
+        """
+        yaml = self.yaml
+        event = self.loader.get_event()
+        if isinstance(event, yaml.AliasEvent):
+            return self.anchors[event.anchor]
+        value: Any
+        if isinstance(event, yaml.ScalarEvent):
+            tag = event.tag
+            if tag is None or tag == "!":
+                tag = self.loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+            node = yaml.ScalarNode(tag, event.value, event.start_mark, event.end_mark, event.style)
+            constructor = self.loader.yaml_constructors.get(tag, self.loader.yaml_constructors[None])
+            value = constructor(self.loader, node)
+        elif isinstance(event, yaml.SequenceStartEvent):
+            value = []
+            while not self.loader.check_event(yaml.SequenceEndEvent):
+                value.append(self.read_value())
+            self.loader.get_event()
+        elif isinstance(event, yaml.MappingStartEvent):
+            value = {}
+            while not self.loader.check_event(yaml.MappingEndEvent):
+                key = self.read_value()
+                value[key] = self.read_value()
+            self.loader.get_event()
+        else:
+            raise ValueError(f"Unexpected {type(event).__name__} in YAML document at {event.start_mark}")
+        if event.anchor is not None:
+            self.anchors[event.anchor] = value
+        return value
+
+    def iter_object(self) -> Iterator[str]:
+        """Walk the mapping starting at the next event. Consume the value of every key before asking for the next one.
+
+        :returns: A generator of the keys
+        """
+        self.expect(self.yaml.MappingStartEvent)
+        while not self.loader.check_event(self.yaml.MappingEndEvent):
+            yield str(self.read_value())
+        self.loader.get_event()
+
+    def iter_array(self) -> Iterator[int]:
+        """Walk the sequence starting at the next event. Consume every element before asking for the next one.
+
+        :returns: A generator of the positions of the elements
+        """
+        self.expect(self.yaml.SequenceStartEvent)
+        position = 0
+        while not self.loader.check_event(self.yaml.SequenceEndEvent):
+            yield position
+            position += 1
+        self.loader.get_event()
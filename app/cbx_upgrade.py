@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+"""Catalogue upgrades. Matches the controls of an old and a new version of the catalogues and carries the stored states over."""
+
+import csv
+import math
+import time
+from collections import Counter
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, TextIO, Tuple
+
+from app.cbx_batch import MarkRecord
+from app.cbx_control import CbxControl
+from app.cbx_search import TOKEN_RE
+from app.cbx_section import CbxSection
+
+# Matching stages in the order they run
+MATCH_UID = "uid"
+MATCH_DESCRIPTION = "description"
+MATCH_SIMILAR = "similar"
+# Controls without partner in the other version
+REMOVED = "removed"
+ADDED = "added"
+
+# Columns of the mapping report
+MAPPING_COLUMNS = ("match", "similarity", "old_uid", "new_uid", "state", "statement", "old_description", "new_description")
+
+
+def normalize(text: str) -> str:
+    """Normalize a description for comparison. Case, punctuation and white space are ignored.
+
+    :param text: The description
+    :returns: The lower case words separated by single spaces
+    """
+    return " ".join(TOKEN_RE.findall(text.lower()))
+
+
+def similarity(old: FrozenSet[str], new: FrozenSet[str]) -> float:
+    """Return the Jaccard similarity of two word sets.
+
+    :param old: The words of one description
+    :param new: The words of the other description
+    :returns: 1.0 for equal sets, 0.0 for sets without common words
+    """
+    if not old and not new:
+        return 1.0
+    return len(old & new) / len(old | new)
+
+
+def find_similar(old: Sequence[FrozenSet[str]], new: Sequence[FrozenSet[str]], threshold: float) -> List[Tuple[float, int, int]]:
+    """Find all pairs of word sets with a similarity of at least threshold, without comparing all pairs.
+
+    Prefix filtering: the words of every set are ordered from rare to frequent. Two sets with a Jaccard similarity of at least
+    threshold share a word in their first len - ceil(threshold * len) + 1 words. Only the new sets in the buckets of these rare
+    words are compared.
+
+    :param old: Word sets of the old controls
+    :param new: Word sets of the new controls
+    :param threshold: The minimal similarity, above 0
+    :returns: (similarity, old position, new position) for all pairs found
+    """
+    frequency: Counter[str] = Counter()
+    for words in list(old) + list(new):
+        frequency.update(words)
+
+    def prefix(words: FrozenSet[str]) -> List[str]:
+        ordered = sorted(words, key=lambda word: (frequency[word], word))
+        return ordered[:len(ordered) - math.ceil(threshold * len(ordered) - 1e-9) + 1]
+
+    buckets: Dict[str, List[int]] = {}
+    for position, words in enumerate(new):
+        for word in prefix(words):
+            buckets.setdefault(word, []).append(position)
+    pairs = []
+    for old_position, words in enumerate(old):
+        candidates = {position for word in prefix(words) for position in buckets.get(word, ())}
+        for new_position in candidates:
+            other = new[new_position]
+            # Sets of very different size can not be similar enough
+            if threshold * len(words) <= len(other) <= len(words) / threshold:
+                score = similarity(words, other)
+                if score >= threshold:
+                    pairs.append((score, old_position, new_position))
+    return pairs
+
+
+class CbxUpgrade():
+    """The mapping of the controls of an old catalogue version to a new one.
+
+    Sections are matched by prefix. Within a section the controls are matched by UID first, then by equal normalized descriptions
+    and at last by the similarity of their words. A UID match is skipped if the description of one of the controls appears
+    unchanged under another UID, the control was moved.
+    """
+
+    def __init__(self, min_similarity: float = 0.5) -> None:
+        """Create an empty mapping.
+
+        :param min_similarity: Minimal Jaccard similarity of the words of two descriptions for the last matching stage
+        """
+        if not 0.0 < min_similarity <= 1.0:
+            raise ValueError(f"The minimal similarity has to be above 0 and at most 1, not {min_similarity}")
+        self.min_similarity = min_similarity
+        # match, similarity, old control, new control
+        self.matches: List[Tuple[str, float, Optional[CbxControl], Optional[CbxControl]]] = []
+        self.duration: float = 0.0
+
+    def match_sections(self, old_sections: Iterable[CbxSection], new_sections: Iterable[CbxSection]) -> "CbxUpgrade":
+        """Match the controls of the loaded sections of both versions.
+
+        :param old_sections: The sections of the old version
+        :param new_sections: The sections of the new version
+        :returns: self
+        """
+        start = time.perf_counter()
+        new_by_prefix = {section.manual_prefix: section for section in new_sections}
+        for section in old_sections:
+            other = new_by_prefix.pop(section.manual_prefix, None)
+            self.match_controls(self.get_controls(section), self.get_controls(other) if other is not None else [])
+        for other in new_by_prefix.values():
+            self.match_controls([], self.get_controls(other))
+        self.duration += time.perf_counter() - start
+        return self
+
+    @staticmethod
+    def get_controls(section: CbxSection) -> List[CbxControl]:
+        """Return the controls of a section.
+
+        :param section: The loaded section
+        :returns: The controls in catalogue order
+        """
+        return [control for group in section.get_groups() for item in group.get_items() for control in item.get_controls()]
+
+    def match_controls(self, old: List[CbxControl], new: List[CbxControl]) -> None:
+        """Match the controls of one section.
+
+        :param old: The controls of the old version
+        :param new: The controls of the new version
+        """
+        old_texts = [normalize(control.description) for control in old]
+        new_texts = [normalize(control.description) for control in new]
+        old_words = [frozenset(text.split()) for text in old_texts]
+        new_words = [frozenset(text.split()) for text in new_texts]
+        partner: Dict[int, Tuple[str, float, int]] = {}
+        taken = set()
+
+        # By UID. Moved descriptions are left to the next stage
+        new_positions = {control.uid: position for position, control in enumerate(new)}
+        old_text_set = set(old_texts)
+        new_text_set = set(new_texts)
+        for old_position, control in enumerate(old):
+            new_position = new_positions.get(control.uid)
+            if new_position is None:
+                continue
+            old_text, new_text = old_texts[old_position], new_texts[new_position]
+            if old_text != new_text and (old_text in new_text_set or new_text in old_text_set):
+                continue
+            partner[old_position] = (MATCH_UID, similarity(old_words[old_position], new_words[new_position]), new_position)
+            taken.add(new_position)
+
+        # By the hash of the normalized description. Duplicates are paired in catalogue order
+        unmatched: Dict[str, List[int]] = {}
+        for new_position, text in enumerate(new_texts):
+            if new_position not in taken:
+                unmatched.setdefault(text, []).append(new_position)
+        for old_position, text in enumerate(old_texts):
+            if old_position not in partner and unmatched.get(text):
+                new_position = unmatched[text].pop(0)
+                partner[old_position] = (MATCH_DESCRIPTION, 1.0, new_position)
+                taken.add(new_position)
+
+        # By similar words, best pairs first
+        old_left = [position for position in range(len(old)) if position not in partner]
+        new_left = [position for position in range(len(new)) if position not in taken]
+        pairs = find_similar([old_words[position] for position in old_left], [new_words[position] for position in new_left], self.min_similarity)
+        for score, old_index, new_index in sorted(pairs, key=lambda pair: (-pair[0], pair[1], pair[2])):
+            old_position, new_position = old_left[old_index], new_left[new_index]
+            if old_position not in partner and new_position not in taken:
+                partner[old_position] = (MATCH_SIMILAR, score, new_position)
+                taken.add(new_position)
+
+        for old_position, control in enumerate(old):
+            if old_position in partner:
+                match, score, new_position = partner[old_position]
+                self.matches.append((match, score, control, new[new_position]))
+            else:
+                self.matches.append((REMOVED, 0.0, control, None))
+        for new_position, control in enumerate(new):
+            if new_position not in taken:
+                self.matches.append((ADDED, 0.0, None, control))
+
+    def get_mapping(self) -> Dict[str, str]:
+        """Return the new UID of every matched old control.
+
+        :returns: old UID: new UID
+        """
+        return {old.uid: new.uid for _, _, old, new in self.matches if old is not None and new is not None}
+
+    def get_records(self, states: Dict[str, Tuple[str, str]]) -> List[MarkRecord]:
+        """Create the mark records carrying the stored states over to the new controls.
+
+        :param states: The stored states of the old version, uid: (state, statement)
+        :returns: (new uid, state, statement) for every matched control with a stored state
+        """
+        return [(new_uid, *states[old_uid]) for old_uid, new_uid in self.get_mapping().items() if old_uid in states]
+
+    def write_mapping(self, fh: TextIO, states: Dict[str, Tuple[str, str]]) -> int:
+        """Write the mapping report as CSV. See MAPPING_COLUMNS.
+
+        :param fh: The file handle to write to. Open it with newline=""
+        :param states: The stored states of the old version, uid: (state, statement)
+        :returns: The number of rows written
+        """
+        writer = csv.writer(fh)
+        writer.writerow(MAPPING_COLUMNS)
+        for match, score, old, new in self.matches:
+            state, statement = states.get(old.uid, ("", "")) if old is not None else ("", "")
+            writer.writerow((match, f"{score:.2f}" if old is not None and new is not None else "",
+                             old.uid if old is not None else "", new.uid if new is not None else "",
+                             state, statement,
+                             old.description if old is not None else "", new.description if new is not None else ""))
+        return len(self.matches)
+
+    def get_counts(self) -> Dict[str, int]:
+        """Count the controls per match.
+
+        :returns: Number of controls per match, removed and added
+        """
+        counts = {match: 0 for match in (MATCH_UID, MATCH_DESCRIPTION, MATCH_SIMILAR, REMOVED, ADDED)}
+        for match, _, _, _ in self.matches:
+            counts[match] += 1
+        return counts
+
+    def print_summary(self, states: Dict[str, Tuple[str, str]]) -> None:
+        """Print the number of matched controls and the stored states that are lost.
+
+        :param states: The stored states of the old version, uid: (state, statement)
+        """
+        counts = self.get_counts()
+        print(f"Matched by UID: {counts[MATCH_UID]}, by description: {counts[MATCH_DESCRIPTION]}, by similarity: {counts[MATCH_SIMILAR]}")
+        print(f"Removed controls: {counts[REMOVED]}, added controls: {counts[ADDED]}")
+        lost = [old.uid for match, _, old, _ in self.matches if match == REMOVED and old is not None and old.uid in states]
+        if lost:
+            print(f"Stored states of removed controls, not carried over: {len(lost)}")
+        print(f"Matched in {self.duration * 1000:.1f} ms")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+"""Export benchmark. Compares time, throughput, output size and peak memory of the export formats on a synthetic catalogue."""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from app.cbx_empire import CbxEmpire  # noqa: E402
+from app.cbx_output import CbxOutput  # noqa: E402
+from bench_memory import build_section  # noqa: E402
+
+
+def run(controls: int, formats: List[str], memory: bool) -> List[Dict[str, Any]]:
+    """Export a synthetic catalogue in every format.
+
+    :param controls: Number of controls
+    :param formats: The formats to benchmark
+    :param memory: Also measure the peak memory with tracemalloc. Slows down the exports
+    :returns: One result per format
+    """
+    empire = CbxEmpire()
+    section = build_section("OWASP_ASVS", controls)
+    # The toml export needs the catalogue metadata of a loaded data file
+    section.data_name = section.data_shortname = "ASVS"
+    section.data_version = "4.0.3"
+    section.data_description = "Synthetic catalogue"
+    empire.add_section(section)
+    for number, uid in enumerate(empire.index.uids()):
+        if number % 4 == 0:
+            empire.apply_state(uid, "checked", f"Reviewed in ticket {number}")
+        else:
+            empire.apply_state(uid, "unchecked", "")
+    output = CbxOutput(empire)
+    exports: Dict[str, Callable[[str], object]] = {"toml": output.export_to_toml,
+                                                   "csv": output.export_to_csv,
+                                                   "jsonl": output.export_to_jsonl,
+                                                   "msgpack": output.export_to_msgpack}
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in formats:
+            filename = os.path.join(tmp_dir, f"controls.{name}")
+            start = time.perf_counter()
+            exports[name](filename)
+            duration = time.perf_counter() - start
+            if not os.path.exists(filename):
+                continue
+            result: Dict[str, Any] = {"format": name, "controls": len(empire.index), "seconds": duration,
+                                      "controls_per_second": len(empire.index) / duration, "bytes": os.path.getsize(filename)}
+            if memory:
+                tracemalloc.start()
+                exports[name](filename)
+                result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare the export formats')
+    parser.add_argument('--controls', type=int, default=10000, help='Number of controls')
+    parser.add_argument('--formats', nargs="+", choices=["toml", "csv", "jsonl", "msgpack"], default=["toml", "csv", "jsonl", "msgpack"], help='Formats to compare')
+    parser.add_argument('--memory', action="store_true", default=False, help='Also measure the peak memory of every export')
+    parser.add_argument('--json', action="store_true", default=False, help='Print the results as JSON')
+    args = parser.parse_args()
+    res = run(args.controls, args.formats, args.memory)
+    if args.json:
+        print(json.dumps(res, indent=2))
+    else:
+        for entry in res:
+            peak = f", peak {entry['peak_bytes'] / 1e6:.1f} MB" if "peak_bytes" in entry else ""
+            print(f"{entry['format']:8} {entry['seconds']:8.3f} s {entry['controls_per_second']:10.0f} controls/s {entry['bytes'] / 1e6:8.2f} MB{peak}")
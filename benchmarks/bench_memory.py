@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+"""Memory benchmark for the control tree. Builds synthetic catalogues and measures the memory per control."""
+
+import argparse
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# pylint: disable=wrong-import-position
+from app.cbx_columns import CbxColumnStore  # noqa: E402
+from app.cbx_control import CbxControl  # noqa: E402
+from app.cbx_empire import CbxEmpire  # noqa: E402
+from app.cbx_group import CbxGroup  # noqa: E402
+from app.cbx_item import CbxItem  # noqa: E402
+from app.cbx_section import CbxSection  # noqa: E402
+from generators import write_project  # noqa: E402
+
+# Data files written by write_project and their types
+DATA_FILES = (("asvs.json", "OWASP_ASVS_JSON"), ("isvs.json", "OWASP_ISVS_JSON"), ("masvs.yaml", "OWASP_MASVS_YAML"), ("wstg.json", "OWASP_WSTG_JSON"))
+
+
+def build_section(prefix: str, controls: int) -> CbxSection:
+    """Build a synthetic ASVS like section.
+
+    :param prefix: The prefix of the section
+    :param controls: The number of controls to create
+    :returns: The section
+    """
+    section = CbxSection(name=prefix, prefix=prefix, description="Synthetic section")
+    per_item = 10
+    per_group = 100
+    for group_ordinal in range(max(1, controls // per_group)):
+        group = CbxGroup(shortcode=f"V{group_ordinal}", ordinal=group_ordinal, shortname=f"G{group_ordinal}", name=f"Group {group_ordinal}")
+        for item_ordinal in range(per_group // per_item):
+            item = CbxItem(shortcode=f"V{group_ordinal}.{item_ordinal}", ordinal=item_ordinal, name=f"Item {item_ordinal}")
+            for control_ordinal in range(per_item):
+                item.add_control(CbxControl(shortcode=f"V{group_ordinal}.{item_ordinal}.{control_ordinal}",
+                                            ordinal=control_ordinal,
+                                            description=f"Verify that the application handles case {control_ordinal} securely",
+                                            cwe=[79] if control_ordinal % 3 == 0 else [],
+                                            nist=[],
+                                            requirement_matrix={},
+                                            section_prefix=prefix))
+            group.add_item(item)
+        section.add_group(group)
+    return section
+
+
+def measure(controls: int, versions: int) -> None:
+    """Print the memory used by the control tree and by a column store of its states.
+
+    :param controls: Controls per catalogue version
+    :param versions: Number of catalogue versions loaded side by side
+    """
+    gc.collect()
+    tracemalloc.start()
+    empire = CbxEmpire()
+    for version in range(versions):
+        empire.add_section(build_section(f"OWASP_ASVS_{version}", controls))
+    tree, _ = tracemalloc.get_traced_memory()
+    store = CbxColumnStore.from_index(empire.index)
+    with_store, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = len(empire.index)
+    print(f"Controls: {total}")
+    print(f"Control tree: {tree / 1e6:.1f} MB, {tree / total:.0f} bytes per control")
+    print(f"Column store (positions, states, statements): {(with_store - tree) / 1e6:.1f} MB, {len(store.states)} bytes state column")
+
+
+def measure_load(controls: int) -> None:
+    """Print the peak memory while parsing the data files of a synthetic project, compared with the tree that was built.
+
+    :param controls: Controls of the project, shared by the four data files
+    """
+    project = tempfile.mkdtemp(prefix="cbx_memory_")
+    try:
+        write_project(project, controls)
+        for filename, file_type in DATA_FILES:
+            section = CbxSection(name=file_type, prefix=file_type, description="")
+            gc.collect()
+            tracemalloc.start()
+            section.get_loaders()[file_type](os.path.join(project, "data", filename))
+            tree, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            size = os.path.getsize(os.path.join(project, "data", filename))
+            print(f"{filename}: file {size / 1e6:.1f} MB, tree {tree / 1e6:.1f} MB, peak while parsing {peak / 1e6:.1f} MB")
+    finally:
+        shutil.rmtree(project, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure memory per control')
+    parser.add_argument('--controls', type=int, default=100000, help='Controls per catalogue version')
+    parser.add_argument('--versions', type=int, default=2, help='Catalogue versions loaded side by side')
+    parser.add_argument('--load', action='store_true', help='Measure the peak memory of parsing the data files instead')
+    args = parser.parse_args()
+    if args.load:
+        measure_load(args.controls)
+    else:
+        measure(args.controls, args.versions)
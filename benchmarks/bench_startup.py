@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+"""Cold start budget. Measures show <uid> in a new process with a warm catalogue cache and checks the imports of the CLI.
+
+Fails if show imports one of the heavy dependencies that only other commands need or more modules than allowed on top of the
+interpreter start. Those checks do not depend on the speed of the machine. The wall times are compared with their budgets and
+reported, they only fail the run with --strict. Budgets given as factors of the start of a bare Python interpreter
+(python -c pass, measured in the same run) follow the speed of the machine, so they can be strict on any machine.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess  # nosec
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, BENCH_DIR)
+
+# pylint: disable=wrong-import-position
+from generators import write_project  # noqa: E402
+
+# Only imported by the commands using them: reports, exports, MASVS, daemon, parallel loading, sqlite backend, profiling
+HEAVY_MODULES = ("jinja2", "tomlkit", "yaml", "asyncio", "multiprocessing", "concurrent.futures", "sqlite3", "http.client",
+                 "cProfile", "tracemalloc", "msgpack")
+
+
+def run(project_dir: str, arguments: List[str], python_options: Tuple[str, ...] = ()) -> Tuple[float, str]:
+    """Run checkbox_empire.py in a new process.
+
+    :param project_dir: The project directory, used as working directory
+    :param arguments: The command and its arguments
+    :param python_options: Options of the interpreter, like -X importtime
+    :returns: Wall time in seconds and stderr
+    """
+    command = [sys.executable, *python_options, os.path.join(ROOT_DIR, "checkbox_empire.py"), "--config", "config_toml.toml"] + arguments
+    start = time.perf_counter()
+    process = subprocess.run(command, cwd=project_dir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)  # nosec
+    return time.perf_counter() - start, process.stderr
+
+
+def get_imports(importtime: str) -> Dict[str, int]:
+    """Parse the output of python -X importtime.
+
+    :param importtime: The stderr of the run
+    :returns: Cumulative import time in microseconds per module
+    """
+    imports = {}
+    for line in importtime.splitlines():
+        if line.startswith("import time:") and "|" in line and "cumulative" not in line:
+            _, cumulative, name = line.split("|")
+            imports[name.strip()] = int(cumulative)
+    return imports
+
+
+def get_python_imports() -> Dict[str, int]:
+    """Return the modules the interpreter imports on its own start.
+
+    :returns: Cumulative import time in microseconds per module
+    """
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", "pass"], capture_output=True, text=True, check=True)  # nosec
+    return get_imports(process.stderr)
+
+
+def get_import_time(module: str) -> float:
+    """Measure the import of a module in a new process.
+
+    :param module: The module name, importable from the repository root
+    :returns: Cumulative import time in seconds
+    """
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT_DIR,  # nosec
+                             capture_output=True, text=True, check=True)
+    return get_imports(process.stderr)[module] / 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check the cold start of show <uid> against a time budget')
+    parser.add_argument('--controls', type=int, default=1000, help='Number of controls of the generated project')
+    parser.add_argument('--max_modules', type=int, default=100, help='Maximal number of modules show imports on top of the interpreter start')
+    parser.add_argument('--budget', type=float, default=100.0, help='Median wall time of show in milliseconds. Reported, only fails with --strict')
+    parser.add_argument('--import_budget', type=float, default=60.0, help='Import time of checkbox_empire.py in milliseconds. Reported, only fails with --strict')
+    parser.add_argument('--budget_factor', type=float, default=None, help='Median wall time of show as multiple of the Python start. Replaces --budget')
+    parser.add_argument('--import_factor', type=float, default=None, help='Import time of checkbox_empire.py as multiple of the Python start. Replaces --import_budget')
+    parser.add_argument('--strict', action="store_true", default=False, help='Also fail if a wall time exceeds its budget. Only useful on a known machine')
+    parser.add_argument('--repeat', type=int, default=10, help='Runs of show, the median is compared with the budget')
+    parser.add_argument('--output', default=None, help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    project = tempfile.mkdtemp(prefix="cbx_startup_")
+    try:
+        write_project(project, args.controls, "toml")
+        # A warm catalogue cache and a database with the states of all controls, like a project in use
+        run(project, ["cache"])
+        run(project, ["compact"])
+        with open(os.path.join(project, "database.toml"), "rt", encoding="utf-8") as fh:
+            uid = next(line.split('"')[1] for line in fh if line.startswith("uid = "))
+
+        starts = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", "pass"], check=True)  # nosec
+            starts.append(time.perf_counter() - start)
+        baseline = statistics.median(starts)
+        durations = [run(project, ["show", uid])[0] for _ in range(args.repeat)]
+        show_time = statistics.median(durations)
+        imports = get_imports(run(project, ["show", uid], ("-X", "importtime"))[1])
+        python_imports = get_python_imports()
+        import_time = min(get_import_time("checkbox_empire") for _ in range(3))
+    finally:
+        shutil.rmtree(project, ignore_errors=True)
+
+    if args.budget_factor is not None:
+        args.budget = args.budget_factor * baseline * 1000
+    if args.import_factor is not None:
+        args.import_budget = args.import_factor * baseline * 1000
+    heavy = [module for module in HEAVY_MODULES if any(name == module or name.startswith(module + ".") for name in imports)]
+    modules = sorted(imports.keys() - python_imports.keys())
+    print(f"Python start: {baseline * 1000:.1f} ms")
+    print(f"show {uid}: {show_time * 1000:.1f} ms, {show_time / baseline:.1f} x Python start (budget {args.budget:.0f} ms), "
+          f"runs: {', '.join(f'{duration * 1000:.0f}' for duration in durations)}")
+    print(f"import checkbox_empire: {import_time * 1000:.1f} ms (budget {args.import_budget:.0f} ms)")
+    print(f"Modules imported by show: {len(modules)} (maximum {args.max_modules})")
+    print("Slowest imports of show:")
+    for name, microseconds in sorted(imports.items(), key=lambda entry: -entry[1])[:10]:
+        print(f"  {microseconds / 1000:7.1f} ms  {name}")
+
+    failures = []
+    warnings = []
+    if show_time * 1000 > args.budget:
+        warnings.append(f"show takes {show_time * 1000:.1f} ms, budget {args.budget:.0f} ms")
+    if import_time * 1000 > args.import_budget:
+        warnings.append(f"import takes {import_time * 1000:.1f} ms, budget {args.import_budget:.0f} ms")
+    if args.strict:
+        failures, warnings = warnings, []
+    if heavy:
+        failures.append(f"show imports {', '.join(heavy)}")
+    if len(modules) > args.max_modules:
+        failures.append(f"show imports {len(modules)} modules, maximum {args.max_modules}")
+    if args.output:
+        with open(args.output, "wt", encoding="utf-8") as out:
+            json.dump({"show_ms": show_time * 1000, "import_ms": import_time * 1000, "heavy_imports": heavy, "budget_ms": args.budget,
+                       "import_budget_ms": args.import_budget, "python_start_ms": baseline * 1000, "modules": modules,
+                       "max_modules": args.max_modules}, out, indent=2)
+    for warning in warnings:
+        print(f"WARNING: {warning}")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+"""Benchmark suite. Runs every CLI path on synthetic projects and records wall time and peak memory.
+
+Every step is a fresh process, like a user calling the tool. The peak memory is the maximum resident set size of that process.
+The results are written as JSON and can be compared with the results of another commit.
+"""
+
+import argparse
+import csv
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess  # nosec
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+# pylint: disable=wrong-import-position
+from generators import write_project, write_upgrade  # noqa: E402
+
+# Steps in the order they run, they build on each other. name: (config backend, arguments). {uid}, {batch}, {csv}, {findings} are filled in
+STEPS: List[Tuple[str, str, List[str]]] = [
+    ("load_cold", "toml", ["cache"]),
+    ("load_warm", "toml", ["cache"]),
+    ("show", "toml", ["show", "{uid}"]),
+    ("mark", "toml", ["mark", "{uid}", "checked", "--statement", "Benchmark", "--author", "bench"]),
+    ("mark_batch", "toml", ["mark-batch", "{batch}", "--author", "bench"]),
+    ("history", "toml", ["history"]),
+    ("compact", "toml", ["compact"]),
+    ("list", "toml", ["list"]),
+    ("stats", "toml", ["stats", "--depth", "item"]),
+    ("search_cold", "toml", ["search", "cwe:79,80,81", "state:unchecked", "text:session"]),
+    ("search_warm", "toml", ["search", "cwe:79,80,81", "state:unchecked", "text:session"]),
+    ("report", "toml", ["report", "--outfile", "report.html"]),
+    ("report_gzip", "toml", ["report", "--outfile", "report.html.gz"]),
+    ("export_toml", "toml", ["export", "--toml", "--toml_file", "export.toml"]),
+    ("export_csv", "toml", ["export", "--csv", "--csv_file", "{csv}"]),
+    ("export_jsonl", "toml", ["export", "--jsonl", "--jsonl_file", "export.jsonl"]),
+    ("import_csv", "toml", ["import", "{csv}", "--author", "bench"]),
+    ("ingest", "toml", ["ingest", "{findings}", "--source", "bench", "--author", "bench"]),
+    ("upgrade", "toml", ["upgrade", "config_upgrade.toml", "--mapping", "mapping.csv"]),
+    ("migrate", "sqlite", ["migrate"]),
+    ("sqlite_mark", "sqlite", ["mark", "{uid}", "unchecked", "--statement", "Benchmark", "--author", "bench"]),
+    ("sqlite_query", "sqlite", ["query", "--state", "checked"]),
+]
+
+STEP_NAMES = [step[0] for step in STEPS]
+
+# Steps that do not repeat. They change state that the next runs depend on
+SINGLE_RUN = {"load_cold", "search_cold", "migrate", "import_csv"}
+
+
+def git_revision() -> Optional[str]:
+    """Return the current git commit.
+
+    :returns: The commit hash or None outside of a git checkout
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True).stdout.strip()  # nosec
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_cli(project_dir: str, backend: str, arguments: List[str]) -> Tuple[float, int, int]:
+    """Run checkbox_empire.py in a new process.
+
+    :param project_dir: The project directory, used as working directory
+    :param backend: Selects the config file
+    :param arguments: The command and its arguments
+    :returns: Wall time in seconds, peak resident memory in bytes, return code
+    """
+    command = [sys.executable, os.path.join(ROOT_DIR, "checkbox_empire.py"), "--config", f"config_{backend}.toml", "--no_server"] + arguments
+    start = time.perf_counter()
+    with subprocess.Popen(command, cwd=project_dir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as process:  # nosec
+        # wait4 returns the resource usage of this single child, ru_maxrss is in KiB on Linux
+        _, status, usage = os.wait4(process.pid, 0)
+        duration = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        errors = process.stderr.read().decode("utf-8", "replace") if process.stderr else ""
+    if process.returncode:
+        print(f"  {' '.join(arguments)} failed with {process.returncode}: {errors.strip()[-500:]}")
+    return duration, usage.ru_maxrss * 1024, process.returncode
+
+
+def prepare_inputs(project_dir: str, controls: int) -> Dict[str, str]:
+    """Write the input files of mark-batch, import and ingest.
+
+    :param project_dir: The project directory
+    :param controls: Number of controls of the project
+    :returns: Values for the placeholders of the steps
+    """
+    # The uids of the catalogue in order, from a plain JSON lines export
+    run_cli(project_dir, "toml", ["export", "--jsonl", "--jsonl_file", "uids.jsonl"])
+    with open(os.path.join(project_dir, "uids.jsonl"), "rt", encoding="utf-8") as fh:
+        records = [json.loads(line) for line in fh]
+    uids = [record["uid"] for record in records]
+    # Every tenth control, states rotating
+    states = ("checked", "unchecked", "not_relevant")
+    with open(os.path.join(project_dir, "batch.jsonl"), "wt", encoding="utf-8") as fh:
+        for number, uid in enumerate(uids[::10]):
+            fh.write(json.dumps({"uid": uid, "state": states[number % len(states)], "statement": f"Batch {number}"}) + "\n")
+    # One finding per CWE of the catalogue, every third one fails
+    cwes = sorted({cwe for record in records for cwe in record.get("cwe") or []})
+    with open(os.path.join(project_dir, "findings.jsonl"), "wt", encoding="utf-8") as fh:
+        for number, cwe in enumerate(cwes):
+            fh.write(json.dumps({"rule": f"rule-{cwe}", "cwe": cwe, "status": "fail" if number % 3 == 0 else "pass"}) + "\n")
+    print(f"  {len(uids)} controls (requested {controls}), {len(uids[::10])} batch records, {len(cwes)} findings")
+    return {"uid": uids[len(uids) // 2], "batch": "batch.jsonl", "csv": "export.csv", "findings": "findings.jsonl"}
+
+
+def edit_csv(filename: str) -> None:
+    """Change the statement of every hundredth row of a CSV export, so import has something to apply.
+
+    :param filename: The CSV file
+    """
+    with open(filename, "rt", encoding="utf-8", newline="") as fh:
+        reader = csv.DictReader(fh)
+        fieldnames = reader.fieldnames or []
+        rows = list(reader)
+    for number, row in enumerate(rows[::100]):
+        row["statement"] = f"Imported {number}"
+    with open(filename, "wt", encoding="utf-8", newline="") as fh:
+        writer = csv.DictWriter(fh, fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def run_size(controls: int, steps: List[str], repeat: int, keep: Optional[str]) -> List[Dict[str, Any]]:
+    """Run the steps on a new project.
+
+    :param controls: Number of controls
+    :param steps: Names of the steps to run
+    :param repeat: Runs per step, the median is reported
+    :param keep: Directory to create the project in. Default: a temporary directory that is removed afterwards
+    :returns: One result per step
+    """
+    project_dir = keep or tempfile.mkdtemp(prefix="cbx_bench_")
+    results = []
+    try:
+        start = time.perf_counter()
+        write_project(project_dir, controls, "toml")
+        write_project(project_dir, controls, "sqlite")
+        write_upgrade(project_dir, "toml")
+        shutil.copytree(os.path.join(ROOT_DIR, "templates"), os.path.join(project_dir, "templates"), dirs_exist_ok=True)
+        print(f"{controls} controls: generated in {time.perf_counter() - start:.1f} s in {project_dir}")
+        values = prepare_inputs(project_dir, controls)
+        for name, backend, arguments in STEPS:
+            if name not in steps:
+                continue
+            if name == "load_cold":
+                run_cli(project_dir, backend, ["cache", "--clear"])
+            if name == "import_csv" and "export_csv" in steps:
+                edit_csv(os.path.join(project_dir, values["csv"]))
+            filled = [argument.format(**values) for argument in arguments]
+            runs = [run_cli(project_dir, backend, filled) for _ in range(1 if name in SINGLE_RUN else repeat)]
+            seconds = statistics.median(run[0] for run in runs)
+            peak = max(run[1] for run in runs)
+            results.append({"controls": controls, "step": name, "command": " ".join(arguments), "seconds": seconds,
+                            "runs": [run[0] for run in runs], "peak_rss_bytes": peak,
+                            "failed": any(run[2] for run in runs)})
+            print(f"  {name:14} {seconds:9.3f} s {peak / 1e6:9.1f} MB")
+    finally:
+        if not keep:
+            shutil.rmtree(project_dir, ignore_errors=True)
+    return results
+
+
+def compare(old_file: str, new: Dict[str, Any], threshold: float) -> int:
+    """Print the change against older results.
+
+    :param old_file: JSON results of an earlier run
+    :param new: The current results
+    :param threshold: Relative slowdown counted as regression, 0.2 is 20 %
+    :returns: Number of regressions
+    """
+    with open(old_file, "rt", encoding="utf-8") as fh:
+        old = json.load(fh)
+    old_results = {(entry["controls"], entry["step"]): entry for entry in old["results"]}
+    regressions = 0
+    print(f"Compared to {old.get('revision')} ({old_file})")
+    for entry in new["results"]:
+        before = old_results.get((entry["controls"], entry["step"]))
+        if before is None:
+            continue
+        time_change = entry["seconds"] / before["seconds"] - 1 if before["seconds"] else 0.0
+        memory_change = entry["peak_rss_bytes"] / before["peak_rss_bytes"] - 1 if before["peak_rss_bytes"] else 0.0
+        regression = time_change > threshold or memory_change > threshold
+        regressions += regression
+        print(f"  {entry['controls']:7} {entry['step']:14} time {time_change:+7.1%} memory {memory_change:+7.1%}{'  REGRESSION' if regression else ''}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run all CLI paths on synthetic catalogues and record wall time and peak memory')
+    parser.add_argument('--sizes', type=int, nargs="+", default=[1000, 10000], help='Numbers of controls. 100000 takes several minutes')
+    parser.add_argument('--steps', nargs="+", choices=STEP_NAMES, default=STEP_NAMES, help='Steps to run. Later steps use the results of earlier ones')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per step, the median time is reported')
+    parser.add_argument('--output', default=None, help='JSON file to write the results to. Default: benchmarks/results/<commit>.json')
+    parser.add_argument('--compare', default=None, help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Relative slowdown or memory growth counted as regression')
+    parser.add_argument('--keep', default=None, help='Create the projects in this directory and keep them')
+    args = parser.parse_args()
+
+    revision = git_revision()
+    report: Dict[str, Any] = {"revision": revision, "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                              "platform": platform.platform(), "cpus": os.cpu_count(), "repeat": args.repeat, "results": []}
+    for size in args.sizes:
+        report["results"] += run_size(size, args.steps, args.repeat, os.path.join(args.keep, str(size)) if args.keep else None)
+
+    output = args.output or os.path.join(BENCH_DIR, "results", f"{(revision or 'unknown')[:12]}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "wt", encoding="utf-8") as out:
+        json.dump(report, out, indent=2)
+    print(f"Results written to {output}")
+    failed = [entry["step"] for entry in report["results"] if entry["failed"]]
+    if failed:
+        print(f"Failed steps: {', '.join(failed)}")
+    if args.compare:
+        sys.exit(1 if compare(args.compare, report, args.threshold) or failed else 0)
+    sys.exit(1 if failed else 0)
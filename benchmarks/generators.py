@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+"""Synthetic catalogues for benchmarks. Writes data files in the formats of the supported loaders and a project config using them."""
+
+import hashlib
+import json
+import os
+import random
+from typing import Dict, List
+
+import yaml
+
+# Words for the descriptions, so text search and statements have realistic vocabulary
+WORDS = ("verify", "that", "the", "application", "session", "token", "password", "input", "output", "encoding", "access", "control",
+         "authentication", "cryptographic", "key", "secret", "log", "error", "file", "upload", "api", "request", "response", "header",
+         "cookie", "database", "query", "parameter", "user", "admin", "data", "sensitive", "storage", "transport", "tls", "certificate")
+
+# Share of the controls per catalogue
+SHARES = {"asvs": 0.4, "isvs": 0.2, "masvs": 0.2, "wstg": 0.2}
+
+
+def sentence(rng: random.Random, words: int = 12) -> str:
+    """Return a random sentence.
+
+    :param rng: The random generator
+    :param words: Number of words
+    :returns: The sentence
+    """
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def write_asvs_json(filename: str, controls: int, seed: int = 1) -> None:
+    """Write an ASVS style json file: groups with items with controls referencing CWEs and NIST.
+
+    :param filename: The file to write
+    :param controls: Number of controls
+    :param seed: Seed of the random generator
+    """
+    rng = random.Random(seed)
+    data: Dict[str, object] = {"Name": "Application Security Verification Standard", "ShortName": "ASVS", "Version": "4.0.3",
+                               "Description": "Synthetic ASVS"}
+    groups: List[Dict[str, object]] = []
+    per_item, per_group = 10, 100
+    for group_ordinal in range(1, max(1, controls // per_group) + 1):
+        items = []
+        for item_ordinal in range(1, per_group // per_item + 1):
+            items.append({"Shortcode": f"V{group_ordinal}.{item_ordinal}", "Ordinal": item_ordinal, "Name": sentence(rng, 4),
+                          "Items": [{"Shortcode": f"V{group_ordinal}.{item_ordinal}.{ordinal}", "Ordinal": ordinal,
+                                     "Description": sentence(rng),
+                                     "CWE": [rng.randint(1, 1000)] if rng.random() < 0.7 else [],
+                                     "NIST": [f"{rng.randint(1, 9)}.{rng.randint(1, 9)}"] if rng.random() < 0.3 else []}
+                                    for ordinal in range(1, per_item + 1)]})
+        groups.append({"Shortcode": f"V{group_ordinal}", "Ordinal": group_ordinal, "ShortName": f"G{group_ordinal}",
+                       "Name": sentence(rng, 3), "Items": items})
+    data["Requirements"] = groups
+    with open(filename, "wt", encoding="utf-8") as fh:
+        json.dump(data, fh)
+
+
+def write_isvs_json(filename: str, controls: int, seed: int = 2) -> None:
+    """Write an ISVS style json file: a flat list of controls.
+
+    :param filename: The file to write
+    :param controls: Number of controls
+    :param seed: Seed of the random generator
+    """
+    rng = random.Random(seed)
+    with open(filename, "wt", encoding="utf-8") as fh:
+        json.dump([{"ID": f"ISVS-{number}", "Description": sentence(rng)} for number in range(controls)], fh)
+
+
+def write_masvs_yaml(filename: str, controls: int, seed: int = 3) -> None:
+    """Write a MASVS style yaml file: groups with controls and statements.
+
+    :param filename: The file to write
+    :param controls: Number of controls
+    :param seed: Seed of the random generator
+    """
+    rng = random.Random(seed)
+    per_group = 50
+    data = {"metadata": {"title": "Mobile Application Security Verification Standard", "remarks": "MASVS", "version": "2.0.0"},
+            "groups": [{"id": f"MASVS-G{group}", "index": group, "title": f"MASVS-G{group}", "description": sentence(rng, 6),
+                        "controls": [{"id": f"MASVS-G{group}-{number}", "description": sentence(rng), "statement": sentence(rng, 5)}
+                                     for number in range(per_group)]}
+                       for group in range(max(1, controls // per_group))]}
+    with open(filename, "wt", encoding="utf-8") as fh:
+        yaml.safe_dump(data, fh)
+
+
+def write_wstg_json(filename: str, controls: int, seed: int = 4) -> None:
+    """Write a WSTG style json file: categories with tests with objectives. Every objective is a control.
+
+    :param filename: The file to write
+    :param controls: Number of controls
+    :param seed: Seed of the random generator
+    """
+    rng = random.Random(seed)
+    per_test, per_category = 5, 50
+    data = {"categories": {f"Category {category}": {"id": f"WSTG-C{category}",
+                                                    "tests": [{"id": f"WSTG-C{category}-{test}", "name": sentence(rng, 4),
+                                                               "objectives": [f"{number} {sentence(rng)}" for number in range(per_test)]}
+                                                              for test in range(per_category // per_test)]}
+                           for category in range(max(1, controls // per_category))}}
+    with open(filename, "wt", encoding="utf-8") as fh:
+        json.dump(data, fh)
+
+
+def write_project(directory: str, controls: int, state_backend: str = "toml") -> str:
+    """Write the four catalogues and a config using them. The controls are split between the catalogues, see SHARES.
+
+    :param directory: The project directory
+    :param controls: Total number of controls
+    :param state_backend: toml or sqlite
+    :returns: The name of the config file
+    """
+    data_dir = os.path.join(directory, "data")
+    os.makedirs(data_dir, exist_ok=True)
+    write_asvs_json(os.path.join(data_dir, "asvs.json"), int(controls * SHARES["asvs"]))
+    write_isvs_json(os.path.join(data_dir, "isvs.json"), int(controls * SHARES["isvs"]))
+    write_masvs_yaml(os.path.join(data_dir, "masvs.yaml"), int(controls * SHARES["masvs"]))
+    write_wstg_json(os.path.join(data_dir, "wstg.json"), int(controls * SHARES["wstg"]))
+    config_file = os.path.join(directory, f"config_{state_backend}.toml")
+    with open(config_file, "wt", encoding="utf-8") as fh:
+        fh.write(f'''project = "Benchmark"
+database_file_toml = "database.toml"
+state_backend = "{state_backend}"
+database_file_sqlite = "database.sqlite"
+cache_dir = ".cbx_cache"
+
+[sections.asvs]
+name = "OWASP ASVS"
+prefix = "OWASP_ASVS"
+description = "Synthetic ASVS"
+data_file = "data/asvs.json"
+file_type = "OWASP_ASVS_JSON"
+
+[sections.isvs]
+name = "OWASP ISVS"
+prefix = "OWASP_ISVS"
+description = "Synthetic ISVS"
+data_file = "data/isvs.json"
+file_type = "OWASP_ISVS_JSON"
+
+[sections.masvs]
+name = "OWASP MASVS"
+prefix = "OWASP_MASVS"
+description = "Synthetic MASVS"
+data_file = "data/masvs.yaml"
+file_type = "OWASP_MASVS_YAML"
+
+[sections.wstg]
+name = "OWASP WSTG"
+prefix = "OWASP_WSTG"
+description = "Synthetic WSTG"
+data_file = "data/wstg.json"
+file_type = "OWASP_WSTG_JSON"
+
+[tag_rules.iot]
+patterns = ['^OWASP_ISVS.*']
+
+[tag_rules.rest]
+patterns = ['OWASP_ASVS-V1[0-9].2.*']
+
+[project_tags]
+iot = false
+rest = false
+''')
+    return config_file
+
+
+def reword(rng: random.Random, text: str, changes: int = 2) -> str:
+    """Replace some words of a sentence, like an edited control of a new catalogue version.
+
+    :param rng: The random generator
+    :param text: The sentence
+    :param changes: Number of words to replace
+    :returns: The new sentence
+    """
+    words = text.split()
+    for _ in range(changes):
+        words[rng.randrange(len(words))] = rng.choice(WORDS)
+    return " ".join(words)
+
+
+def write_upgrade(directory: str, state_backend: str = "toml", seed: int = 5) -> Dict[str, str]:
+    """Write a new version of the ASVS and WSTG catalogues of a project and a config using it, for the upgrade command.
+
+    ASVS: 5 % of the controls are removed, 5 % swap their descriptions (moved), 20 % are reworded and 5 % are added.
+    WSTG: 5 % of the objectives are removed and 20 % are reworded, which changes their UIDs.
+    The config uses database_upgrade.toml and database_upgrade.sqlite, the states of the project are not touched.
+
+    :param directory: The project directory, see write_project
+    :param state_backend: toml or sqlite
+    :param seed: Seed of the random generator
+    :returns: The expected new UID of every old ASVS and WSTG control that is not removed
+    """
+    rng = random.Random(seed)
+    data_dir = os.path.join(directory, "data")
+    expected: Dict[str, str] = {}
+    with open(os.path.join(data_dir, "asvs.json"), "rt", encoding="utf-8") as fh:
+        asvs = json.load(fh)
+    controls = [(item, control) for group in asvs["Requirements"] for item in group["Items"] for control in item["Items"]]
+    removed = set(rng.sample(range(len(controls)), len(controls) // 20))
+    for position, (item, control) in enumerate(controls):
+        if position in removed:
+            item["Items"].remove(control)
+        else:
+            expected[f"OWASP_ASVS-{control['Shortcode']}"] = f"OWASP_ASVS-{control['Shortcode']}"
+    kept = [control for position, (_, control) in enumerate(controls) if position not in removed]
+    moved = rng.sample(kept, len(kept) // 20 * 2)
+    for first, second in zip(moved[::2], moved[1::2]):
+        first["Description"], second["Description"] = second["Description"], first["Description"]
+        expected[f"OWASP_ASVS-{first['Shortcode']}"] = f"OWASP_ASVS-{second['Shortcode']}"
+        expected[f"OWASP_ASVS-{second['Shortcode']}"] = f"OWASP_ASVS-{first['Shortcode']}"
+    for control in rng.sample([control for control in kept if control not in moved], len(kept) // 5):
+        control["Description"] = reword(rng, control["Description"])
+    items = [item for group in asvs["Requirements"] for item in group["Items"]]
+    for number in range(len(controls) // 20):
+        item = rng.choice(items)
+        item["Items"].append({"Shortcode": f"{item['Shortcode']}.{100 + number}", "Ordinal": 100 + number, "Description": sentence(rng),
+                              "CWE": [], "NIST": []})
+    with open(os.path.join(data_dir, "asvs_v2.json"), "wt", encoding="utf-8") as fh:
+        json.dump(asvs, fh)
+
+    with open(os.path.join(data_dir, "wstg.json"), "rt", encoding="utf-8") as fh:
+        wstg = json.load(fh)
+    for category in wstg["categories"].values():
+        for test in category["tests"]:
+            objectives = []
+            for objective in test["objectives"]:
+                dice = rng.random()
+                if dice < 0.05:
+                    continue
+                new_objective = reword(rng, objective) if dice < 0.25 else objective
+                objectives.append(new_objective)
+                # WSTG UIDs are the MD5 of the objective. Not used for security
+                old_uid = "OWASP_WSTG-" + hashlib.md5(objective.encode("utf-8")).hexdigest()  # nosec
+                expected[old_uid] = "OWASP_WSTG-" + hashlib.md5(new_objective.encode("utf-8")).hexdigest()  # nosec
+            test["objectives"] = objectives
+    with open(os.path.join(data_dir, "wstg_v2.json"), "wt", encoding="utf-8") as fh:
+        json.dump(wstg, fh)
+
+    with open(os.path.join(directory, f"config_{state_backend}.toml"), "rt", encoding="utf-8") as fh:
+        config = fh.read()
+    for old, new in (("data/asvs.json", "data/asvs_v2.json"), ("data/wstg.json", "data/wstg_v2.json"),
+                     ('"database.toml"', '"database_upgrade.toml"'), ('"database.sqlite"', '"database_upgrade.sqlite"')):
+        config = config.replace(old, new)
+    with open(os.path.join(directory, "config_upgrade.toml"), "wt", encoding="utf-8") as fh:
+        fh.write(config)
+    return expected
@@ -3,7 +3,43 @@
 """A tool to generate checkbox documents and collect data to also check some boxes."""
 
 import argparse
-from app.cbx_empire import CbxEmpire
+import os
+import sys
+from typing import Callable, List, Optional
+from app.cbx_batch import LIST_FORMATS, CbxMarkResult, RecordError, guess_format, read_mark_records
+from app.cbx_cache import clear_cache
+from app.cbx_client import DEFAULT_TOKEN_FILE, CbxApiError, CbxClient, get_token_file, parse_address, read_token
+from app.cbx_control import CbxControlFilter
+from app.cbx_empire import CbxEmpire, read_config
+from app.cbx_output import CbxOutput
+from app.cbx_profile import PROFILER
+from app.cbx_section import CbxLoadError
+
+
+def get_client(largs: argparse.Namespace) -> Optional[CbxClient]:
+    """Return a client for the serve daemon if it is configured and running.
+
+    Only reads the server settings of the config. Loading the project later reuses the parsed config, see read_config.
+    A daemon serving another config file is not used.
+
+    :param largs: Argparse parsed arguments
+    :returns: A client or None if the command has to load the data itself
+    """
+    if largs.no_server:
+        return None
+    data = read_config(largs.config)
+    if "server" not in data:
+        return None
+    config_file = os.path.abspath(largs.config)
+    token = read_token(get_token_file(config_file, str(data.get("server_token_file", DEFAULT_TOKEN_FILE))))
+    if token is None:
+        return None
+    client = CbxClient(str(data["server"]), token)
+    answer = client.ping()
+    # A daemon serving another project on the same address must not get the commands of this one
+    if answer is None or answer.get("config") != config_file:
+        return None
+    return client
 
 
 def export(largs: argparse.Namespace) -> None:
@@ -11,11 +47,40 @@ def export(largs: argparse.Namespace) -> None:
 
     :param largs: Argparse parsed arguments
     """
+    if largs.all_projects:
+        from app.cbx_portfolio import CbxPortfolio  # pylint: disable=import-outside-toplevel
+        portfolio = CbxPortfolio()
+        portfolio.load_config(largs.config)
+        for project in portfolio.iter_projects():
+            export_project(project, largs, lambda filename, project=project: portfolio.get_project_file(filename, project))  # type: ignore
+        return
+    client = get_client(largs)
+    if client is not None:
+        client.request("POST", "/export", {f"{name}_file": os.path.abspath(getattr(largs, f"{name}_file"))
+                                           for name in ("toml", "csv", "jsonl", "msgpack") if getattr(largs, name)})
+        return
     cbe = CbxEmpire()
     cbe.load_config(largs.config)
     # cbe.pretty_print()
+    export_project(cbe, largs, lambda filename: filename)
+
+
+def export_project(cbe: CbxEmpire, largs: argparse.Namespace, get_filename: Callable[[str], str]) -> None:
+    """Export the data of a loaded project.
+
+    :param cbe: The project
+    :param largs: Argparse parsed arguments
+    :param get_filename: Returns the file name to write for a file name of the arguments
+    """
+    output = CbxOutput(cbe)
     if largs.toml:
-        cbe.export_to_toml(largs.toml_file)
+        output.export_to_toml(get_filename(largs.toml_file))
+    if largs.csv:
+        output.export_to_csv(get_filename(largs.csv_file))
+    if largs.jsonl:
+        output.export_to_jsonl(get_filename(largs.jsonl_file))
+    if largs.msgpack:
+        output.export_to_msgpack(get_filename(largs.msgpack_file))
 
 
 def show(largs: argparse.Namespace) -> None:
@@ -23,8 +88,16 @@ def show(largs: argparse.Namespace) -> None:
 
     :param largs: Argparse parsed arguments
     """
+    client = get_client(largs)
+    if client is not None:
+        try:
+            print(client.request("GET", f"/controls/{largs.uid}")["text"])
+        except CbxApiError as error:
+            if error.status != 404:
+                raise
+        return
     cbe = CbxEmpire()
-    cbe.load_config(largs.config)
+    cbe.load_config(largs.config, lazy=True)
     # cbe.pretty_print()
 
     cbx_control = cbe.find_control_by_uid(largs.uid)
@@ -35,32 +108,293 @@ def show(largs: argparse.Namespace) -> None:
 def list_controls(largs: argparse.Namespace) -> None:
     """List controls.
 
+    :param largs: Argparse parsed arguments
+    """
+    try:
+        control_filter = CbxControlFilter(largs.state, largs.section, largs.group, largs.cwe, largs.nist)
+    except ValueError as e:
+        print(e)
+        return
+    client = get_client(largs)
+    if client is not None:
+        sys.stdout.write(client.request("GET", "/list", {"filter": control_filter.to_dict(), "format": largs.format})["output"])
+        return
+    cbe = CbxEmpire()
+    # Lazy: a section filter only loads that section
+    cbe.load_config(largs.config, lazy=True)
+
+    CbxOutput(cbe).print_control_list(largs.format, control_filter)
+
+
+def search(largs: argparse.Namespace) -> None:
+    """Search controls.
+
     :param largs: Argparse parsed arguments
     """
     cbe = CbxEmpire()
     cbe.load_config(largs.config)
+    CbxOutput(cbe).print_search(" ".join(largs.query))
+
 
-    cbe.print_control_list()
+def stats(largs: argparse.Namespace) -> None:
+    """Show compliance statistics.
+
+    :param largs: Argparse parsed arguments
+    """
+    if largs.all_projects:
+        from app.cbx_portfolio import CbxPortfolio  # pylint: disable=import-outside-toplevel
+        portfolio = CbxPortfolio()
+        portfolio.load_config(largs.config)
+        portfolio.print_stats()
+        return
+    cbe = CbxEmpire()
+    cbe.load_config(largs.config)
+    CbxOutput(cbe).print_stats(largs.depth)
 
 
 def mark_control(largs: argparse.Namespace) -> None:
     """Mark a  control.
 
+    :param largs: Argparse parsed arguments
+    """
+    client = get_client(largs)
+    if client is not None:
+        result = CbxMarkResult.from_dict(client.mark([(largs.uid, largs.state, largs.statement)], largs.author))
+        for uid in result.unknown_uids:
+            print(f"Unknown UID {uid}")
+        for _, state, _ in result.invalid_states:
+            print(f"Invalid state {state}")
+        return
+    cbe = CbxEmpire()
+    cbe.load_config(largs.config, lazy=True)
+    if largs.author:
+        cbe.author = largs.author
+    if cbe.mark_control(largs.uid, largs.state, largs.statement):
+        cbe.database.save()
+
+
+def mark_batch(largs: argparse.Namespace) -> None:
+    """Mark many controls from a CSV or JSON lines file and save the database once.
+
+    :param largs: Argparse parsed arguments
+    """
+    file_format = largs.format or guess_format(largs.file)
+    errors: List[RecordError] = []
+    client = get_client(largs)
+    if client is not None:
+        if largs.file == "-":
+            records = list(read_mark_records(sys.stdin, file_format, errors))
+        else:
+            with open(largs.file, "rt", encoding="utf-8", newline="") as fh:
+                records = list(read_mark_records(fh, file_format, errors))
+        result = CbxMarkResult.from_dict(client.mark(records, largs.author))
+        result.errors.extend(errors)
+        result.print_summary()
+        return
+    cbe = CbxEmpire()
+    cbe.load_config(largs.config, lazy=True)
+    if largs.author:
+        cbe.author = largs.author
+    if largs.file == "-":
+        result = cbe.mark_controls(read_mark_records(sys.stdin, file_format, errors))
+    else:
+        with open(largs.file, "rt", encoding="utf-8", newline="") as fh:
+            result = cbe.mark_controls(read_mark_records(fh, file_format, errors))
+
+    if result.applied:
+        cbe.database.save()
+    result.errors.extend(errors)
+    result.print_summary()
+
+
+def ingest(largs: argparse.Namespace) -> None:
+    """Map the results of a security tool onto control states and save the database once.
+
+    :param largs: Argparse parsed arguments
+    """
+    from app.cbx_ingest import guess_findings_format, read_findings  # pylint: disable=import-outside-toplevel
+    cbe = CbxEmpire()
+    cbe.load_config(largs.config)
+    if largs.author:
+        cbe.author = largs.author
+    file_format = largs.format or guess_findings_format(largs.file)
+    source = largs.source or os.path.basename(largs.file)
+    with open(largs.file, "rt", encoding="utf-8") as fh:
+        result, marks = cbe.ingest_findings(read_findings(fh, file_format), source)
+
+    result.print_summary()
+    if largs.dry_run:
+        for uid in cbe.changed_uids:
+            print(f"Would mark {uid}")
+        return
+    if marks.applied:
+        cbe.database.save()
+    print(f"Changed controls: {marks.applied}")
+
+
+def import_records(largs: argparse.Namespace) -> None:
+    """Read back an edited CSV export and apply only the changed rows. Saves the database once.
+
+    :param largs: Argparse parsed arguments
+    """
+    file_format = largs.format or guess_format(largs.file, default="csv")
+    errors: List[RecordError] = []
+    client = get_client(largs)
+    if client is not None:
+        if largs.file == "-":
+            records = list(read_mark_records(sys.stdin, file_format, errors))
+        else:
+            with open(largs.file, "rt", encoding="utf-8", newline="") as fh:
+                records = list(read_mark_records(fh, file_format, errors))
+        result = CbxMarkResult.from_dict(client.merge(records, largs.author, largs.dry_run))
+    else:
+        cbe = CbxEmpire()
+        cbe.load_config(largs.config)
+        if largs.author:
+            cbe.author = largs.author
+        if largs.file == "-":
+            result = cbe.merge_controls(read_mark_records(sys.stdin, file_format, errors), largs.dry_run)
+        else:
+            with open(largs.file, "rt", encoding="utf-8", newline="") as fh:
+                result = cbe.merge_controls(read_mark_records(fh, file_format, errors), largs.dry_run)
+        if result.applied:
+            cbe.database.save()
+
+    result.errors.extend(errors)
+    result.print_summary()
+    print(f"Changes{' (dry run)' if largs.dry_run else ''}: {len(result.changes)}")
+    result.print_diff()
+
+
+def compact(largs: argparse.Namespace) -> None:
+    """Compact the state journal into the database.
+
+    :param largs: Argparse parsed arguments
+    """
+    cbe = CbxEmpire()
+    cbe.load_config(largs.config)
+    cbe.database.compact()
+
+
+def query(largs: argparse.Namespace) -> None:
+    """Query controls on the SQLite state backend.
+
+    :param largs: Argparse parsed arguments
+    """
+    cbe = CbxEmpire()
+    # The states come from the database. Sections are only loaded if their controls are not stored yet, see sync_query_tables
+    cbe.load_config(largs.config, lazy=True, load_states=False)
+    CbxOutput(cbe).print_query(largs.state, largs.section, largs.group, largs.cwe, largs.nist)
+
+
+def migrate(largs: argparse.Namespace) -> None:
+    """Import the toml database into the SQLite state backend.
+
     :param largs: Argparse parsed arguments
     """
     cbe = CbxEmpire()
     cbe.load_config(largs.config)
-    cbe.mark_control(largs.uid, largs.state, largs.statement)
+    imported = cbe.database.migrate_toml_to_sqlite()
+    print(f"Imported {imported} control states")
+
 
-    cbe.save_toml_database()
+def upgrade(largs: argparse.Namespace) -> None:
+    """Carry the stored states over to a new version of the catalogues and write a mapping report.
+
+    :param largs: Argparse parsed arguments
+    """
+    from app.cbx_upgrade import CbxUpgrade  # pylint: disable=import-outside-toplevel
+    try:
+        upgrade_map = CbxUpgrade(largs.min_similarity)
+    except ValueError as e:
+        print(e)
+        return
+    old = CbxEmpire()
+    old.load_catalogue(largs.config)
+    states = old.database.get_stored_states()
+    # The stored states are keyed by the old UIDs, the new project gets only the carried over ones
+    new = CbxEmpire()
+    new.load_config(largs.new_config, load_states=False)
+    if largs.author:
+        new.author = largs.author
+    upgrade_map.match_sections(old.sections, new.sections)
+    with open(largs.mapping, "wt", encoding="utf-8", newline="") as fh:
+        upgrade_map.write_mapping(fh, states)
+    upgrade_map.print_summary(states)
+    print(f"Mapping written to {largs.mapping}")
+    result = new.mark_controls(upgrade_map.get_records(states))
+    result.print_summary()
+    if largs.dry_run:
+        print(f"Would carry over {result.applied} of {len(states)} stored states")
+        return
+    new.database.save()
+    new.database.compact()
+    print(f"Carried over {result.applied} of {len(states)} stored states to {new.database.database_file_toml if new.database.sqlite is None else new.database.sqlite.filename}")
+
+
+def history(largs: argparse.Namespace) -> None:
+    """Show the state changes from the journal.
+
+    :param largs: Argparse parsed arguments
+    """
+    cbe = CbxEmpire()
+    cbe.load_config(largs.config, lazy=True)
+    CbxOutput(cbe).print_history(largs.uid)
 
 
 def generate_report(largs: argparse.Namespace) -> None:
     """Generate a report."""
+    if largs.all_projects:
+        from app.cbx_portfolio import CbxPortfolio  # pylint: disable=import-outside-toplevel
+        portfolio = CbxPortfolio()
+        portfolio.load_config(largs.config)
+        if largs.report_type == "html":
+            summaries = portfolio.generate_html_reports(largs.template, largs.outdir, largs.index_template, largs.gzip, largs.workers)
+            for summary in summaries:
+                print(f"{summary['project']}\t{summary['percent']:.1f} %\t{summary['report']}")
+            print(f"Index: {os.path.join(largs.outdir, 'index.html')}")
+        return
+    client = get_client(largs)
+    if client is not None:
+        if largs.report_type == "html":
+            client.request("POST", "/report", {"template": os.path.abspath(largs.template), "outfile": os.path.abspath(largs.outfile), "gzip": largs.gzip})
+        return
     cbe = CbxEmpire()
     cbe.load_config(largs.config)
     if largs.report_type == "html":
-        cbe.generate_html_report(largs.template, largs.outfile)
+        CbxOutput(cbe).generate_html_report(largs.template, largs.outfile, largs.gzip)
+
+
+def cache(largs: argparse.Namespace) -> None:
+    """Show load times of the sections or clear the catalogue cache.
+
+    :param largs: Argparse parsed arguments
+    """
+    cbe = CbxEmpire()
+    cbe.load_config(largs.config)
+    if largs.clear:
+        removed = clear_cache(cbe.cache_dir)
+        print(f"Removed {removed} cache files")
+    else:
+        CbxOutput(cbe).print_load_stats()
+
+
+def serve(largs: argparse.Namespace) -> None:
+    """Keep the data loaded and serve it to the other commands.
+
+    :param largs: Argparse parsed arguments
+    """
+    from app.cbx_server import CbxServer  # pylint: disable=import-outside-toplevel
+    cbe = CbxEmpire()
+    cbe.load_config(largs.config, load_sections=False)
+    host, port = parse_address(cbe.server or "127.0.0.1:8737")
+    try:
+        server = CbxServer(largs.config, largs.host or host, largs.port or port, largs.save_interval, largs.watch_interval,
+                           token_file=cbe.server_token_file)
+    except ValueError as e:
+        print(e)
+        return
+    server.run()
 
 
 def create_parser() -> argparse.ArgumentParser:
@@ -72,13 +406,25 @@ def create_parser() -> argparse.ArgumentParser:
     """
     lparser = argparse.ArgumentParser(description='Manage compliance documents')
     lparser.add_argument('--config', type=str, default="config.toml", help='The main configuration file')
+    lparser.add_argument('--no_server', action="store_true", default=False, help='Load the data even if the serve daemon is running')
+    lparser.add_argument('--profile', action="store_true", default=False, help='Print timings of the phases, counters and peak memory to stderr')
+    lparser.add_argument('--profile_format', choices=["text", "json"], default="text", help='With --profile: format of the profile')
+    lparser.add_argument('--profile_memory', action="store_true", default=False, help='With --profile: measure the peak memory of every phase with tracemalloc. Slows down the run')
+    lparser.add_argument('--profile_cprofile', default=None, help='With --profile: write cProfile statistics to this file. Read them with python -m pstats')
     subparsers = lparser.add_subparsers(help='sub-commands')
 
     # create the parser for the "export" command
     parser_export = subparsers.add_parser('export', help='Export generated data')
     parser_export.set_defaults(func=export)
+    parser_export.add_argument('--all_projects', action="store_true", default=False, help='Export every project listed in projects of the config. The project name is added to the file names')
     parser_export.add_argument('--toml', action="store_true", default=False, help='Export to toml')
     parser_export.add_argument('--toml_file', default="testfile.toml", help='File name of the toml file to write')
+    parser_export.add_argument('--csv', action="store_true", default=False, help='Export to CSV, one row per control')
+    parser_export.add_argument('--csv_file', default="controls.csv", help='File name of the CSV file to write')
+    parser_export.add_argument('--jsonl', action="store_true", default=False, help='Export to JSON lines, one control per line')
+    parser_export.add_argument('--jsonl_file', default="controls.jsonl", help='File name of the JSON lines file to write')
+    parser_export.add_argument('--msgpack', action="store_true", default=False, help='Export to MessagePack, one map per control. Requires msgpack')
+    parser_export.add_argument('--msgpack_file', default="controls.msgpack", help='File name of the MessagePack file to write')
 
     # create the parser for the "show" command
     parser_show = subparsers.add_parser('show', help='Show control details')
@@ -88,6 +434,23 @@ def create_parser() -> argparse.ArgumentParser:
     # create the parser for the "list" command
     parser_list = subparsers.add_parser('list', help='List controls')
     parser_list.set_defaults(func=list_controls)
+    parser_list.add_argument('--state', default=None, help='Only controls with this state')
+    parser_list.add_argument('--section', default=None, help='Only controls of the section with this prefix')
+    parser_list.add_argument('--group', default=None, help='Only controls of the group with this shortcode')
+    parser_list.add_argument('--cwe', type=int, default=None, help='Only controls referencing this CWE')
+    parser_list.add_argument('--nist', default=None, help='Only controls referencing this NIST entry')
+    parser_list.add_argument('--format', default="text", choices=LIST_FORMATS, help='text: one line per control, tsv and csv: the columns of the CSV export, jsonl: the records of the JSON lines export')
+
+    # create the parser for the "search" command
+    parser_search = subparsers.add_parser('search', help='Search controls, for example: search cwe:79 state:unchecked text:session')
+    parser_search.set_defaults(func=search)
+    parser_search.add_argument('query', nargs="+", help='Terms that all have to match. Fields: text, cwe, nist, state, section, group, uid. Words without field search description and statement, word* matches the start of words, a,b matches any of the values')
+
+    # create the parser for the "stats" command
+    parser_stats = subparsers.add_parser('stats', help='Show number of controls per state and percent done')
+    parser_stats.set_defaults(func=stats)
+    parser_stats.add_argument('--depth', choices=["section", "group", "item"], default="group", help='Show statistics down to this level')
+    parser_stats.add_argument('--all_projects', action="store_true", default=False, help='Show the statistics of every project listed in projects of the config, per section')
 
     # create the parser for the "mark" command
     parser_mark = subparsers.add_parser('mark', help='Mark a control with a state and a comment')
@@ -95,6 +458,62 @@ def create_parser() -> argparse.ArgumentParser:
     parser_mark.add_argument('uid', default=None, help='UID of the element to mark')
     parser_mark.add_argument('state', default=None, help='State to write')
     parser_mark.add_argument('--statement', default="", help='Comment why this state is set')
+    parser_mark.add_argument('--author', default=None, help='Author of the change written to the journal. Default: login name')
+
+    # create the parser for the "mark-batch" command
+    parser_mark_batch = subparsers.add_parser('mark-batch', help='Mark many controls from a CSV or JSON lines file. Saves the database once')
+    parser_mark_batch.set_defaults(func=mark_batch)
+    parser_mark_batch.add_argument('file', nargs="?", default="-", help='File with uid, state and statement records. - reads from stdin')
+    parser_mark_batch.add_argument('--format', choices=["csv", "jsonl"], default=None, help='Record format. Default: guessed from the file extension, jsonl for stdin')
+    parser_mark_batch.add_argument('--author', default=None, help='Author of the changes written to the journal. Default: login name')
+
+    # create the parser for the "import" command
+    parser_import = subparsers.add_parser('import', help='Read back an edited CSV export. Only rows with changed state or statement are applied')
+    parser_import.set_defaults(func=import_records)
+    parser_import.add_argument('file', nargs="?", default="-", help='File with uid, state and statement columns. - reads from stdin')
+    parser_import.add_argument('--format', choices=["csv", "jsonl"], default=None, help='Record format. Default: guessed from the file extension, csv for stdin')
+    parser_import.add_argument('--author', default=None, help='Author of the changes written to the journal. Default: login name')
+    parser_import.add_argument('--dry_run', action="store_true", default=False, help='Only show the changes')
+
+    # create the parser for the "ingest" command
+    parser_ingest = subparsers.add_parser('ingest', help='Mark controls from the results of security tools (SARIF, JUnit XML, JSON lines). Saves the database once')
+    parser_ingest.set_defaults(func=ingest)
+    parser_ingest.add_argument('file', help='The result file of the tool')
+    parser_ingest.add_argument('--format', choices=["sarif", "junit", "jsonl"], default=None, help='Result format. Default: guessed from the file extension')
+    parser_ingest.add_argument('--source', default=None, help='Tool name used in the statements. Default: the file name')
+    parser_ingest.add_argument('--author', default=None, help='Author of the changes written to the journal. Default: login name')
+    parser_ingest.add_argument('--dry_run', action="store_true", default=False, help='Only show which controls would change')
+
+    # create the parser for the "compact" command
+    parser_compact = subparsers.add_parser('compact', help='Write all states to the database and mark the journal as included')
+    parser_compact.set_defaults(func=compact)
+
+    # create the parser for the "query" command
+    parser_query = subparsers.add_parser('query', help='Query controls on the sqlite state backend')
+    parser_query.set_defaults(func=query)
+    parser_query.add_argument('--state', default=None, help='Only controls with this state')
+    parser_query.add_argument('--section', default=None, help='Only controls of the section with this prefix')
+    parser_query.add_argument('--group', default=None, help='Only controls of the group with this shortcode')
+    parser_query.add_argument('--cwe', type=int, default=None, help='Only controls referencing this CWE')
+    parser_query.add_argument('--nist', default=None, help='Only controls referencing this NIST entry')
+
+    # create the parser for the "migrate" command
+    parser_migrate = subparsers.add_parser('migrate', help='Import database_file_toml and its journal into the sqlite state backend')
+    parser_migrate.set_defaults(func=migrate)
+
+    # create the parser for the "upgrade" command
+    parser_upgrade = subparsers.add_parser('upgrade', help='Carry the stored states over to a new version of the catalogues. Matches controls by UID, description and similarity')
+    parser_upgrade.set_defaults(func=upgrade)
+    parser_upgrade.add_argument('new_config', help='Config with the data files of the new version. Its state database gets the carried over states')
+    parser_upgrade.add_argument('--mapping', default="upgrade_mapping.csv", help='CSV file for the mapping of old to new controls')
+    parser_upgrade.add_argument('--min_similarity', type=float, default=0.5, help='Minimal share of common words for matching reworded controls, 0 to 1')
+    parser_upgrade.add_argument('--author', default=None, help='Author of the carried over states. Default: the current user')
+    parser_upgrade.add_argument('--dry_run', action="store_true", default=False, help='Only write the mapping, do not change the new state database')
+
+    # create the parser for the "history" command
+    parser_history = subparsers.add_parser('history', help='Show state changes from the journal')
+    parser_history.set_defaults(func=history)
+    parser_history.add_argument('uid', nargs="?", default=None, help='Only show changes of this control')
 
     # create the parser for the "report" command
     parser_report = subparsers.add_parser('report', help='Generate a report')
@@ -102,6 +521,24 @@ def create_parser() -> argparse.ArgumentParser:
     parser_report.add_argument('--report_type', default="html", help='Report type to generate')
     parser_report.add_argument('--template', default="templates/html_report.html", help='Template to use')
     parser_report.add_argument('--outfile', default="html_report.html", help='Filename of generated report')
+    parser_report.add_argument('--gzip', action="store_true", default=False, help='Compress the report with gzip. Default for outfiles ending with .gz')
+    parser_report.add_argument('--all_projects', action="store_true", default=False, help='Generate the reports of all projects listed in projects of the config and an index page')
+    parser_report.add_argument('--outdir', default="reports", help='With --all_projects: directory for the reports and index.html')
+    parser_report.add_argument('--index_template', default="templates/html_portfolio.html", help='With --all_projects: template of the index page')
+    parser_report.add_argument('--workers', type=int, default=0, help='With --all_projects: worker processes rendering reports. 0: one per project, up to the number of CPUs')
+
+    # create the parser for the "cache" command
+    parser_cache = subparsers.add_parser('cache', help='Show section load times from cache or data file')
+    parser_cache.set_defaults(func=cache)
+    parser_cache.add_argument('--clear', action="store_true", default=False, help='Remove all files from the catalogue cache')
+
+    # create the parser for the "serve" command
+    parser_serve = subparsers.add_parser('serve', help='Keep the data loaded and answer show, list, mark, mark-batch, import, report and export over a local HTTP API. Clients authenticate with the token in server_token_file')
+    parser_serve.set_defaults(func=serve)
+    parser_serve.add_argument('--host', default=None, help='Address to listen on. Default: from the server setting. Only loopback addresses are accepted')
+    parser_serve.add_argument('--port', type=int, default=None, help='Port to listen on. Default: from the server setting')
+    parser_serve.add_argument('--save_interval', type=float, default=30.0, help='Seconds between saves of changed states')
+    parser_serve.add_argument('--watch_interval', type=float, default=2.0, help='Seconds between checks for changed config and data files')
 
     return lparser
 
@@ -111,7 +548,32 @@ if __name__ == "__main__":
     # TODO Add argcomplete
     args = parser.parse_args()
 
-    args.func(args)
+    if args.profile:
+        PROFILER.enable(trace_memory=args.profile_memory, cprofile=args.profile_cprofile is not None)
+    try:
+        args.func(args)
+    except CbxLoadError as error:
+        for prefix, message in error.errors.items():
+            print(f"Could not load section {prefix}: {message}", file=sys.stderr)
+        sys.exit(1)
+    except CbxApiError as error:
+        print(f"Server error: {error}", file=sys.stderr)
+        sys.exit(1)
+    except TimeoutError as error:
+        # Another process holds the database lock too long
+        print(error, file=sys.stderr)
+        sys.exit(1)
+    except BrokenPipeError:
+        # The reader closed the pipe, like list | head. Send the rest to devnull so flushing at exit does not fail again
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(1)
+    finally:
+        if args.profile:
+            PROFILER.disable()
+            PROFILER.print_summary(sys.stderr, args.profile_format)
+            if args.profile_cprofile is not None:
+                PROFILER.dump_cprofile(args.profile_cprofile)
 
     # Parser commands:
     # TODO: Create a tool where you answer project questions and it will de-activate certain controls based on that
@@ -123,4 +585,4 @@ if __name__ == "__main__":
 
     # TODO: Add unit tests
 
-    # TODO: Ensure that the versions of the OWASP databases are locked. Especially WSTG with the ordinals will cause chaos if not.
+    # TODO: Ensure that the versions of the OWASP databases are locked. Especially WSTG with the ordinals will cause chaos if not. Use upgrade to change versions.
@@ -16,7 +16,7 @@ def flake8(session):
     session.install("flake8")
     session.install("-r", "requirements.txt")
     # E 501 is long line
-    session.run("flake8", "--ignore","E501", "checkbox_empire.py", "app/cbx_section.py", "app/cbx_item.py", "app/cbx_empire.py")
+    session.run("flake8", "--ignore","E501", "checkbox_empire.py", "app/cbx_section.py", "app/cbx_item.py", "app/cbx_empire.py", "app/cbx_index.py", "app/cbx_rules.py", "app/cbx_batch.py", "app/cbx_journal.py", "app/cbx_sqlite.py", "app/cbx_stats.py", "app/cbx_columns.py", "app/cbx_server.py", "app/cbx_ingest.py", "app/cbx_stream.py", "app/cbx_search.py", "app/cbx_profile.py", "app/cbx_portfolio.py", "app/cbx_upgrade.py", "app/cbx_client.py", "app/cbx_lock.py", "app/cbx_cache.py", "app/cbx_database.py", "app/cbx_output.py")
 
 @nox.session(python=supported_python_versions,venv_backend='venv')
 def safety(session):
@@ -32,7 +32,7 @@ def bandit(session):
     session.install("bandit")
     session.install("-r", "requirements.txt")
     # bandit -ll -r  foo.py    ( -ll = medium level and higher, -r recursive)
-    session.run("bandit","-ll", "-r", "checkbox_empire.py", "app/cbx_section.py", "app/cbx_item.py", "app/cbx_empire.py")
+    session.run("bandit","-ll", "-r", "checkbox_empire.py", "app/cbx_section.py", "app/cbx_item.py", "app/cbx_empire.py", "app/cbx_index.py", "app/cbx_rules.py", "app/cbx_batch.py", "app/cbx_journal.py", "app/cbx_sqlite.py", "app/cbx_stats.py", "app/cbx_columns.py", "app/cbx_server.py", "app/cbx_ingest.py", "app/cbx_stream.py", "app/cbx_search.py", "app/cbx_profile.py", "app/cbx_portfolio.py", "app/cbx_upgrade.py", "app/cbx_client.py", "app/cbx_lock.py", "app/cbx_cache.py", "app/cbx_database.py", "app/cbx_output.py")
 
 @nox.session(python=supported_python_versions,venv_backend='venv')
 def mypy(session):
@@ -41,7 +41,7 @@ def mypy(session):
     session.install("-r", "requirements.txt")
     # Check for wrong types
     # mypy --strict-optional  app/ plugins/base/
-    session.run("mypy","--strict-optional", "checkbox_empire.py", "app/cbx_section.py", "app/cbx_item.py", "app/cbx_empire.py")
+    session.run("mypy","--strict-optional", "checkbox_empire.py", "app/cbx_section.py", "app/cbx_item.py", "app/cbx_empire.py", "app/cbx_index.py", "app/cbx_rules.py", "app/cbx_batch.py", "app/cbx_journal.py", "app/cbx_sqlite.py", "app/cbx_stats.py", "app/cbx_columns.py", "app/cbx_server.py", "app/cbx_ingest.py", "app/cbx_stream.py", "app/cbx_search.py", "app/cbx_profile.py", "app/cbx_portfolio.py", "app/cbx_upgrade.py", "app/cbx_client.py", "app/cbx_lock.py", "app/cbx_cache.py", "app/cbx_database.py", "app/cbx_output.py")
 
 @nox.session(python=supported_python_versions,venv_backend='venv')
 def pylint(session):
@@ -49,7 +49,7 @@ def pylint(session):
     session.install("pylint")
     session.install("-r", "requirements.txt")
     # pylint --rcfile=pylint.rc  foo.py
-    session.run("pylint","--rcfile=pylint.rc", "checkbox_empire.py", "app/cbx_section.py", "app/cbx_item.py", "app/cbx_empire.py")
+    session.run("pylint","--rcfile=pylint.rc", "checkbox_empire.py", "app/cbx_section.py", "app/cbx_item.py", "app/cbx_empire.py", "app/cbx_index.py", "app/cbx_rules.py", "app/cbx_batch.py", "app/cbx_journal.py", "app/cbx_sqlite.py", "app/cbx_stats.py", "app/cbx_columns.py", "app/cbx_server.py", "app/cbx_ingest.py", "app/cbx_stream.py", "app/cbx_search.py", "app/cbx_profile.py", "app/cbx_portfolio.py", "app/cbx_upgrade.py", "app/cbx_client.py", "app/cbx_lock.py", "app/cbx_cache.py", "app/cbx_database.py", "app/cbx_output.py")
 
 @nox.session(python=supported_python_versions,venv_backend='venv')
 def unittest(session):
@@ -80,4 +80,20 @@ def pydocstyle(session):
     session.install("pydocstyle")
     session.install("-r", "requirements.txt")
     # pylint --rcfile=pylint.rc  foo.py
-    session.run("pydocstyle","app", "checkbox_empire.py")
\ No newline at end of file
+    session.run("pydocstyle","app", "checkbox_empire.py")
+
+
+@nox.session(python=supported_python_versions,venv_backend='venv')
+def benchmark(session):
+    """ Performance benchmarks of all CLI paths, results in benchmarks/results """
+    session.install("-r", "requirements.txt")
+    # python benchmarks/bench_suite.py --sizes 1000 10000 --compare benchmarks/results/<commit>.json
+    session.run("python", "benchmarks/bench_suite.py", *session.posargs)
+
+
+@nox.session(python=supported_python_versions,venv_backend='venv')
+def startup(session):
+    """ Cold start of show <uid>. Fails if it imports heavy dependencies, too many modules or exceeds the wall time budgets relative to the Python start """
+    session.install("-r", "requirements.txt")
+    # python benchmarks/bench_startup.py --max_modules 100 --budget 100 --import_budget 60 [--strict]
+    session.run("python", "benchmarks/bench_startup.py", "--strict", "--budget_factor", "15", "--import_factor", "8", *session.posargs)
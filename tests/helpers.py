@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+"""Shared fixtures of the unit tests. Synthetic projects are written with the generators of the benchmarks."""
+
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from benchmarks.generators import write_project
+
+from app.cbx_empire import CbxEmpire
+
+
+class ProjectTestCase(unittest.TestCase):
+    """Writes a small synthetic project into a temporary directory and runs the test in there.
+
+    The data file and database paths of a config are relative to the working directory.
+    """
+
+    # Number of controls of the synthetic project
+    controls = 200
+    # toml or sqlite
+    state_backend = "toml"
+
+    def setUp(self) -> None:
+        """Write the project and change into its directory."""
+        self.tmp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.tmp_dir.cleanup)
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+        self.config_file = write_project(self.tmp_dir.name, self.controls, self.state_backend)
+        os.chdir(self.tmp_dir.name)
+
+    def load(self, **kwargs: bool) -> CbxEmpire:
+        """Load the project.
+
+        :param kwargs: Arguments of CbxEmpire.load_config
+        :returns: The loaded project
+        """
+        empire = CbxEmpire()
+        # Loading prints the project tag summary
+        with contextlib.redirect_stdout(io.StringIO()):
+            empire.load_config(self.config_file, **kwargs)
+        return empire
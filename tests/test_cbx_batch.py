@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+"""Tests of marking single controls and batches of controls."""
+
+import contextlib
+import io
+import unittest
+
+from helpers import ProjectTestCase
+
+from app.cbx_batch import CbxMarkResult, guess_format, read_mark_records
+from app.cbx_control import State
+
+
+class TestRecords(unittest.TestCase):
+    """Reading mark records."""
+
+    def test_csv(self) -> None:
+        """uid and state are stripped, the statement is optional."""
+        records = read_mark_records(io.StringIO("uid,state,statement\n S-V1 ,checked,ok\nS-V2, unchecked ,\n"), "csv")
+        self.assertEqual(list(records), [("S-V1", "checked", "ok"), ("S-V2", "unchecked", "")])
+
+    def test_jsonl(self) -> None:
+        """Empty lines are skipped, the statement is optional."""
+        records = read_mark_records(io.StringIO('{"uid": "S-V1", "state": "checked"}\n\n{"uid": "S-V2", "state": "unchecked", "statement": "no"}\n'), "jsonl")
+        self.assertEqual(list(records), [("S-V1", "checked", ""), ("S-V2", "unchecked", "no")])
+
+    def test_csv_malformed_rows(self) -> None:
+        """Rows without uid or state are skipped and reported with their line number, a file without the columns is refused."""
+        errors: list[tuple[int, str]] = []
+        records = read_mark_records(io.StringIO("uid,state,statement\nS-V1,checked,ok\nS-V2\nS-V3,unchecked,\n"), "csv", errors)
+        self.assertEqual(list(records), [("S-V1", "checked", "ok"), ("S-V3", "unchecked", "")])
+        self.assertEqual([line for line, _ in errors], [3])
+        errors.clear()
+        self.assertEqual(list(read_mark_records(io.StringIO("id,status\nS-V1,checked\n"), "csv", errors)), [])
+        self.assertEqual(errors, [(1, "Missing column uid, state")])
+
+    def test_jsonl_malformed_lines(self) -> None:
+        """Invalid JSON and objects without uid or state are skipped and reported with their line number."""
+        errors: list[tuple[int, str]] = []
+        records = read_mark_records(io.StringIO('{"uid": "S-V1", "state": "checked"}\n{"uid": "S-V2"\n\n["S-V3", "checked"]\n'
+                                                '{"uid": "S-V4"}\n{"uid": "S-V5", "state": "unchecked"}\n'), "jsonl", errors)
+        self.assertEqual(list(records), [("S-V1", "checked", ""), ("S-V5", "unchecked", "")])
+        self.assertEqual([line for line, _ in errors], [2, 4, 5])
+
+    def test_formats(self) -> None:
+        """The format is guessed from the extension, unknown formats are refused."""
+        self.assertEqual(guess_format("marks.csv"), "csv")
+        self.assertEqual(guess_format("marks.json"), "jsonl")
+        self.assertEqual(guess_format("-", default="csv"), "csv")
+        with self.assertRaises(ValueError):
+            read_mark_records(io.StringIO(""), "xml")
+
+    def test_result_round_trip(self) -> None:
+        """The summary survives to_dict and from_dict, as used by the serve daemon."""
+        result = CbxMarkResult()
+        result.applied = 2
+        result.unknown_uids = ["S-V9"]
+        result.invalid_states = [("S-V1", "done", "")]
+        result.changes = [("S-V2", "unchecked", "checked")]
+        result.errors = [(3, "Missing uid or state")]
+        self.assertEqual(CbxMarkResult.from_dict(result.to_dict()).to_dict(), result.to_dict())
+
+
+class TestMarking(ProjectTestCase):
+    """Marking controls of the synthetic project and saving them."""
+
+    def test_mark_control(self) -> None:
+        """A valid mark is applied and recorded, an invalid state or unknown UID is refused."""
+        empire = self.load(lazy=True)
+        self.assertTrue(empire.mark_control("OWASP_ASVS-V1.1.1", "checked", "ok"))
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertFalse(empire.mark_control("OWASP_ASVS-V1.1.2", "done"))
+        self.assertIn("Invalid state done", out.getvalue())
+        self.assertFalse(empire.mark_control("UNKNOWN-V1", "checked"))
+        control = empire.find_control_by_uid("OWASP_ASVS-V1.1.2")
+        assert control is not None
+        self.assertEqual(control.state, State.UNCHECKED)
+        self.assertEqual(list(empire.changed_uids), ["OWASP_ASVS-V1.1.1"])
+
+    def test_mark_controls(self) -> None:
+        """The summary counts applied marks, unknown UIDs and invalid states."""
+        empire = self.load(lazy=True)
+        result = empire.mark_controls([("OWASP_ASVS-V1.1.1", "checked", "a"), ("OWASP_ASVS-V1.1.2", "not_relevant", "b"),
+                                       ("UNKNOWN-V1", "checked", ""), ("OWASP_ASVS-V1.1.3", "done", "")])
+        self.assertEqual(result.applied, 2)
+        self.assertEqual(result.unknown_uids, ["UNKNOWN-V1"])
+        self.assertEqual(result.invalid_states, [("OWASP_ASVS-V1.1.3", "done", "")])
+        self.assertEqual(list(empire.changed_uids), ["OWASP_ASVS-V1.1.1", "OWASP_ASVS-V1.1.2"])
+
+    def test_batch_is_saved_once(self) -> None:
+        """All marks of a batch go to the journal in one write and are loaded again."""
+        empire = self.load(lazy=True)
+        uids = empire.sections_by_prefix["OWASP_ASVS"].get_uids()[:50]
+        empire.mark_controls([(uid, "checked", f"batch {uid}") for uid in uids])
+        empire.database.save()
+        self.assertEqual(empire.changed_uids, {})
+        assert empire.database.journal is not None
+        self.assertEqual(len(list(empire.database.journal.read())), 50)
+        reloaded = self.load()
+        for uid in uids:
+            self.assertEqual(reloaded.index.controls[uid].state, State.CHECKED)
+            self.assertEqual(reloaded.index.controls[uid].statement, f"batch {uid}")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+"""Tests of the catalogue cache."""
+
+import contextlib
+import io
+import os
+import unittest
+
+from helpers import ProjectTestCase
+
+from app.cbx_cache import clear_cache, get_cache_file, hash_data_file, read_cache
+from app.cbx_section import CbxSection
+
+ASVS_FILE = os.path.join("data", "asvs.json")
+
+
+class TestCache(ProjectTestCase):
+    """Loading the sections of the synthetic project through the cache."""
+
+    def load_asvs(self) -> CbxSection:
+        """Load the ASVS data file into a new section, using the cache of the project.
+
+        :returns: The section
+        """
+        section = CbxSection(name="ASVS", prefix="OWASP_ASVS", description="")
+        section.load_data_file("OWASP_ASVS_JSON", ASVS_FILE, ".cbx_cache")
+        return section
+
+    def test_second_load_uses_the_cache(self) -> None:
+        """The first load parses the data file and writes the cache, the second one builds the same tree from it."""
+        first = self.load_asvs()
+        self.assertFalse(first.loaded_from_cache)
+        assert first.data_hash is not None
+        self.assertTrue(os.path.exists(get_cache_file(".cbx_cache", first.data_hash)))
+        second = self.load_asvs()
+        self.assertTrue(second.loaded_from_cache)
+        self.assertEqual(second.to_dict(), first.to_dict())
+        self.assertEqual(second.get_uids(), first.get_uids())
+
+    def test_changed_data_file_is_parsed_again(self) -> None:
+        """A changed data file has a new hash, its old cache file is not used."""
+        first = self.load_asvs()
+        with open(ASVS_FILE, "at", encoding="utf-8") as fh:
+            fh.write("\n")
+        second = self.load_asvs()
+        self.assertNotEqual(second.data_hash, first.data_hash)
+        self.assertFalse(second.loaded_from_cache)
+
+    def test_hash_covers_type_and_prefix(self) -> None:
+        """The same data file loaded for another section or type gets another cache file."""
+        digest = hash_data_file("OWASP_ASVS_JSON", ASVS_FILE, "OWASP_ASVS")
+        self.assertEqual(digest, hash_data_file("OWASP_ASVS_JSON", ASVS_FILE, "OWASP_ASVS"))
+        self.assertNotEqual(digest, hash_data_file("OWASP_ASVS_JSON", ASVS_FILE, "PLANNING"))
+        self.assertNotEqual(digest, hash_data_file("OWASP_ISVS_JSON", ASVS_FILE, "OWASP_ASVS"))
+
+    def test_broken_cache_file_is_replaced(self) -> None:
+        """A truncated cache file is reported and written again from the data file."""
+        first = self.load_asvs()
+        cache_file = get_cache_file(".cbx_cache", first.data_hash)
+        with open(cache_file, "wb") as fh:
+            fh.write(b"\xff")
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            second = self.load_asvs()
+        self.assertIn("Broken cache file", out.getvalue())
+        self.assertFalse(second.loaded_from_cache)
+        self.assertIsNotNone(read_cache(cache_file))
+
+    def test_clear_cache(self) -> None:
+        """Clearing removes the cache files of all sections, a missing cache dir is fine."""
+        empire = self.load()
+        self.assertEqual(clear_cache(empire.cache_dir), len(empire.sections))
+        self.assertEqual(clear_cache(empire.cache_dir), 0)
+        self.assertEqual(clear_cache(None), 0)
+        self.assertFalse(self.load().sections[0].loaded_from_cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
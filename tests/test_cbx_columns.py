@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+"""Tests of the columnar state store."""
+
+import unittest
+
+from helpers import ProjectTestCase
+
+from app.cbx_columns import CbxColumnStore
+from app.cbx_control import State
+
+
+class TestColumnStore(unittest.TestCase):
+    """States and statements of a store."""
+
+    def setUp(self) -> None:
+        """Create a store of three controls."""
+        self.store = CbxColumnStore(CbxColumnStore.get_positions(["S-V1", "S-V2", "S-V3"]))
+
+    def test_states_and_statements(self) -> None:
+        """Empty statements are kept apart from missing ones, unknown UIDs are rejected."""
+        self.assertTrue(self.store.set_state("S-V1", State.CHECKED, "done"))
+        self.assertTrue(self.store.set_state("S-V2", State.NOT_RELEVANT, ""))
+        self.assertFalse(self.store.set_state("S-V9", State.CHECKED))
+        self.assertEqual([self.store.get_state(uid) for uid in ("S-V1", "S-V2", "S-V3", "S-V9")], [State.CHECKED, State.NOT_RELEVANT, State.UNCHECKED, None])
+        self.assertEqual([self.store.get_statement(uid) for uid in ("S-V1", "S-V2", "S-V3", "S-V9")], ["done", "", None, None])
+        self.store.set_state("S-V1", State.CHECKED)
+        self.assertIsNone(self.store.get_statement("S-V1"))
+        self.assertEqual(self.store.statements, {})
+
+    def test_counts(self) -> None:
+        """Controls with empty statements are counted with their state."""
+        self.store.set_state("S-V1", State.CHECKED, "")
+        self.store.set_state("S-V2", State.CHECKED)
+        self.assertEqual(self.store.get_counts(), {State.UNCHECKED: 1, State.CHECKED: 2, State.NOT_RELEVANT: 0})
+
+
+class TestProjectColumns(ProjectTestCase):
+    """Copying the states of the synthetic project to a store and back."""
+
+    def test_round_trip(self) -> None:
+        """A store applied to a fresh project restores the states, only differences are written on a shared store."""
+        empire = self.load()
+        empire.mark_controls([("OWASP_ASVS-V1.1.1", "checked", "a"), ("OWASP_ASVS-V1.1.2", "not_relevant", "")])
+        store = CbxColumnStore.from_index(empire.index)
+        self.assertEqual(store.get_counts(), empire.stats.counts)
+        fresh = self.load()
+        baseline = CbxColumnStore.from_index(fresh.index, store.positions)
+        store.apply_to(fresh.index, baseline)
+        for uid, control in empire.index.controls.items():
+            self.assertEqual((fresh.index.controls[uid].state, fresh.index.controls[uid].statement), (control.state, control.statement))
+        self.assertEqual(fresh.stats.counts, empire.stats.counts)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+"""Tests of the JSON lines and MessagePack exports."""
+
+import importlib.util
+import json
+import unittest
+
+from helpers import ProjectTestCase
+
+from app.cbx_batch import read_jsonl_records
+from app.cbx_output import CbxOutput
+
+
+class TestExport(ProjectTestCase):
+    """Exporting the synthetic project."""
+
+    def setUp(self) -> None:
+        """Load the project and mark a control."""
+        super().setUp()
+        self.empire = self.load()
+        self.empire.mark_control("OWASP_ASVS-V1.1.1", "checked", "Unicode statement: ✓")
+        self.output = CbxOutput(self.empire)
+
+    def test_jsonl(self) -> None:
+        """One record per control in catalogue order, the file can be merged back without changes."""
+        self.assertEqual(self.output.export_to_jsonl("controls.jsonl"), len(self.empire.index))
+        with open("controls.jsonl", "rt", encoding="utf-8") as fh:
+            records = [json.loads(line) for line in fh]
+        self.assertEqual(records, list(self.output.get_control_records()))
+        self.assertEqual([record["uid"] for record in records], self.empire.list_all_control_uids())
+        with open("controls.jsonl", "rt", encoding="utf-8") as fh:
+            result = self.empire.merge_controls(read_jsonl_records(fh))
+        self.assertEqual((result.unchanged, result.changes), (len(self.empire.index), []))
+
+    @unittest.skipUnless(importlib.util.find_spec("msgpack"), "msgpack is not installed")
+    def test_msgpack(self) -> None:
+        """The MessagePack stream holds the same records as the JSON lines."""
+        import msgpack  # pylint: disable=import-outside-toplevel
+        self.assertEqual(self.output.export_to_msgpack("controls.msgpack"), len(self.empire.index))
+        with open("controls.msgpack", "rb") as fh:
+            self.assertEqual(list(msgpack.Unpacker(fh)), list(self.output.get_control_records()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""Tests of the UID index and the lookups of the project."""
+
+import contextlib
+import io
+import unittest
+
+from helpers import ProjectTestCase
+
+from app.cbx_control import CbxControl
+from app.cbx_group import CbxGroup
+from app.cbx_index import CbxIndex
+from app.cbx_item import CbxItem
+from app.cbx_section import CbxSection
+
+
+class TestIndex(unittest.TestCase):
+    """Adding and finding controls."""
+
+    def test_find(self) -> None:
+        """Controls are found by UID, unknown UIDs return None."""
+        index = CbxIndex()
+        control = CbxControl("V1", 1, "first", [], [], {}, section_prefix="S")
+        index.add_controls([control, CbxControl("V2", 2, "second", [], [], {}, section_prefix="S")])
+        self.assertIs(index.find("S-V1"), control)
+        self.assertIsNone(index.find("S-V3"))
+        self.assertIn("S-V2", index)
+        self.assertEqual(index.uids(), ["S-V1", "S-V2"])
+        self.assertEqual(len(index), 2)
+
+    def test_duplicates_keep_the_first(self) -> None:
+        """A second control with the same UID is reported, the first one stays indexed."""
+        index = CbxIndex()
+        first = CbxControl("V1", 1, "first", [], [], {}, section_prefix="S")
+        index.add_control(first)
+        index.add_control(first)
+        with contextlib.redirect_stdout(io.StringIO()):
+            index.add_control(CbxControl("V1", 2, "second", [], [], {}, section_prefix="S"))
+        self.assertIs(index.find("S-V1"), first)
+        self.assertEqual(index.duplicates, ["S-V1"])
+
+    def test_controls_added_later_are_registered(self) -> None:
+        """Sections attached to an index register the controls of groups and items added afterwards."""
+        index = CbxIndex()
+        section = CbxSection(name="Section", prefix="S", description="")
+        section.set_index(index)
+        group = CbxGroup(shortcode="G1", ordinal=1, shortname="G", name="Group")
+        section.add_group(group)
+        item = CbxItem(shortcode="I1", ordinal=1, name="Item")
+        group.add_item(item)
+        item.add_control(CbxControl("V1", 1, "first", [], [], {}, section_prefix="S"))
+        self.assertIsNotNone(index.find("S-V1"))
+
+
+class TestProjectLookup(ProjectTestCase):
+    """Lookups on a loaded project."""
+
+    def test_lazy_section_is_loaded_on_lookup(self) -> None:
+        """Finding a control of a lazy project loads only its section."""
+        empire = self.load(lazy=True)
+        self.assertEqual(len(empire.index), 0)
+        control = empire.find_control_by_uid("OWASP_ASVS-V1.1.1")
+        assert control is not None
+        self.assertEqual(control.get_uid(), "OWASP_ASVS-V1.1.1")
+        self.assertEqual([section.is_loaded() for section in empire.sections], [prefix == "OWASP_ASVS" for prefix in empire.sections_by_prefix])
+        self.assertIsNone(empire.find_control_by_uid("UNKNOWN-V1"))
+
+    def test_index_matches_catalogue_order(self) -> None:
+        """The index holds every control of the project in catalogue order."""
+        empire = self.load()
+        self.assertEqual(empire.index.uids(), empire.list_all_control_uids())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+"""Tests of the tool result readers and the mapping of findings to controls."""
+
+import io
+import json
+import tracemalloc
+import unittest
+
+from app.cbx_control import CbxControl, State
+from app.cbx_index import CbxIndex
+from app.cbx_ingest import CbxFindingMap, CbxIngestResult, find_cwes, read_findings, read_junit_findings
+
+
+def junit_document(testcases: int) -> str:
+    """Return a JUnit XML document with two nested test suites.
+
+    :param testcases: Number of test cases in the first suite
+    :returns: The document
+    """
+    parts = ["<testsuites><testsuite name='first'><properties><property name='build' value='1'/></properties>"]
+    for number in range(testcases):
+        parts.append(f"<testcase classname='web' name='xss {number} CWE-79'><failure message='found'>trace {number}</failure>"
+                     f"<system-out>output of test {number}</system-out></testcase>")
+    parts.append("</testsuite><testsuite name='second'><testcase name='last'/></testsuite></testsuites>")
+    return "".join(parts)
+
+
+class TestReaders(unittest.TestCase):
+    """The SARIF, JUnit XML and JSON lines readers."""
+
+    def test_find_cwes(self) -> None:
+        """CWE references are found in strings and lists, other values are ignored."""
+        self.assertEqual(find_cwes("CWE-79", ["cwe_089", "external/cwe/cwe-22"], None, 5), {79, 89, 22})
+
+    def test_sarif(self) -> None:
+        """CWEs of rules and results are combined, skipped kinds and levels are ignored."""
+        sarif = {"runs": [{"tool": {"driver": {"rules": [{"id": "R1", "properties": {"tags": ["external/cwe/cwe-79"]}}]}},
+                           "results": [{"ruleId": "R1", "level": "error"},
+                                       {"ruleId": "R2", "kind": "pass", "properties": {"tags": ["CWE-89"]}},
+                                       {"ruleId": "R3", "level": "note"},
+                                       {"ruleId": "R4", "kind": "notApplicable"}]}]}
+        findings = list(read_findings(io.StringIO(json.dumps(sarif)), "sarif"))
+        self.assertEqual(findings, [("R1", {79}, True), ("R2", {89}, False)])
+
+    def test_junit(self) -> None:
+        """Failures and errors fail, skipped test cases are ignored, the cwe property is used."""
+        xml = ("<testsuite><testcase classname='a' name='b CWE-79'><failure/></testcase>"
+               "<testcase name='c'><properties><property name='cwe' value='89'/></properties></testcase>"
+               "<testcase name='d'><skipped/></testcase><testcase name='e'><error/></testcase></testsuite>")
+        findings = list(read_findings(io.StringIO(xml), "junit"))
+        self.assertEqual(findings, [("a.b CWE-79", {79}, True), ("c", {89}, False), ("e", set(), True)])
+
+    def test_junit_nested_suites(self) -> None:
+        """All test cases of nested test suites are read."""
+        findings = list(read_junit_findings(io.StringIO(junit_document(100))))
+        self.assertEqual(len(findings), 101)
+        self.assertEqual(findings[-1], ("last", set(), False))
+
+    def test_junit_memory_is_flat(self) -> None:
+        """The peak memory does not grow with the number of test cases of a nested test suite."""
+        peaks = []
+        for testcases in (2000, 20000):
+            # Created before tracing, only the memory of the reader is measured
+            fh = io.StringIO(junit_document(testcases))
+            tracemalloc.start()
+            try:
+                for _ in read_junit_findings(fh):
+                    pass
+                peaks.append(tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+        self.assertLess(peaks[1], peaks[0] * 2)
+
+    def test_jsonl(self) -> None:
+        """cwe can be a number, a reference or a list, status defaults to fail."""
+        lines = ('{"rule": "a", "cwe": 79}\n\n{"rule": "b", "cwe": ["CWE-89", 22], "status": "pass"}\n'
+                 '{"uid": "OWASP_ASVS-V1.1.1"}\n')
+        findings = list(read_findings(io.StringIO(lines), "jsonl"))
+        self.assertEqual(findings, [("a", {79}, True), ("b", {89, 22}, False), ("OWASP_ASVS-V1.1.1", set(), True)])
+
+    def test_unknown_format(self) -> None:
+        """Unknown formats are refused."""
+        with self.assertRaises(ValueError):
+            read_findings(io.StringIO(""), "pdf")
+
+
+class TestMapping(unittest.TestCase):
+    """Mapping findings to controls and creating the mark records."""
+
+    def setUp(self) -> None:
+        """Index three controls."""
+        self.index = CbxIndex()
+        self.index.add_controls([CbxControl("V1", 1, "xss", [79], [], {}, section_prefix="S"),
+                                 CbxControl("V2", 2, "sql", [89], [], {}, section_prefix="S"),
+                                 CbxControl("V3", 3, "other", [], [], {}, section_prefix="S")])
+
+    def test_records(self) -> None:
+        """Failures uncheck, passes check, rule ids that are UIDs and the rule table are mapped."""
+        finding_map = CbxFindingMap(self.index, {"policy": ["S-V3"]})
+        result = CbxIngestResult("tool").collect([("r1", {79}, True), ("r1", {79}, True), ("r2", {89}, False),
+                                                  ("policy", set(), False), ("r3", {1}, True)], finding_map)
+        self.assertEqual(result.findings, 5)
+        self.assertEqual(result.unmapped, 1)
+        self.assertEqual(result.get_records(self.index), [("S-V1", "unchecked", "tool: 2 findings of r1"),
+                                                          ("S-V2", "checked", "tool: passed r2"),
+                                                          ("S-V3", "checked", "tool: passed policy")])
+
+    def test_map_findings(self) -> None:
+        """Every finding gets the UIDs of its rule id and CWEs, unknown ones none."""
+        mapped = list(CbxFindingMap(self.index, {"policy": ["S-V3"]}).map_findings([("r1", {79, 89}, True), ("policy", set(), False), ("r3", {1}, True)]))
+        self.assertEqual(mapped, [("r1", {"S-V1", "S-V2"}, True), ("policy", {"S-V3"}, False), ("r3", set(), True)])
+
+    def test_not_relevant_and_unchanged_are_skipped(self) -> None:
+        """Not relevant controls and controls already in the resulting state are left alone."""
+        self.index.controls["S-V1"].set_state(State.NOT_RELEVANT.value, "")
+        self.index.controls["S-V2"].set_state(State.CHECKED.value, "tool: passed r2")
+        result = CbxIngestResult("tool").collect([("r1", {79}, True), ("r2", {89}, False)], CbxFindingMap(self.index))
+        self.assertEqual(result.get_records(self.index), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
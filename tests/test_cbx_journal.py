@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+"""Tests of the state journal and the toml database compacted from it."""
+
+import contextlib
+import io
+import os
+import tempfile
+import tomllib
+import unittest
+
+from helpers import ProjectTestCase
+
+from app.cbx_control import State
+from app.cbx_journal import CbxJournal
+
+
+class TestJournal(unittest.TestCase):
+    """Appending and replaying entries."""
+
+    def setUp(self) -> None:
+        """Create a journal in a temporary directory."""
+        tmp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmp_dir.cleanup)
+        self.journal = CbxJournal(os.path.join(tmp_dir.name, "database.toml.journal"))
+
+    def test_read_from_offset(self) -> None:
+        """Reading from a remembered size returns only the entries written later."""
+        self.assertEqual(list(self.journal.read()), [])
+        self.assertEqual(self.journal.write([CbxJournal.create_entry("S-V1", "checked", "a", "alice")]), 1)
+        offset = self.journal.size()
+        self.journal.write([CbxJournal.create_entry("S-V2", "unchecked", "b", "bob"), CbxJournal.create_entry("S-V1", "not_relevant", "c", "bob")])
+        self.assertEqual([entry["uid"] for entry in self.journal.read()], ["S-V1", "S-V2", "S-V1"])
+        self.assertEqual([(entry["uid"], entry["state"], entry["author"]) for entry in self.journal.read(offset)],
+                         [("S-V2", "unchecked", "bob"), ("S-V1", "not_relevant", "bob")])
+
+    def test_broken_and_replaced_journals(self) -> None:
+        """Broken lines are skipped, an offset behind the end replays the whole journal."""
+        self.journal.write([CbxJournal.create_entry("S-V1", "checked", "a", "alice")])
+        with open(self.journal.filename, "at", encoding="utf-8") as fh:
+            fh.write('{"uid": "S-V2", "sta\n')
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertEqual([entry["uid"] for entry in self.journal.read(self.journal.size() * 2)], ["S-V1"])
+        self.assertIn("shorter than expected", out.getvalue())
+        self.assertIn("Skipping broken journal line", out.getvalue())
+
+
+class TestJournalDatabase(ProjectTestCase):
+    """Saving, compacting and merging on the toml database of the synthetic project."""
+
+    def test_save_appends_and_compacts(self) -> None:
+        """Saves only append to the journal until journal_compact_after entries are pending."""
+        empire = self.load()
+        empire.database.journal_compact_after = 3
+        empire.mark_controls([("OWASP_ASVS-V1.1.1", "checked", "a"), ("OWASP_ASVS-V1.1.2", "checked", "b")])
+        empire.database.save()
+        self.assertFalse(os.path.exists("database.toml"))
+        empire.mark_control("OWASP_ASVS-V1.1.3", "checked", "c")
+        empire.database.save()
+        assert empire.database.journal is not None
+        with open("database.toml", "rb") as fh:
+            data = tomllib.load(fh)
+        self.assertEqual(data["journal_offset"], empire.database.journal.size())
+        self.assertEqual(len(data["controls"]), len(empire.index))
+        self.assertEqual(empire.database.journal_pending, 0)
+        # The journal stays as audit trail
+        self.assertEqual(len(list(empire.database.journal.read())), 3)
+
+    def test_replay_after_compaction(self) -> None:
+        """Loading combines the compacted database with the journal entries written after it."""
+        empire = self.load()
+        empire.mark_control("OWASP_ASVS-V1.1.1", "checked", "compacted")
+        empire.database.compact()
+        empire.mark_control("OWASP_ASVS-V1.1.1", "unchecked", "journal")
+        empire.database.save()
+        reloaded = self.load()
+        self.assertEqual(reloaded.index.controls["OWASP_ASVS-V1.1.1"].state, State.UNCHECKED)
+        self.assertEqual(reloaded.index.controls["OWASP_ASVS-V1.1.1"].statement, "journal")
+        self.assertEqual(reloaded.database.journal_pending, 1)
+
+    def test_concurrent_saves_are_merged(self) -> None:
+        """A save applies the entries another process saved since loading, its own unsaved changes win."""
+        first = self.load(lazy=True)
+        second = self.load(lazy=True)
+        first.mark_controls([("OWASP_ASVS-V1.1.1", "checked", "first"), ("OWASP_ASVS-V1.1.2", "checked", "first")])
+        first.database.save()
+        second.mark_control("OWASP_ASVS-V1.1.2", "not_relevant", "second")
+        second.database.save()
+        control = second.find_control_by_uid("OWASP_ASVS-V1.1.1")
+        assert control is not None
+        self.assertEqual(control.statement, "first")
+        reloaded = self.load()
+        self.assertEqual(reloaded.index.controls["OWASP_ASVS-V1.1.1"].state, State.CHECKED)
+        self.assertEqual(reloaded.index.controls["OWASP_ASVS-V1.1.2"].state, State.NOT_RELEVANT)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+"""Tests of lazy section loading."""
+
+import unittest
+
+from helpers import ProjectTestCase
+
+from app.cbx_control import State
+
+
+class TestLazyLoading(ProjectTestCase):
+    """Loading the synthetic project lazily."""
+
+    def test_only_touched_sections_are_loaded(self) -> None:
+        """A control lookup loads only the section of its UID, unknown prefixes load nothing."""
+        empire = self.load(lazy=True)
+        self.assertFalse(any(section.is_loaded() for section in empire.sections))
+        self.assertIsNone(empire.find_control_by_uid("UNKNOWN-V1.1.1"))
+        self.assertIsNotNone(empire.find_control_by_uid("OWASP_MASVS-MASVS-G0-0"))
+        self.assertEqual([str(section.manual_prefix) for section in empire.sections if section.is_loaded()], ["OWASP_MASVS"])
+        self.assertEqual(len(empire.index), len(empire.sections_by_prefix["OWASP_MASVS"].get_uids()))
+
+    def test_states_and_tags_of_late_sections(self) -> None:
+        """Stored states and project tags are applied when a section is loaded, the result equals an eager load."""
+        stored = self.load()
+        stored.mark_controls([("OWASP_ASVS-V1.1.1", "checked", "stored"), ("OWASP_ISVS-ISVS-0", "checked", "overrides tag")])
+        stored.database.save()
+        empire = self.load(lazy=True)
+        empire.load_all()
+        eager = self.load()
+        self.assertEqual(empire.to_dict(), eager.to_dict())
+        self.assertEqual(empire.stats.counts, eager.stats.counts)
+        self.assertEqual(empire.index.controls["OWASP_ASVS-V1.1.1"].statement, "stored")
+        self.assertEqual(empire.index.controls["OWASP_ISVS-ISVS-0"].state, State.CHECKED)
+        self.assertEqual(empire.index.controls["OWASP_ISVS-ISVS-1"].state, State.NOT_RELEVANT)
+
+    def test_mark_saves_only_the_changed_section(self) -> None:
+        """Marking a control loads its section, the states of the others are kept when saving."""
+        first = self.load()
+        first.mark_control("OWASP_MASVS-MASVS-G0-0", "checked", "kept")
+        first.database.save()
+        empire = self.load(lazy=True)
+        self.assertTrue(empire.mark_control("OWASP_ASVS-V1.1.1", "checked", "lazy"))
+        empire.database.save()
+        self.assertEqual([str(section.manual_prefix) for section in empire.sections if section.is_loaded()], ["OWASP_ASVS"])
+        reloaded = self.load()
+        self.assertEqual(reloaded.index.controls["OWASP_MASVS-MASVS-G0-0"].statement, "kept")
+        self.assertEqual(reloaded.index.controls["OWASP_ASVS-V1.1.1"].statement, "lazy")
+
+
+if __name__ == '__main__':
+    unittest.main()
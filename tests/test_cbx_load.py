@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+"""Tests of loading the data files of several sections, sequentially and in parallel."""
+
+import contextlib
+import io
+import time
+import unittest
+from typing import Any
+from unittest import mock
+
+from helpers import ProjectTestCase
+
+from app.cbx_empire import CbxEmpire
+from app.cbx_section import CbxLoadError, CbxSection
+
+
+class TestLoadSections(ProjectTestCase):
+    """Loading the sections of the synthetic project with different numbers of workers."""
+
+    def load_with(self, workers: int) -> CbxEmpire:
+        """Load all sections of the project.
+
+        :param workers: Number of workers, see CbxEmpire.load_sections
+        :returns: The loaded project
+        """
+        empire = self.load(lazy=True)
+        empire.load_workers = workers
+        with contextlib.redirect_stdout(io.StringIO()):
+            empire.load_all()
+        return empire
+
+    def test_parallel_equals_sequential(self) -> None:
+        """The UID index and the trees do not depend on the number of workers or the cache."""
+        sequential = self.load_with(1)
+        self.assertFalse(any(section.loaded_from_cache for section in sequential.sections))
+        for workers in (4, 1):
+            empire = self.load_with(workers)
+            self.assertTrue(all(section.loaded_from_cache for section in empire.sections))
+            self.assertEqual(empire.list_all_control_uids(), sequential.list_all_control_uids())
+            self.assertEqual(empire.to_dict(), sequential.to_dict())
+
+    def test_parallel_parse(self) -> None:
+        """Without cache the data files are parsed in a process pool with the same result."""
+        parallel = self.load_with(4)
+        self.assertFalse(any(section.loaded_from_cache for section in parallel.sections))
+        self.assertEqual(parallel.to_dict(), self.load_with(1).to_dict())
+
+    def test_load_duration_per_section(self) -> None:
+        """Every section reports the time of its own loading, not the time since the first section started."""
+        from_cache = CbxSection.from_cache
+
+        def slow_first(section: CbxSection, data: Any) -> None:
+            if section.manual_prefix == "OWASP_ASVS":
+                time.sleep(0.3)
+            from_cache(section, data)
+
+        for warm in (False, True):
+            with self.subTest(warm=warm), mock.patch.object(CbxSection, "from_cache", slow_first):
+                empire = self.load_with(4)
+                self.assertEqual(all(section.loaded_from_cache for section in empire.sections), warm)
+                self.assertEqual(empire.sections[0].manual_prefix, "OWASP_ASVS")
+                self.assertGreaterEqual(empire.sections[0].load_duration, 0.3)
+                for section in empire.sections[1:]:
+                    self.assertLess(section.load_duration, 0.3, section.manual_prefix)
+
+    def test_errors_of_all_sections(self) -> None:
+        """A broken data file fails its section, the error names the section and the file."""
+        with open("data/asvs.json", "wt", encoding="utf-8") as fh:
+            fh.write("{")
+        for workers in (1, 4):
+            with self.subTest(workers=workers):
+                with self.assertRaises(CbxLoadError) as error:
+                    self.load_with(workers)
+                self.assertEqual(list(error.exception.errors), ["OWASP_ASVS"])
+                self.assertIn("data/asvs.json", error.exception.errors["OWASP_ASVS"])
+
+
+if __name__ == '__main__':
+    unittest.main()
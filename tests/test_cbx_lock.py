@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+"""Tests of the file locking and of concurrent marks by several processes."""
+
+import os
+import subprocess  # nosec
+import sys
+import tempfile
+import threading
+import unittest
+
+from helpers import ProjectTestCase
+
+from app.cbx_control import State
+from app.cbx_lock import CbxFileLock, atomic_write
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestFileLock(unittest.TestCase):
+    """Locking a lock file and replacing files."""
+
+    def setUp(self) -> None:
+        """Create a temporary directory for the lock file."""
+        tmp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmp_dir.cleanup)
+        self.filename = os.path.join(tmp_dir.name, "database.toml.lock")
+
+    def test_exclusive_and_shared(self) -> None:
+        """An exclusive lock keeps out every other lock, shared locks only keep out exclusive ones."""
+        first = CbxFileLock(self.filename, timeout=0.1)
+        other = CbxFileLock(self.filename, timeout=0.1)
+        with first.locked():
+            for shared in (False, True):
+                with self.assertRaises(TimeoutError):
+                    other.acquire(shared)
+        with first.locked(shared=True), other.locked(shared=True):
+            with self.assertRaises(TimeoutError):
+                CbxFileLock(self.filename, timeout=0.1).acquire()
+        with other.locked():
+            pass
+
+    def test_reentrant(self) -> None:
+        """Nested acquires only count, a shared lock can not be upgraded."""
+        lock = CbxFileLock(self.filename, timeout=0.1)
+        with lock.locked(), lock.locked(shared=True):
+            self.assertEqual(lock.depth, 2)
+        self.assertIsNone(lock.fd)
+        with lock.locked(shared=True):
+            with self.assertRaises(RuntimeError):
+                lock.acquire()
+
+    def test_atomic_write(self) -> None:
+        """A failed write keeps the old file and removes the temporary file."""
+        filename = os.path.join(os.path.dirname(self.filename), "database.toml")
+        with atomic_write(filename, encoding="utf-8") as fh:
+            fh.write("old")
+        with self.assertRaises(KeyboardInterrupt), atomic_write(filename, encoding="utf-8") as fh:
+            fh.write("partial")
+            raise KeyboardInterrupt
+        with open(filename, "rt", encoding="utf-8") as fh:
+            self.assertEqual(fh.read(), "old")
+        self.assertEqual(os.listdir(os.path.dirname(filename)), ["database.toml"])
+
+
+class TestConcurrentMarks(ProjectTestCase):
+    """Several writers marking controls in parallel on the synthetic project, every mark is a new process.
+
+    Like parallel CI jobs calling checkbox_empire.py mark. A small journal_compact_after makes the writers compact the database
+    often, while the others are appending to the journal.
+    """
+
+    writers = 4
+    marks = 5
+
+    def setUp(self) -> None:
+        """Compact the database after every few journal entries."""
+        super().setUp()
+        with open(self.config_file, "rt", encoding="utf-8") as fh:
+            config = fh.read()
+        with open(self.config_file, "wt", encoding="utf-8") as fh:
+            fh.write(config.replace('database_file_toml = "database.toml"\n', 'database_file_toml = "database.toml"\njournal_compact_after = 3\n', 1))
+
+    def run_cli(self, arguments: list[str]) -> None:
+        """Run checkbox_empire.py in a new process without the serve daemon.
+
+        :param arguments: The command and its arguments
+        """
+        command = [sys.executable, os.path.join(ROOT_DIR, "checkbox_empire.py"), "--no_server", "--config", self.config_file] + arguments
+        subprocess.run(command, stdout=subprocess.DEVNULL, check=True)  # nosec
+
+    def writer(self, marks: list[tuple[str, str]], author: str, errors: list[str]) -> None:
+        """Mark the controls one process at a time.
+
+        :param marks: The controls to mark checked with their statements
+        :param author: The author of the marks
+        :param errors: Collects the failed marks
+        """
+        for uid, statement in marks:
+            try:
+                self.run_cli(["mark", uid, "checked", "--statement", statement, "--author", author])
+            except subprocess.CalledProcessError as e:
+                errors.append(f"{author} {uid}: {e}")
+
+    def lost_marks(self, marks: list[tuple[str, str]]) -> list[str]:
+        """Load the project and compare the states with the marks.
+
+        :param marks: All marks of all writers
+        :returns: The UIDs of the lost marks
+        """
+        empire = self.load()
+        return [uid for uid, statement in marks
+                if empire.index.controls[uid].state is not State.CHECKED or empire.index.controls[uid].statement != statement]
+
+    def test_no_mark_is_lost(self) -> None:
+        """All marks are in the journal and in the compacted database."""
+        self.run_cli(["compact"])
+        # Unchecked controls only, controls of disabled project tags would be reset to not relevant when loading
+        uids = [uid for uid, control in self.load().index.controls.items() if control.state is State.UNCHECKED]
+        plans = [[(uids[mark * self.writers + number], f"writer {number} mark {mark}") for mark in range(self.marks)]
+                 for number in range(self.writers)]
+        errors: list[str] = []
+        threads = [threading.Thread(target=self.writer, args=(plan, f"writer{number}", errors)) for number, plan in enumerate(plans)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        all_marks = [mark for plan in plans for mark in plan]
+        self.assertEqual(self.lost_marks(all_marks), [])
+        # The compacted database alone has to hold them as well
+        self.run_cli(["compact"])
+        self.assertEqual(self.lost_marks(all_marks), [])
+        self.assertEqual(len(list(self.load().database.get_history())), len(all_marks))
+
+
+class TestConcurrentMarksSqlite(TestConcurrentMarks):
+    """Concurrent writers on the SQLite backend."""
+
+    state_backend = "sqlite"
+
+
+if __name__ == '__main__':
+    unittest.main()
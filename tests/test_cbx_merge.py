@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+"""Tests of the CSV round trip: exporting the controls, editing the file and merging it back."""
+
+import csv
+import unittest
+
+from helpers import ProjectTestCase
+
+from app.cbx_batch import CSV_COLUMNS, read_csv_records
+from app.cbx_control import State
+from app.cbx_output import CbxOutput
+
+
+class TestCsvMerge(ProjectTestCase):
+    """Merging an exported and edited CSV file of the synthetic project."""
+
+    def setUp(self) -> None:
+        """Load the project and export it."""
+        super().setUp()
+        self.empire = self.load()
+        self.empire.mark_control("OWASP_ASVS-V1.1.1", "checked", 'Quoted "statement", with comma\nand newline')
+        self.assertEqual(CbxOutput(self.empire).export_to_csv("controls.csv"), len(self.empire.index))
+
+    def edit(self, changes: dict[str, tuple[str, str]]) -> None:
+        """Change rows of the exported file like a person filling it out.
+
+        :param changes: New state and statement by UID
+        """
+        with open("controls.csv", "rt", encoding="utf-8", newline="") as fh:
+            rows = list(csv.DictReader(fh))
+        for row in rows:
+            if row["uid"] in changes:
+                row["state"], row["statement"] = changes[row["uid"]]
+        with open("controls.csv", "wt", encoding="utf-8", newline="") as fh:
+            writer = csv.DictWriter(fh, CSV_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def merge(self, dry_run: bool = False) -> tuple[int, list[tuple[str, str, str]]]:
+        """Merge the exported file.
+
+        :param dry_run: Only compare
+        :returns: The number of unchanged records and the changes
+        """
+        with open("controls.csv", "rt", encoding="utf-8", newline="") as fh:
+            result = self.empire.merge_controls(read_csv_records(fh), dry_run)
+        return result.unchanged, result.changes
+
+    def test_unchanged_export(self) -> None:
+        """Merging the unchanged export changes nothing, statements survive quoting."""
+        self.assertEqual(self.merge(), (len(self.empire.index), []))
+        self.assertEqual(self.empire.changed_uids, {"OWASP_ASVS-V1.1.1": None})
+
+    def test_only_differences_are_applied(self) -> None:
+        """A dry run reports the edited rows, the merge applies only those."""
+        self.edit({"OWASP_ASVS-V1.1.1": ("checked", "New statement"), "OWASP_ASVS-V1.1.2": ("not_relevant", "")})
+        self.empire.changed_uids.clear()
+        expected = [("OWASP_ASVS-V1.1.1", "checked", "checked"), ("OWASP_ASVS-V1.1.2", "unchecked", "not_relevant")]
+        self.assertEqual(self.merge(dry_run=True), (len(self.empire.index) - 2, expected))
+        self.assertEqual(self.empire.index.controls["OWASP_ASVS-V1.1.2"].state, State.UNCHECKED)
+        self.assertEqual(self.merge(), (len(self.empire.index) - 2, expected))
+        self.assertEqual(list(self.empire.changed_uids), ["OWASP_ASVS-V1.1.1", "OWASP_ASVS-V1.1.2"])
+        self.assertEqual(self.empire.index.controls["OWASP_ASVS-V1.1.1"].statement, "New statement")
+        self.assertEqual(self.empire.index.controls["OWASP_ASVS-V1.1.2"].state, State.NOT_RELEVANT)
+
+
+if __name__ == '__main__':
+    unittest.main()
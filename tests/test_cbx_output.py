@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+"""Tests of the output of a project: reports, lists and exports."""
+
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import unittest
+
+from helpers import ProjectTestCase
+
+from app.cbx_batch import CSV_COLUMNS, LIST_FORMATS
+from app.cbx_control import CbxControlFilter, State
+from app.cbx_output import CbxOutput
+
+# The templates shipped with the tool
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates")
+
+
+class TestReport(ProjectTestCase):
+    """Rendering the html report of the synthetic project."""
+
+    def setUp(self) -> None:
+        """Load the project and copy the report template next to it, templates are loaded relative to the working directory."""
+        super().setUp()
+        self.empire = self.load()
+        self.output = CbxOutput(self.empire)
+        shutil.copytree(TEMPLATE_DIR, "templates")
+
+    def test_report(self) -> None:
+        """The report lists every control with its state and statement."""
+        self.empire.mark_control("OWASP_ASVS-V1.1.1", "checked", "Reviewed in ticket 42")
+        self.output.generate_html_report("templates/html_report.html", "report.html")
+        with open("report.html", "rt", encoding="utf-8") as fh:
+            html = fh.read()
+        for uid in self.empire.index.uids():
+            self.assertIn(uid, html)
+        self.assertIn("Reviewed in ticket 42", html)
+
+    def test_compressed_report(self) -> None:
+        """A .gz outfile is compressed and has the same content."""
+        self.output.generate_html_report("templates/html_report.html", "report.html")
+        self.output.generate_html_report("templates/html_report.html", "report.html.gz")
+        with gzip.open("report.html.gz", "rt", encoding="utf-8") as fh, open("report.html", "rt", encoding="utf-8") as plain:
+            self.assertEqual(fh.read(), plain.read())
+
+    def test_templates_are_cached(self) -> None:
+        """The compiled template is kept in the cache dir."""
+        with open("stats.txt", "wt", encoding="utf-8") as fh:
+            fh.write("{% for section in data.sections %}{{ section.manual_prefix }} {{ section.stats.get_total() }}\n{% endfor %}")
+        self.output.generate_html_report("stats.txt", "stats.out")
+        with open("stats.out", "rt", encoding="utf-8") as fh:
+            lines = fh.read().splitlines()
+        self.assertEqual(lines, [f"{section.manual_prefix} {section.stats.get_total()}" for section in self.empire.sections])
+        assert self.empire.cache_dir is not None
+        self.assertTrue(os.listdir(os.path.join(self.empire.cache_dir, "templates")))
+
+
+class TestControlList(ProjectTestCase):
+    """Listing the controls of the synthetic project in the list formats."""
+
+    def write(self, file_format: str, control_filter: CbxControlFilter | None = None, lazy: bool = False) -> tuple[int, str]:
+        """Write the control list.
+
+        :param file_format: One of LIST_FORMATS
+        :param control_filter: The conditions
+        :param lazy: Load the project lazily
+        :returns: The number of controls written and the output
+        """
+        out = io.StringIO(newline="")
+        written = CbxOutput(self.load(lazy=lazy)).write_control_list(out, file_format, control_filter)
+        return written, out.getvalue()
+
+    def test_formats(self) -> None:
+        """Every format lists all controls, the machine formats keep statements with tabs and line breaks in their record."""
+        empire = self.load()
+        empire.mark_control("OWASP_ASVS-V1.1.1", "checked", "tab\there\nnew line")
+        empire.database.save()
+        for file_format in LIST_FORMATS:
+            with self.subTest(file_format=file_format):
+                written, output = self.write(file_format)
+                self.assertEqual(written, len(empire.index))
+                if file_format == "tsv":
+                    lines = output.splitlines()
+                    self.assertEqual(lines[0].split("\t"), list(CSV_COLUMNS))
+                    self.assertEqual(len(lines), written + 1)
+                    self.assertIn("\tchecked\ttab\\there\\nnew line", output)
+                elif file_format == "jsonl":
+                    records = [json.loads(line) for line in output.splitlines()]
+                    self.assertEqual(records[0]["uid"], "OWASP_ASVS-V1.1.1")
+                    self.assertEqual(records[0]["statement"], "tab\there\nnew line")
+                elif file_format == "csv":
+                    rows = list(csv.DictReader(io.StringIO(output, newline="")))
+                    self.assertEqual(len(rows), written)
+                    self.assertEqual(rows[0]["statement"], "tab\there\nnew line")
+        with self.assertRaises(ValueError):
+            self.write("xml")
+
+    def test_filters(self) -> None:
+        """Only the matching controls are listed, a section condition loads only that section."""
+        empire = self.load()
+        control = next(control for control in empire.index.controls.values() if control.cwe and control.section_prefix == "OWASP_ASVS")
+        for control_filter, expected in ((CbxControlFilter(state="not_relevant"), [uid for uid, other in empire.index.controls.items() if other.state is State.NOT_RELEVANT]),
+                                         (CbxControlFilter(cwe=control.cwe[0]), [uid for uid, other in empire.index.controls.items() if control.cwe[0] in other.cwe]),
+                                         (CbxControlFilter(section_prefix="OWASP_MASVS"), empire.sections_by_prefix["OWASP_MASVS"].get_uids())):
+            with self.subTest(control_filter=control_filter.to_dict()):
+                _, output = self.write("jsonl", CbxControlFilter.from_dict(control_filter.to_dict()), lazy=True)
+                self.assertEqual([json.loads(line)["uid"] for line in output.splitlines()], expected)
+        lazy = self.load(lazy=True)
+        CbxOutput(lazy).write_control_list(io.StringIO(), "text", CbxControlFilter(section_prefix="OWASP_MASVS"))
+        self.assertEqual([str(section.manual_prefix) for section in lazy.sections if section.is_loaded()], ["OWASP_MASVS"])
+        with self.assertRaises(ValueError):
+            CbxControlFilter(state="done")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+"""Tests of the multi-project mode."""
+
+import contextlib
+import gzip
+import io
+import os
+import shutil
+import unittest
+
+from helpers import ProjectTestCase
+
+from app.cbx_control import State
+from app.cbx_portfolio import CbxPortfolio
+
+# The templates shipped with the tool
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates")
+
+
+class PortfolioTestCase(ProjectTestCase):
+    """Two projects on the catalogues of the synthetic project, listed in portfolio.toml."""
+
+    def setUp(self) -> None:
+        """Write a second project with its own database and the portfolio config."""
+        super().setUp()
+        with open(self.config_file, "rt", encoding="utf-8") as fh:
+            config = fh.read()
+        with open("product_b.toml", "wt", encoding="utf-8") as fh:
+            fh.write(config.replace('project = "Benchmark"', 'project = "Product B"').replace('"database.toml"', '"database_b.toml"'))
+        with open("portfolio.toml", "wt", encoding="utf-8") as fh:
+            fh.write(f'projects = ["{self.config_file}", "product_b.toml"]\n')
+        self.empire = self.load()
+        self.empire.mark_controls([("OWASP_ASVS-V1.1.1", "checked", "product a"), ("OWASP_ASVS-V1.1.2", "not_relevant", "")])
+        self.empire.database.save()
+
+    def load_portfolio(self) -> CbxPortfolio:
+        """Load the portfolio.
+
+        :returns: The portfolio with both projects
+        """
+        portfolio = CbxPortfolio()
+        with contextlib.redirect_stdout(io.StringIO()):
+            portfolio.load_config("portfolio.toml")
+        return portfolio
+
+
+class TestPortfolio(PortfolioTestCase):
+    """Sharing the catalogue between the projects."""
+
+    def test_projects_share_the_catalogue(self) -> None:
+        """The data files are loaded once, every project gets the statistics of a project loaded on its own."""
+        portfolio = self.load_portfolio()
+        self.assertEqual(len(portfolio.catalogues), 1)
+        first, second = portfolio.projects.values()
+        self.assertIs(first.index, second.index)
+        self.assertEqual(portfolio.activate(self.config_file).stats.counts, self.empire.stats.counts)
+        self.assertEqual(portfolio.activate("product_b.toml").stats.counts[State.CHECKED], 0)
+
+    def test_switching_keeps_the_states(self) -> None:
+        """Marks on the active project are kept when another project is activated."""
+        portfolio = self.load_portfolio()
+        product_b = portfolio.activate("product_b.toml")
+        self.assertEqual(product_b.index.controls["OWASP_ASVS-V1.1.1"].state, State.UNCHECKED)
+        product_b.mark_control("OWASP_ASVS-V1.1.3", "checked", "product b")
+        product_a = portfolio.activate(self.config_file)
+        self.assertEqual(product_a.index.controls["OWASP_ASVS-V1.1.1"].statement, "product a")
+        self.assertEqual(product_a.index.controls["OWASP_ASVS-V1.1.3"].state, State.UNCHECKED)
+        portfolio.activate("product_b.toml")
+        self.assertEqual(product_b.index.controls["OWASP_ASVS-V1.1.3"].statement, "product b")
+        self.assertEqual(product_b.index.controls["OWASP_ASVS-V1.1.1"].statement, None)
+
+    def test_print_stats(self) -> None:
+        """One row per project and its sections."""
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.load_portfolio().print_stats()
+        names = [line.split("\t")[0] for line in out.getvalue().splitlines()]
+        sections = [str(section.manual_prefix) for section in self.empire.sections]
+        expected = ["Name"]
+        for project in ("Benchmark", "Product B"):
+            expected += [project] + [f"{project}/{prefix}" for prefix in sections]
+        self.assertEqual(names, expected)
+
+
+class TestPortfolioReport(PortfolioTestCase):
+    """Rendering the reports of all projects and the index page."""
+
+    def setUp(self) -> None:
+        """Copy the report templates next to the projects, templates are loaded relative to the working directory."""
+        super().setUp()
+        shutil.copytree(TEMPLATE_DIR, "templates")
+
+    def render(self, outdir: str, workers: int, compress: bool = False) -> list[dict[str, object]]:
+        """Render the reports.
+
+        :param outdir: The directory to write the reports to
+        :param workers: Number of worker processes
+        :param compress: gzip the project reports
+        :returns: The project summaries
+        """
+        return self.load_portfolio().generate_html_reports("templates/html_report.html", outdir, "templates/html_portfolio.html", compress, workers)
+
+    def test_reports(self) -> None:
+        """Every project gets its own report with its states, the index page links them."""
+        summaries = self.render("reports", 1)
+        self.assertEqual([summary["link"] for summary in summaries], ["Benchmark.html", "Product_B.html"])
+        self.assertEqual(summaries[0]["counts"], {state.value: count for state, count in self.empire.stats.counts.items()})
+        with open("reports/Benchmark.html", "rt", encoding="utf-8") as fh:
+            self.assertIn("product a", fh.read())
+        with open("reports/Product_B.html", "rt", encoding="utf-8") as fh:
+            self.assertNotIn("product a", fh.read())
+        with open("reports/index.html", "rt", encoding="utf-8") as fh:
+            index = fh.read()
+        self.assertIn('href="Benchmark.html"', index)
+        self.assertIn('href="Product_B.html"', index)
+
+    def test_parallel_reports(self) -> None:
+        """Worker processes render the same reports, compressed if requested."""
+        self.render("serial", 1)
+        summaries = self.render("parallel", 2, compress=True)
+        self.assertEqual([summary["link"] for summary in summaries], ["Benchmark.html.gz", "Product_B.html.gz"])
+        for name in ("Benchmark", "Product_B"):
+            with gzip.open(f"parallel/{name}.html.gz", "rt", encoding="utf-8") as fh, open(f"serial/{name}.html", "rt", encoding="utf-8") as serial:
+                self.assertEqual(fh.read(), serial.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
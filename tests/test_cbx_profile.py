@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+"""Tests of the profiling instrumentation."""
+
+import io
+import json
+import threading
+import unittest
+
+from helpers import ProjectTestCase
+
+from app.cbx_profile import NULL_PHASE, PROFILER, CbxProfiler, profiled
+
+
+class TestProfiler(unittest.TestCase):
+    """Phases and counters of a profiler."""
+
+    def setUp(self) -> None:
+        """Create a disabled profiler."""
+        self.profiler = CbxProfiler()
+
+    def parse(self) -> None:
+        """Measure a parse phase."""
+        with self.profiler.phase("parse"):
+            pass
+
+    def test_disabled(self) -> None:
+        """Nothing is recorded before enabling."""
+        self.assertIs(self.profiler.phase("load"), NULL_PHASE)
+        self.profiler.count("marks")
+        self.assertEqual((self.profiler.phases, self.profiler.counts), ({}, {}))
+
+    def test_nested_phases(self) -> None:
+        """Nested phases are named by their path and accumulate calls, phases of other threads start at the top."""
+        self.profiler.enable()
+        with self.profiler.phase("load"):
+            for _ in range(2):
+                with self.profiler.phase("parse"):
+                    self.profiler.count("files", 2)
+        thread = threading.Thread(target=self.parse)
+        thread.start()
+        thread.join()
+        self.profiler.disable()
+        self.assertEqual({name: phase.calls for name, phase in self.profiler.phases.items()}, {"load": 1, "load/parse": 2, "parse": 1})
+        self.assertGreaterEqual(self.profiler.phases["load"].seconds, self.profiler.phases["load/parse"].seconds)
+        self.assertEqual(self.profiler.counts, {"files": 4})
+
+    def test_trace_memory(self) -> None:
+        """The peak memory of a phase is passed on to the enclosing phases."""
+        self.profiler.enable(trace_memory=True)
+        with self.profiler.phase("outer"):
+            with self.profiler.phase("allocate"):
+                data = bytearray(4_000_000)
+            del data
+        self.profiler.disable()
+        summary = self.profiler.to_dict()
+        peaks = {phase["name"]: phase["peak_traced_bytes"] for phase in summary["phases"]}
+        self.assertGreaterEqual(peaks["outer/allocate"], 4_000_000)
+        self.assertGreaterEqual(peaks["outer"], peaks["outer/allocate"])
+        self.assertGreaterEqual(summary["peak_traced_bytes"], peaks["outer"])
+
+    def test_summary(self) -> None:
+        """The text summary indents nested phases below their parent, the json summary holds the same phases."""
+        self.profiler.enable()
+        with self.profiler.phase("b"):
+            with self.profiler.phase("child"):
+                pass
+        with self.profiler.phase("a"):
+            pass
+        self.profiler.disable()
+        out = io.StringIO()
+        self.profiler.print_summary(out)
+        self.assertEqual([line.split()[0] for line in out.getvalue().splitlines()[2:]], ["b", "child", "a"])
+        self.assertTrue(out.getvalue().splitlines()[3].startswith("  child"))
+        out = io.StringIO()
+        self.profiler.print_summary(out, "json")
+        self.assertEqual([phase["name"] for phase in json.loads(out.getvalue())["phases"]], ["b", "b/child", "a"])
+
+
+class TestProfiledProject(ProjectTestCase):
+    """The instrumentation of the synthetic project on the global profiler."""
+
+    def setUp(self) -> None:
+        """Enable the global profiler, it is reset after the test."""
+        super().setUp()
+        self.addCleanup(PROFILER.__init__)
+        PROFILER.enable()
+
+    def test_load_and_mark(self) -> None:
+        """Loading and marking are measured and counted, profiled functions keep their name and result."""
+        empire = self.load()
+        self.assertTrue(empire.mark_control("OWASP_ASVS-V1.1.1", "checked", ""))
+        self.assertFalse(empire.mark_control("OWASP_ASVS-V9.9.9", "checked", ""))
+        PROFILER.disable()
+        self.assertIn("load_config/load_sections", PROFILER.phases)
+        self.assertEqual(PROFILER.counts["controls_loaded"], len(empire.index))
+        self.assertEqual((PROFILER.counts["marks_applied"], PROFILER.counts["uids_not_found"]), (1, 1))
+
+        @profiled("double")
+        def double(value: int) -> int:
+            return value * 2
+        self.assertEqual((double.__name__, double(2)), ("double", 4))
+        self.assertNotIn("double", PROFILER.phases)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+"""Tests of the project tag rules."""
+
+import contextlib
+import io
+import os
+import tomllib
+import unittest
+
+from helpers import ProjectTestCase
+
+from app.cbx_control import State
+from app.cbx_empire import TAG_STATEMENT
+from app.cbx_rules import DEFAULT_TAG_RULES_FILE, CbxRuleEngine, CbxTagRule, load_tag_rules
+
+
+class TestRules(unittest.TestCase):
+    """Matching UIDs with single rules and the compiled engine."""
+
+    def setUp(self) -> None:
+        """Compile an exact and a pattern rule."""
+        self.exact = CbxTagRule("login", ["S-V2.1.1", "S-V2.1.2 "], [])
+        self.pattern = CbxTagRule("iot", [], ["^OWASP_ISVS.*"])
+        self.engine = CbxRuleEngine([self.exact, self.pattern, CbxTagRule("rest", ["OWASP_ISVS-1"], [r"S-V13\.2\.\d"])])
+
+    def test_rule_matches(self) -> None:
+        """Listed UIDs are stripped, patterns are searched."""
+        self.assertTrue(self.exact.matches("S-V2.1.2"))
+        self.assertFalse(self.exact.matches("S-V2.1.3"))
+        self.assertTrue(self.pattern.matches("OWASP_ISVS-1.2"))
+        self.assertFalse(self.pattern.matches("OWASP_ASVS-1.2"))
+
+    def test_covers_section(self) -> None:
+        """Only literal prefix patterns cover a whole section."""
+        self.assertTrue(self.pattern.covers_section("OWASP_ISVS"))
+        self.assertFalse(self.pattern.covers_section("OWASP_ASVS"))
+        self.assertFalse(CbxTagRule("rest", [], ["^OWASP_ISVS-1.*"]).covers_section("OWASP_ISVS"))
+
+    def test_listed_uids(self) -> None:
+        """The exact UIDs of a section are found by its prefix."""
+        self.assertEqual(self.engine.get_listed_uids("OWASP_ISVS"), ["OWASP_ISVS-1"])
+        self.assertEqual(self.engine.get_listed_uids("OWASP"), [])
+
+    def test_engine_returns_all_tags(self) -> None:
+        """A UID matched by an exact rule and a pattern gets both tags."""
+        self.assertEqual(self.engine.match("OWASP_ISVS-1"), ["rest", "iot"])
+        self.assertEqual(self.engine.match("S-V13.2.1"), ["rest"])
+        self.assertEqual(self.engine.match("S-V2.1.2"), ["login"])
+        self.assertEqual(self.engine.match("S-V1.1.1"), [])
+
+    def test_section_tags(self) -> None:
+        """Only literal prefix patterns cover a whole section."""
+        self.assertEqual(self.engine.get_section_tags("OWASP_ISVS"), ["iot"])
+        self.assertEqual(self.engine.get_section_tags("OWASP_ASVS"), [])
+        self.assertEqual(CbxRuleEngine([CbxTagRule("rest", [], ["^OWASP_ISVS-1.*"])]).get_section_tags("OWASP_ISVS"), [])
+
+    def test_evaluate(self) -> None:
+        """Matches and per tag counts of a single pass."""
+        result = self.engine.evaluate(["S-V2.1.1", "OWASP_ISVS-2", "S-V1.1.1"])
+        self.assertEqual(result.matches, {"S-V2.1.1": ["login"], "OWASP_ISVS-2": ["iot"]})
+        self.assertEqual(result.counts, {"login": 1, "iot": 1, "rest": 0})
+        self.assertEqual(result.evaluated, 3)
+
+
+class TestLoadRules(unittest.TestCase):
+    """Reading the rules of the disabled tags from the config."""
+
+    def test_only_disabled_tags(self) -> None:
+        """Tags set to true or missing in the rule table create no rules."""
+        data = {"iot": {"patterns": ["^OWASP_ISVS.*"]}, "login": {"uids": ["S-V1"]}}
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            rules = load_tag_rules(data, {"iot": False, "login": True, "unknown": False})
+        self.assertEqual([rule.tag for rule in rules], ["iot"])
+        self.assertIn("No rule for project tag unknown", out.getvalue())
+
+    def test_defaults_without_table(self) -> None:
+        """Without a [tag_rules] table the built-in rules are used, an empty table has no rules. The built-in rules are the ones of config.toml."""
+        with open(DEFAULT_TAG_RULES_FILE, "rb") as fh:
+            defaults = tomllib.load(fh)["tag_rules"]
+        with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config.toml"), "rb") as fh:
+            self.assertEqual(tomllib.load(fh)["tag_rules"], defaults)
+        rules = load_tag_rules(None, {"mobile": False})
+        self.assertEqual([(rule.tag, [pattern.pattern for pattern in rule.patterns]) for rule in rules],
+                         [("mobile", defaults["mobile"]["patterns"])])
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(load_tag_rules({}, {"mobile": False}), [])
+
+
+class TestProjectTags(ProjectTestCase):
+    """Project tags of the synthetic project: iot and rest are false."""
+
+    def test_disabled_section(self) -> None:
+        """The iot rule covers the whole ISVS section, all its controls are not relevant."""
+        empire = self.load()
+        section = empire.sections_by_prefix["OWASP_ISVS"]
+        self.assertEqual(section.disabled_tags, ["iot"])
+        controls = [control for group in section.get_groups() for item in group.get_items() for control in item.get_controls()]
+        self.assertTrue(controls)
+        for control in controls:
+            self.assertEqual(control.state, State.NOT_RELEVANT)
+            self.assertEqual(control.statement, TAG_STATEMENT + "iot")
+        self.assertEqual(empire.tag_result.counts["iot"], len(controls))
+        control = empire.find_control_by_uid("OWASP_ASVS-V1.1.1")
+        assert control is not None
+        self.assertEqual(control.state, State.UNCHECKED)
+
+    def test_listed_uids_in_disabled_section(self) -> None:
+        """Controls of a disabled section listed by another rule get the tags of both rules, lazy sections are not loaded for it."""
+        with open(self.config_file, "rt", encoding="utf-8") as fh:
+            config = fh.read()
+        with open(self.config_file, "wt", encoding="utf-8") as fh:
+            fh.write(config.replace("[tag_rules.rest]\n", "[tag_rules.rest]\nuids = ['OWASP_ISVS-ISVS-0']\n"))
+        for lazy in (False, True):
+            with self.subTest(lazy=lazy):
+                empire = self.load(lazy=lazy)
+                section = empire.sections_by_prefix["OWASP_ISVS"]
+                self.assertEqual(section.is_loaded(), not lazy)
+                self.assertEqual(section.not_relevant_statement, TAG_STATEMENT + "iot" if lazy else None)
+                self.assertEqual(empire.index.find("OWASP_ISVS-ISVS-0") is None, lazy)
+                control = empire.find_control_by_uid("OWASP_ISVS-ISVS-0")
+                assert control is not None
+                self.assertEqual((control.state, control.statement), (State.NOT_RELEVANT, TAG_STATEMENT + "rest, iot"))
+                self.assertEqual(empire.tag_result.counts["iot"], section.stats.get_total())
+                control = empire.find_control_by_uid("OWASP_ISVS-ISVS-1")
+                assert control is not None
+                self.assertEqual(control.statement, TAG_STATEMENT + "iot")
+
+    def test_lazy_sections_get_the_rules(self) -> None:
+        """Rules are applied to a lazy section when it is loaded."""
+        empire = self.load(lazy=True)
+        self.assertFalse(empire.sections_by_prefix["OWASP_ISVS"].is_loaded())
+        control = empire.find_control_by_uid("OWASP_ISVS-ISVS-0")
+        assert control is not None
+        self.assertEqual(control.state, State.NOT_RELEVANT)
+
+
+if __name__ == '__main__':
+    unittest.main()
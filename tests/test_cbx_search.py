@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+"""Tests of the search index."""
+
+import unittest
+
+from helpers import ProjectTestCase
+
+from app.cbx_output import CbxOutput
+from app.cbx_search import CbxSearchIndex, tokenize
+
+
+class TestSearch(ProjectTestCase):
+    """Queries on the search index of a synthetic project."""
+
+    def setUp(self) -> None:
+        """Load the project and build its search index."""
+        super().setUp()
+        self.empire = self.load()
+        self.search_index = CbxOutput(self.empire).get_search_index()
+        self.uids = self.empire.index.uids()
+
+    def test_tokenize(self) -> None:
+        """Texts are split into lower case words."""
+        self.assertEqual(tokenize("Verify the TLS-Certificate, v2"), {"verify", "the", "tls", "certificate", "v2"})
+
+    def test_empty_query_returns_all(self) -> None:
+        """An empty query matches every control in catalogue order."""
+        self.assertEqual(self.search_index.search(""), self.uids)
+
+    def test_fields_match_controls(self) -> None:
+        """cwe, section, state and text terms return exactly the matching controls in catalogue order."""
+        control = next(control for control in self.empire.index.controls.values() if control.cwe)
+        cwe = control.cwe[0]
+        expected = [uid for uid, candidate in self.empire.index.controls.items() if cwe in candidate.cwe]
+        self.assertEqual(self.search_index.search(f"cwe:{cwe}"), expected)
+        self.assertEqual(self.search_index.search(f"cwe:CWE-{cwe}"), expected)
+        isvs = [uid for uid in self.uids if uid.startswith("OWASP_ISVS-")]
+        self.assertEqual(self.search_index.search("section:owasp_isvs"), isvs)
+        # The project tag iot sets the ISVS controls to not relevant
+        self.assertEqual(self.search_index.search("state:not_relevant section:OWASP_ISVS"), isvs)
+        word = sorted(tokenize(control.description))[0]
+        self.assertIn(control.get_uid(), self.search_index.search(word))
+        self.assertIn(control.get_uid(), self.search_index.search(f"text:{word[:2]}*"))
+
+    def test_alternatives_and_conjunction(self) -> None:
+        """Comma separated values match any of them, all terms have to match."""
+        both = self.search_index.search("section:OWASP_ISVS,OWASP_MASVS")
+        self.assertEqual(len(both), len(self.search_index.search("section:OWASP_ISVS")) + len(self.search_index.search("section:OWASP_MASVS")))
+        self.assertEqual(self.search_index.search("section:OWASP_ISVS section:OWASP_MASVS"), [])
+
+    def test_uid(self) -> None:
+        """A full UID returns that control, a prefix all controls starting with it, case insensitive."""
+        self.assertEqual(self.search_index.search("uid:OWASP_ASVS-V1.1.1"), ["OWASP_ASVS-V1.1.1"])
+        prefixed = [uid for uid in self.uids if uid.startswith("OWASP_ASVS-V1.1.")]
+        self.assertEqual(self.search_index.search("uid:owasp_asvs-v1.1."), prefixed)
+        self.assertEqual(self.search_index.search("uid:OWASP_IS"), [uid for uid in self.uids if uid.startswith("OWASP_ISVS-")])
+        self.assertEqual(self.search_index.search("uid:UNKNOWN-1"), [])
+
+    def test_statements_are_searched(self) -> None:
+        """Statements are indexed by index_states."""
+        self.empire.mark_control("OWASP_ASVS-V1.1.1", "checked", "Reviewed in ticket zebra")
+        self.search_index.index_states(self.empire.index)
+        self.assertEqual(self.search_index.search("zebra state:checked"), ["OWASP_ASVS-V1.1.1"])
+
+    def test_unknown_field(self) -> None:
+        """Unknown fields are refused."""
+        with self.assertRaises(ValueError):
+            self.search_index.search("color:red")
+
+    def test_cache_round_trip(self) -> None:
+        """The catalogue part of the index survives the cache file, a second load uses it."""
+        assert self.empire.cache_dir is not None
+        cache_file = CbxSearchIndex.get_cache_file(self.empire.cache_dir, self.empire.sections)
+        assert cache_file is not None
+        loaded = CbxSearchIndex.load(cache_file)
+        assert loaded is not None
+        self.assertEqual(loaded.uids, self.search_index.uids)
+        self.assertEqual(loaded.postings, self.search_index.postings)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+"""Tests of the daemon mode: the HTTP/JSON API of the server and its client."""
+
+import argparse
+import asyncio
+import contextlib
+import http.client
+import io
+import os
+import stat
+import threading
+import unittest
+
+from helpers import ProjectTestCase
+
+from app.cbx_client import TOKEN_HEADER, CbxApiError, CbxClient, read_token
+from app.cbx_control import State
+from app.cbx_server import CbxServer, is_loopback, remove_token, write_token
+from checkbox_empire import get_client
+
+
+class TestServerHelpers(ProjectTestCase):
+    """Listen addresses and token files."""
+
+    def test_is_loopback(self) -> None:
+        """Only addresses of this machine are accepted."""
+        self.assertEqual([is_loopback(host) for host in ("localhost", "127.0.0.1", "127.1.2.3", "::1")], [True] * 4)
+        self.assertEqual([is_loopback(host) for host in ("0.0.0.0", "::", "192.168.1.1", "example.org")], [False] * 4)
+        with self.assertRaises(ValueError):
+            CbxServer(self.config_file, host="0.0.0.0")
+
+    def test_token_file(self) -> None:
+        """The token file is readable only by the user and only removed by the session that wrote it."""
+        self.assertIsNone(read_token(".token"))
+        write_token(".token", "secret")
+        self.assertEqual(stat.S_IMODE(os.stat(".token").st_mode), 0o600)
+        self.assertEqual(read_token(".token"), "secret")
+        remove_token(".token", "other")
+        self.assertEqual(read_token(".token"), "secret")
+        remove_token(".token", "secret")
+        self.assertFalse(os.path.exists(".token"))
+
+
+class TestServer(ProjectTestCase):
+    """Requests to a server running on the synthetic project in a background event loop."""
+
+    def setUp(self) -> None:
+        """Load the project and start serving it on a free port."""
+        super().setUp()
+        self.server = CbxServer(self.config_file, token_file=".token")
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.server.empire = self.server.load()
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+        listener = asyncio.run_coroutine_threadsafe(asyncio.start_server(self.server.handle_connection, "127.0.0.1", 0), loop).result()
+        self.addCleanup(loop.close)
+        self.addCleanup(thread.join)
+        self.addCleanup(loop.call_soon_threadsafe, loop.stop)
+        self.addCleanup(lambda: asyncio.run_coroutine_threadsafe(self.close(listener), loop).result())
+        self.address = f"127.0.0.1:{listener.sockets[0].getsockname()[1]}"
+        self.client = CbxClient(self.address, self.server.token, timeout=10.0)
+
+    @staticmethod
+    async def close(listener: asyncio.AbstractServer) -> None:
+        """Stop listening.
+
+        :param listener: The listening server
+        """
+        listener.close()
+        await listener.wait_closed()
+
+    def status(self, method: str, path: str, headers: dict[str, str]) -> int:
+        """Send a request with the given headers.
+
+        :param method: GET or POST
+        :param path: The request path
+        :param headers: The request headers
+        :returns: The HTTP status of the answer
+        """
+        host, _, port = self.address.partition(":")
+        connection = http.client.HTTPConnection(host, int(port), timeout=10.0)
+        try:
+            connection.request(method, path, body=b"{}", headers=headers)
+            return connection.getresponse().status
+        finally:
+            connection.close()
+
+    def test_mark_and_read(self) -> None:
+        """Marks are visible to following requests, marks of another author than the one of the server are saved at once."""
+        self.assertTrue(self.client.is_running())
+        self.assertEqual(self.client.request("GET", "/ping")["controls"], len(self.server.empire.index))
+        self.assertEqual(self.client.request("GET", "/ping")["config"], os.path.abspath(self.config_file))
+        result = self.client.mark([("OWASP_ASVS-V1.1.1", "checked", "via api"), ("OWASP_ASVS-V9.9.9", "checked", "")], author="alice")
+        self.assertEqual((result["applied"], result["unknown_uids"]), (1, ["OWASP_ASVS-V9.9.9"]))
+        self.assertEqual(self.client.request("GET", "/controls/OWASP_ASVS-V1.1.1")["statement"], "via api")
+        self.assertEqual(self.client.request("GET", "/stats")["total"]["checked"], self.server.empire.stats.counts[State.CHECKED])
+        self.assertEqual([entry["author"] for entry in self.server.empire.database.get_history("OWASP_ASVS-V1.1.1")], ["alice"])
+
+    def test_marks_of_other_processes(self) -> None:
+        """States other processes save are visible to the next request, unsaved marks of the server keep their state."""
+        self.client.mark([("OWASP_ASVS-V1.1.2", "checked", "unsaved")])
+        other = self.load()
+        other.mark_controls([("OWASP_ASVS-V1.1.1", "not_relevant", "by cli"), ("OWASP_ASVS-V1.1.2", "not_relevant", "by cli")])
+        other.database.save()
+        self.assertEqual(self.client.request("GET", "/controls/OWASP_ASVS-V1.1.1")["statement"], "by cli")
+        self.assertEqual(self.client.request("GET", "/controls/OWASP_ASVS-V1.1.2")["statement"], "unsaved")
+        other.mark_control("OWASP_ASVS-V1.1.3", "checked", "compacted")
+        other.database.save()
+        other.database.compact()
+        self.assertEqual(self.client.request("GET", "/controls/OWASP_ASVS-V1.1.3")["statement"], "compacted")
+
+    def test_client_of_the_config(self) -> None:
+        """Commands only use a daemon serving their config file. The token file is relative to the config file, not the working directory."""
+        with open(self.config_file, "rt", encoding="utf-8") as fh:
+            config = f'server = "{self.address}"\nserver_token_file = ".token"\n' + fh.read()
+        with open(self.config_file, "wt", encoding="utf-8") as fh:
+            fh.write(config)
+        write_token(".token", self.server.token)
+        os.mkdir("work")
+        os.chdir("work")
+        self.assertIsNotNone(get_client(argparse.Namespace(config=os.path.join("..", os.path.basename(self.config_file)), no_server=False)))
+        # Another project configured with the same address and a copied token
+        os.mkdir("other")
+        with open(os.path.join("other", "config.toml"), "wt", encoding="utf-8") as fh:
+            fh.write(config)
+        write_token(os.path.join("other", ".token"), self.server.token)
+        self.assertIsNone(get_client(argparse.Namespace(config=os.path.join("other", "config.toml"), no_server=False)))
+
+    def test_errors(self) -> None:
+        """Unknown UIDs and routes, wrong methods and files outside of the working directory are rejected."""
+        for method, path, body, status in (("GET", "/controls/OWASP_ASVS-V9.9.9", None, 404), ("GET", "/nothing", None, 404),
+                                           ("GET", "/mark", None, 405), ("POST", "/export", {"csv_file": "../out.csv"}, 403),
+                                           ("POST", "/report", {}, 400)):
+            with self.subTest(path=path), self.assertRaises(CbxApiError) as error:
+                self.client.request(method, path, body)
+            self.assertEqual(error.exception.status, status)
+        self.assertFalse(os.path.exists(os.path.join(os.path.dirname(self.tmp_dir.name), "out.csv")))
+
+    def test_token_and_content_type(self) -> None:
+        """Requests without the session token or posts without JSON content type, like browser form posts, are refused."""
+        self.assertEqual(self.status("GET", "/ping", {}), 401)
+        self.assertEqual(self.status("GET", "/ping", {TOKEN_HEADER: "wrong"}), 401)
+        self.assertEqual(self.status("POST", "/save", {TOKEN_HEADER: self.server.token, "Content-Type": "text/plain"}), 415)
+        self.assertEqual(self.status("POST", "/save", {TOKEN_HEADER: self.server.token, "Content-Type": "application/json"}), 200)
+        # A client with the token of an old session does not fall back to writing the files the server holds
+        with self.assertRaises(CbxApiError) as error:
+            CbxClient(self.address, "wrong").is_running()
+        self.assertEqual(error.exception.status, 401)
+
+
+class TestServerSqlite(TestServer):
+    """The requests with the SQLite state backend."""
+
+    state_backend = "sqlite"
+
+
+if __name__ == '__main__':
+    unittest.main()
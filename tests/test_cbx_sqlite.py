@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+"""Tests of the SQLite state backend."""
+
+import contextlib
+import io
+import unittest
+from typing import Any
+
+from helpers import ProjectTestCase
+
+from app.cbx_control import State
+from app.cbx_empire import CbxEmpire
+from app.cbx_journal import CbxJournal
+from app.cbx_output import CbxOutput
+
+
+class TestSqlite(ProjectTestCase):
+    """States, history and queries of the synthetic project on the SQLite backend."""
+
+    state_backend = "sqlite"
+
+    def load(self, **kwargs: bool) -> CbxEmpire:
+        """Load the project and close its database after the test.
+
+        :param kwargs: Arguments of CbxEmpire.load_config
+        :returns: The loaded project
+        """
+        empire = super().load(**kwargs)
+        assert empire.database.sqlite is not None
+        self.addCleanup(empire.database.sqlite.close)
+        return empire
+
+    def query(self, empire: CbxEmpire, **kwargs: Any) -> str:
+        """Print a query.
+
+        :param empire: The project
+        :param kwargs: Arguments of CbxOutput.print_query
+        :returns: The printed lines
+        """
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            CbxOutput(empire).print_query(**kwargs)
+        return out.getvalue()
+
+    def test_save_and_load(self) -> None:
+        """Saved states are loaded again, every save is kept in the history."""
+        empire = self.load(lazy=True)
+        empire.author = "alice"
+        empire.mark_control("OWASP_ASVS-V1.1.1", "checked", "first")
+        empire.database.save()
+        empire.mark_control("OWASP_ASVS-V1.1.1", "not_relevant", "second")
+        empire.database.save()
+        reloaded = self.load()
+        self.assertEqual(reloaded.index.controls["OWASP_ASVS-V1.1.1"].state, State.NOT_RELEVANT)
+        self.assertEqual([(entry["statement"], entry["author"]) for entry in reloaded.database.get_history("OWASP_ASVS-V1.1.1")],
+                         [("first", "alice"), ("second", "alice")])
+
+    def test_query_syncs_a_fresh_database(self) -> None:
+        """A query on a database that never stored the controls loads and stores the sections first."""
+        empire = self.load(lazy=True, load_states=False)
+        output = self.query(empire, section_prefix="OWASP_ISVS")
+        self.assertEqual(len(output.splitlines()), len(empire.sections_by_prefix["OWASP_ISVS"].get_uids()))
+        # The states set by project tags are not stored, the query gets them from the rules
+        loaded = self.load()
+        self.assertEqual([line.split("\t")[0] for line in output.splitlines()],
+                         [f"[{loaded.index.controls[uid].state.name}] {uid}" for uid in loaded.sections_by_prefix["OWASP_ISVS"].get_uids()])
+        not_relevant = [uid for uid, control in loaded.index.controls.items() if control.state == State.NOT_RELEVANT]
+        self.assertTrue(not_relevant)
+        self.assertEqual([line.split("\t")[0] for line in self.query(empire, state="not_relevant").splitlines()],
+                         [f"[NOT_RELEVANT] {uid}" for uid in not_relevant])
+
+    def test_stored_states_win_over_project_tags(self) -> None:
+        """A control marked by hand keeps its stored state in queries, like when the project is loaded."""
+        loaded = self.load()
+        uid = next(uid for uid, control in loaded.index.controls.items() if control.state == State.NOT_RELEVANT)
+        loaded.mark_control(uid, "checked", "needed after all")
+        loaded.database.save()
+        empire = self.load(lazy=True, load_states=False)
+        self.assertIn(f"[CHECKED] {uid}\t  needed after all", self.query(empire, state="checked"))
+        self.assertNotIn(uid, self.query(empire, state="not_relevant"))
+
+    def test_query_skips_stored_sections(self) -> None:
+        """Sections whose data file did not change since they were stored are not loaded for a query."""
+        self.load()
+        empire = self.load(lazy=True, load_states=False)
+        self.assertEqual(empire.database.sync_query_tables(), 0)
+        self.assertFalse(any(section.is_loaded() for section in empire.sections))
+        control = next(control for control in self.load().index.controls.values() if control.cwe)
+        uid = control.get_uid()
+        self.assertIn(f"[UNCHECKED] {uid}\t  {control.description}", self.query(empire, section_prefix=control.section_prefix))
+        self.assertIn(uid, self.query(empire, cwe=control.cwe[0]))
+        self.assertFalse(any(section.is_loaded() for section in empire.sections))
+
+    def test_compact_writes_only_changed_rows(self) -> None:
+        """Compacting keeps the rows already stored and adds the states differing from unchecked, like the ones set by project tags."""
+        empire = self.load()
+        empire.author = "alice"
+        empire.mark_control("OWASP_ASVS-V1.1.1", "checked", "kept")
+        empire.database.save()
+        empire.author = "bob"
+        empire.database.compact()
+        assert empire.database.sqlite is not None
+        rows = dict(empire.database.sqlite.connection.execute("SELECT uid, author FROM states").fetchall())
+        self.assertEqual(rows.pop("OWASP_ASVS-V1.1.1"), "alice")
+        changed = [uid for uid, control in empire.index.controls.items()
+                   if uid != "OWASP_ASVS-V1.1.1" and (control.state != State.UNCHECKED or control.statement)]
+        self.assertEqual(sorted(rows), sorted(changed))
+        self.assertEqual(set(rows.values()), {"bob"})
+
+    def test_migrate(self) -> None:
+        """The states of the toml database and its journal are imported with their history. Only written rows are counted."""
+        CbxJournal("database.toml.journal").write([CbxJournal.create_entry("OWASP_ASVS-V1.1.1", "checked", "from toml", "alice")])
+        empire = self.load()
+        written = empire.database.migrate_toml_to_sqlite()
+        assert empire.database.sqlite is not None
+        self.assertEqual(written, empire.database.sqlite.connection.execute("SELECT COUNT(*) FROM states").fetchone()[0])
+        self.assertEqual(written, len([control for control in empire.index.controls.values() if control.state != State.UNCHECKED or control.statement]))
+        self.assertLess(written, len(empire.index))
+        reloaded = self.load()
+        self.assertEqual(reloaded.index.controls["OWASP_ASVS-V1.1.1"].statement, "from toml")
+        self.assertEqual(len(list(reloaded.database.get_history())), 1)
+        # Only the journal entries are written again
+        self.assertEqual(reloaded.database.migrate_toml_to_sqlite(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+"""Tests of the cold start of the command line tool."""
+
+import argparse
+import os
+import subprocess  # nosec
+import sys
+import unittest
+
+from helpers import ProjectTestCase
+
+from app.cbx_empire import read_config
+from checkbox_empire import get_client
+
+# The command line tool
+CLI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "checkbox_empire.py")
+
+# Dependencies only imported by the commands using them, see benchmarks/bench_startup.py
+HEAVY_MODULES = ("jinja2", "tomlkit", "yaml", "asyncio", "multiprocessing", "concurrent.futures", "sqlite3", "cProfile", "tracemalloc", "msgpack")
+
+
+class TestStartup(ProjectTestCase):
+    """Imports of a show command on the synthetic project."""
+
+    def get_imports(self, *arguments: str) -> list[str]:
+        """Run the tool in a new process.
+
+        :param arguments: The command and its arguments
+        :returns: The modules imported by the run
+        """
+        process = subprocess.run([sys.executable, "-X", "importtime", CLI, "--config", self.config_file, *arguments],  # nosec
+                                 capture_output=True, text=True, check=True)
+        return [line.split("|")[-1].strip() for line in process.stderr.splitlines() if line.startswith("import time:") and "cumulative" not in line]
+
+    def test_show_imports_no_heavy_modules(self) -> None:
+        """Showing an ASVS control does not import the dependencies of reports, exports, MASVS, the daemon or the sqlite backend."""
+        imports = self.get_imports("show", "OWASP_ASVS-V1.1.1")
+        self.assertIn("app.cbx_empire", imports)
+        self.assertEqual([name for name in imports if name.split(".")[0] in HEAVY_MODULES or name in HEAVY_MODULES], [])
+
+
+class TestServerProbe(ProjectTestCase):
+    """Checking for the serve daemon before loading a project."""
+
+    state_backend = "sqlite"
+
+    def test_config_is_parsed_once(self) -> None:
+        """The parsed config is reused until the file changes."""
+        data = read_config(self.config_file)
+        self.assertIs(read_config(self.config_file), data)
+        with open(self.config_file, "at", encoding="utf-8") as fh:
+            fh.write("\n# changed\n")
+        os.utime(self.config_file, ns=(0, os.stat(self.config_file).st_mtime_ns + 1))
+        self.assertIsNot(read_config(self.config_file), data)
+
+    def test_probe_does_not_open_the_database(self) -> None:
+        """Without a running daemon the command loads the project itself, the probe does not create the sqlite database."""
+        with open(self.config_file, "rt", encoding="utf-8") as fh:
+            config = fh.read()
+        with open(self.config_file, "wt", encoding="utf-8") as fh:
+            fh.write('server = "127.0.0.1:1"\n' + config)
+        self.assertEqual(read_config(self.config_file)["server"], "127.0.0.1:1")
+        self.assertIsNone(get_client(argparse.Namespace(config=self.config_file, no_server=False)))
+        self.assertFalse(os.path.exists(read_config(self.config_file)["database_file_sqlite"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+"""Tests of the compliance statistics."""
+
+import contextlib
+import io
+import unittest
+
+from helpers import ProjectTestCase
+
+from app.cbx_control import State
+from app.cbx_output import CbxOutput
+from app.cbx_stats import CbxStats
+
+
+class TestStats(unittest.TestCase):
+    """Counts passed on to the parent containers."""
+
+    def test_rollup(self) -> None:
+        """Added controls and state changes are counted in all parents."""
+        total = CbxStats()
+        section = CbxStats()
+        section.attach(total)
+        item = CbxStats()
+        item.add({State.UNCHECKED: 3})
+        item.attach(section)
+        item.change(State.UNCHECKED, State.CHECKED)
+        item.change(State.UNCHECKED, State.NOT_RELEVANT)
+        for stats in (item, section, total):
+            self.assertEqual(stats.counts, {State.UNCHECKED: 1, State.CHECKED: 1, State.NOT_RELEVANT: 1})
+        self.assertEqual(total.to_dict(), {"unchecked": 1, "checked": 1, "not_relevant": 1, "total": 3, "percent": 50.0})
+
+    def test_percent_without_relevant_controls(self) -> None:
+        """Containers without relevant controls are done."""
+        stats = CbxStats()
+        self.assertEqual(stats.get_percent(), 100.0)
+        stats.add({State.NOT_RELEVANT: 2})
+        self.assertEqual(stats.get_percent(), 100.0)
+
+
+class TestProjectStats(ProjectTestCase):
+    """The statistics of the synthetic project follow the states of its controls."""
+
+    def count(self, controls: object) -> dict[State, int]:
+        """Count the states of controls.
+
+        :param controls: The controls
+        :returns: Number of controls per state
+        """
+        counts = {state: 0 for state in State}
+        for control in controls:  # type: ignore
+            counts[control.state] += 1
+        return counts
+
+    def test_counts_match_the_controls(self) -> None:
+        """Loading, project tags, stored states and marks are all counted."""
+        stored = self.load()
+        stored.mark_control("OWASP_ASVS-V1.1.1", "checked", "")
+        stored.database.save()
+        empire = self.load()
+        empire.mark_controls([("OWASP_ASVS-V1.1.2", "not_relevant", ""), ("OWASP_MASVS-MASVS-G0-0", "checked", "")])
+        self.assertEqual(empire.stats.counts, self.count(empire.index.controls.values()))
+        for section in empire.sections:
+            self.assertEqual(section.stats.counts, self.count(control for uid, control in empire.index.controls.items()
+                                                              if uid.startswith(f"{section.manual_prefix}-")))
+            for group in section.get_groups():
+                self.assertEqual(group.stats.counts, self.count(control for item in group.get_items() for control in item.get_controls()))
+
+    def test_print_stats(self) -> None:
+        """One row per section and group and the total."""
+        empire = self.load()
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            CbxOutput(empire).print_stats("section")
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split("\t")[0] for line in lines], ["Name"] + [str(section.manual_prefix) for section in empire.sections] + ["Total"])
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            CbxOutput(empire).print_stats("group")
+        self.assertEqual(len(out.getvalue().splitlines()), len(lines) + sum(len(section.get_groups()) for section in empire.sections))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""Tests of the incremental JSON and YAML readers."""
+
+import io
+import json
+import unittest
+from typing import Any
+
+import yaml
+
+from app.cbx_stream import CbxJsonReader, CbxYamlReader, iter_json_arrays
+
+# Nested containers, escapes, unicode, numbers and literals
+DOCUMENT = {"name": 'Cat"alogue\\u00e9 ✓ \\\\', "version": 4.0125, "empty": {}, "none": [],
+            "Requirements": [{"Shortcode": "V1", "Items": [{"Shortcode": "V1.1", "Items": [{"Ordinal": 12345678901234567890, "CWE": [1, 2]}]},
+                                                           {"Shortcode": "V1.2", "Items": [{"Flag": True, "Other": None, "Ratio": -1.5e-10}]}]}],
+            "Items": ["top level"]}
+
+
+def walk_json(reader: CbxJsonReader) -> Any:
+    """Rebuild a document by walking it with the reader.
+
+    :param reader: The reader
+    :returns: The document
+    """
+    char = reader.peek()
+    if char == "{":
+        return {key: walk_json(reader) for key in reader.iter_object()}
+    if char == "[":
+        return [walk_json(reader) for _ in reader.iter_array()]
+    return reader.read_value()
+
+
+def walk_yaml(reader: CbxYamlReader) -> Any:
+    """Rebuild a document by walking it with the reader.
+
+    :param reader: The reader
+    :returns: The document
+    """
+    if reader.loader.check_event(yaml.MappingStartEvent):
+        return {key: walk_yaml(reader) for key in reader.iter_object()}
+    if reader.loader.check_event(yaml.SequenceStartEvent):
+        return [walk_yaml(reader) for _ in reader.iter_array()]
+    return reader.read_value()
+
+
+class TestJsonArrays(unittest.TestCase):
+    """Scanning for arrays by key."""
+
+    def test_items_in_document_order(self) -> None:
+        """Items of all arrays with the keys are found at any depth and across chunk borders, nested arrays stay in their item."""
+        text = json.dumps(DOCUMENT, indent=1)
+        expected = [("Requirements", DOCUMENT["Requirements"][0]), ("Items", "top level")]
+        for chunk_size in (1, 7, 100, 1 << 20):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(list(iter_json_arrays(io.StringIO(text), ["Requirements", "Items"], chunk_size)), expected)
+        self.assertEqual(len(list(iter_json_arrays(io.StringIO(text), ["Items"], 7))), 3)
+
+    def test_unterminated_array(self) -> None:
+        """A document cut inside an array is an error."""
+        with self.assertRaises(ValueError):
+            list(iter_json_arrays(io.StringIO('{"Items": [1, 2'), ["Items"]))
+
+
+class TestJsonReader(unittest.TestCase):
+    """Walking JSON documents."""
+
+    def test_walk(self) -> None:
+        """Walking gives the document json.load gives, with any chunk size and indentation."""
+        for indent in (None, 2):
+            text = json.dumps(DOCUMENT, indent=indent, ensure_ascii=indent is None)
+            for chunk_size in (1, 3, 64, 1 << 16):
+                with self.subTest(indent=indent, chunk_size=chunk_size):
+                    self.assertEqual(walk_json(CbxJsonReader(io.StringIO(text), chunk_size)), DOCUMENT)
+
+    def test_errors(self) -> None:
+        """Truncated documents and unexpected characters are errors."""
+        for text in ('{"a": [1, 2', '{"a" 1}', '[1 2]', '{1: 2}'):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                walk_json(CbxJsonReader(io.StringIO(text), 2))
+
+
+class TestYamlReader(unittest.TestCase):
+    """Walking YAML documents."""
+
+    def test_walk(self) -> None:
+        """Walking gives the document yaml.safe_load gives."""
+        text = yaml.safe_dump(DOCUMENT, allow_unicode=True)
+        reader = CbxYamlReader(io.StringIO(text))
+        self.addCleanup(reader.close)
+        self.assertEqual(walk_yaml(reader), yaml.safe_load(text))
+
+    def test_read_values(self) -> None:
+        """Values read at once resolve implicit types and aliases of anchors read before."""
+        text = "anchored: &shared {a: [1, yes, 2020-01-01, 1.5]}\nalias: *shared\nplain: ~\n"
+        reader = CbxYamlReader(io.StringIO(text))
+        self.addCleanup(reader.close)
+        self.assertEqual({key: reader.read_value() for key in reader.iter_object()}, yaml.safe_load(text))
+
+    def test_unexpected_event(self) -> None:
+        """Walking a scalar as mapping is an error."""
+        reader = CbxYamlReader(io.StringIO("just text\n"))
+        self.addCleanup(reader.close)
+        with self.assertRaises(ValueError):
+            list(reader.iter_object())
+
+
+if __name__ == '__main__':
+    unittest.main()
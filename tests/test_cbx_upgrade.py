@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+"""Tests of the catalogue upgrade matching."""
+
+import contextlib
+import csv
+import io
+import random
+import unittest
+
+from helpers import ProjectTestCase
+
+from benchmarks.generators import write_upgrade
+
+from app.cbx_empire import CbxEmpire
+from app.cbx_upgrade import ADDED, MAPPING_COLUMNS, REMOVED, CbxUpgrade, find_similar, normalize, similarity
+
+
+class TestSimilarity(unittest.TestCase):
+    """Comparing descriptions."""
+
+    def test_normalize(self) -> None:
+        """Case, punctuation and white space are ignored."""
+        self.assertEqual(normalize("Verify that  the App,\tuses TLS."), normalize("verify that the app uses tls"))
+
+    def test_similarity(self) -> None:
+        """Jaccard similarity of the word sets."""
+        self.assertEqual(similarity(frozenset("abc"), frozenset("abd")), 0.5)
+        self.assertEqual(similarity(frozenset(), frozenset()), 1.0)
+        self.assertEqual(similarity(frozenset("a"), frozenset("b")), 0.0)
+
+    def test_find_similar_finds_all_pairs(self) -> None:
+        """Prefix filtering finds the same pairs as comparing all pairs."""
+        rng = random.Random(1)
+        words = [f"w{number}" for number in range(30)]
+        old = [frozenset(rng.sample(words, rng.randint(1, 8))) for _ in range(60)]
+        new = [frozenset(rng.sample(words, rng.randint(1, 8))) for _ in range(60)]
+        for threshold in (0.3, 0.5, 0.8, 1.0):
+            expected = sorted((similarity(a, b), i, j) for i, a in enumerate(old) for j, b in enumerate(new) if similarity(a, b) >= threshold)
+            self.assertEqual(sorted(find_similar(old, new, threshold)), expected)
+
+    def test_min_similarity(self) -> None:
+        """The minimal similarity has to be above 0 and at most 1."""
+        for value in (0.0, 1.5):
+            with self.assertRaises(ValueError):
+                CbxUpgrade(value)
+
+
+class TestUpgrade(ProjectTestCase):
+    """Upgrading the synthetic project to a new version of its ASVS and WSTG catalogues."""
+
+    def setUp(self) -> None:
+        """Write the new catalogues and load both versions."""
+        super().setUp()
+        self.expected = write_upgrade(self.tmp_dir.name)
+        self.old = self.load()
+        self.new = CbxEmpire()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.new.load_config("config_upgrade.toml", load_states=False)
+        self.upgrade = CbxUpgrade().match_sections(self.old.sections, self.new.sections)
+
+    def test_mapping(self) -> None:
+        """Unchanged, moved and reworded controls get their new UID, the others are removed or added."""
+        mapping = self.upgrade.get_mapping()
+        self.assertEqual({uid: mapping.get(uid) for uid in self.expected}, self.expected)
+        counts = self.upgrade.get_counts()
+        self.assertEqual(counts[REMOVED], len(self.old.index) - len(mapping))
+        self.assertEqual(counts[ADDED], len(self.new.index) - len(mapping))
+
+    def test_states_are_carried_over(self) -> None:
+        """Stored states of matched controls are marked on their new UID, the states of removed controls are lost."""
+        removed = next(uid for uid in self.old.index.controls if uid.startswith("OWASP_ASVS") and uid not in self.expected)
+        moved = next(uid for uid, new_uid in self.expected.items() if uid != new_uid and uid.startswith("OWASP_ASVS"))
+        self.old.mark_controls([(removed, "checked", "lost"), (moved, "checked", "moved")])
+        self.old.database.save()
+        states = self.old.database.get_stored_states()
+        records = self.upgrade.get_records(states)
+        self.assertIn((self.expected[moved], "checked", "moved"), records)
+        self.assertNotIn("lost", [statement for _, _, statement in records])
+        self.assertEqual(self.new.mark_controls(records).unknown_uids, [])
+
+    def test_mapping_report(self) -> None:
+        """One CSV row per match."""
+        out = io.StringIO(newline="")
+        self.assertEqual(self.upgrade.write_mapping(out, {}), len(self.upgrade.matches))
+        rows = list(csv.reader(io.StringIO(out.getvalue(), newline="")))
+        self.assertEqual(tuple(rows[0]), MAPPING_COLUMNS)
+        self.assertEqual(len(rows), len(self.upgrade.matches) + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()